@@ -16,33 +16,62 @@ except KeyError:
 import streamlit as st
 import os
 import traceback
-from core.pdf_processor import process_pdfs
-from core.vector_store import get_vector_store, add_documents_to_store, get_retriever_with_filter, list_indexed_documents
-from core.qa_engine import get_qa_chain, query_rag
+from core.pdf_processor import PdfBytes, iter_process_pdfs, file_content_hash
+from core.vector_store import get_vector_store, add_documents_to_store, describe_store, finish_indexing, ingest_checkpoint_path, get_retriever_with_filter, list_indexed_documents, sync_sources, remove_source, index_fingerprint
+from core.qa_engine import get_qa_chain, stream_rag
+from core.answer_cache import get_answer_cache
+from core.shared_index import get_shared_index
+from core.context_packing import DEFAULT_TOKEN_BUDGET
+from core import telemetry
 
 # --- Configuration ---
-UPLOAD_DIR = "uploads" 
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Set PDF_QA_INDEX_DIR to keep the index on disk across restarts instead of in memory
+INDEX_DIR = os.environ.get("PDF_QA_INDEX_DIR")
+# The persistent index is shared by every session; PDF_QA_ALLOW_INDEX_WIPE=1 shows an admin
+# button that deletes all of its documents. A session reset never touches it.
+ALLOW_INDEX_WIPE = os.environ.get("PDF_QA_ALLOW_INDEX_WIPE") == "1"
+# "chroma" (default), "numpy" or "shared" (one NumPy index shared by all sessions, each document
+# stored once); PDF_QA_QUANTIZATION=int8|float16 enables the quantized NumPy search
+VECTOR_BACKEND = os.environ.get("PDF_QA_VECTOR_BACKEND", "chroma")
+QUANTIZATION = os.environ.get("PDF_QA_QUANTIZATION") or None
+# "dense" (default) or "hybrid" (BM25 + dense, fused with reciprocal rank fusion)
+RETRIEVAL_MODE = os.environ.get("PDF_QA_RETRIEVAL_MODE", "dense")
+# Prompt-token budget for the retrieved context (overlapping chunks merged, duplicates dropped); 0 disables packing
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("PDF_QA_CONTEXT_TOKENS", DEFAULT_TOKEN_BUDGET))
+# Set PDF_QA_SEMANTIC_CACHE=1 to also reuse answers for near-identical questions
+ANSWER_CACHE = get_answer_cache(semantic=os.environ.get("PDF_QA_SEMANTIC_CACHE") == "1")
+# Per-stage timing spans and counters (PDF_QA_TELEMETRY=0 turns them off); PDF_QA_TRACE_FILE also
+# appends every span to a JSON-lines file. Configured once per process, not on every rerun.
+if not telemetry.exporters():
+    TRACE_FILE = os.environ.get("PDF_QA_TRACE_FILE")
+    telemetry.configure(
+        enabled=os.environ.get("PDF_QA_TELEMETRY", "1") != "0",
+        exporters=[telemetry.InMemoryExporter()] + ([telemetry.JsonLinesExporter(TRACE_FILE)] if TRACE_FILE else []),
+    )
 
 # --- Helper Functions ---
 def initialize_services(api_key, clear_existing_data=False):
     """
-    Initializes IN-MEMORY vector store and other services.
+    Initializes the session's vector store (see PDF_QA_VECTOR_BACKEND) and other services.
     If clear_existing_data is True, it also clears session state related to docs and chat.
+    With INDEX_DIR set, the persistent index is opened instead and its documents are listed
+    right away; it is shared with other sessions, so it is never wiped here (see wipe_index).
     """
-    print(f"--- Initializing IN-MEMORY services. Clear existing data: {clear_existing_data} ---")
+    print(f"--- Initializing {'PERSISTENT' if INDEX_DIR else 'IN-MEMORY'} services. Clear existing data: {clear_existing_data} ---")
     
-    # Always create a new in-memory vector store instance
-    st.session_state.vector_store = get_vector_store(google_api_key=api_key)
+    # Always create a new vector store instance (the persistent index itself is shared)
+    st.session_state.vector_store = get_vector_store(
+        google_api_key=api_key, persist_directory=INDEX_DIR, backend=VECTOR_BACKEND, quantization=QUANTIZATION
+    )
     st.session_state.current_api_key_for_store = api_key
     
     if clear_existing_data:
         print("--- Clearing existing session data: indexed_documents and messages ---")
-        st.session_state.indexed_documents = []
+        st.session_state.indexed_documents = list_indexed_documents(st.session_state.vector_store) if INDEX_DIR else []
         st.session_state.messages = []
-        st.info("In-memory vector store re-initialized for the session.")
+        st.info("Vector store re-initialized for the session.")
     else:
-        st.info("In-memory vector store initialized for the session.")
+        st.info("Vector store initialized for the session.")
     
     # Ensure these lists exist if they were cleared or never created
     if "indexed_documents" not in st.session_state:
@@ -50,18 +79,27 @@ def initialize_services(api_key, clear_existing_data=False):
     if "messages" not in st.session_state:
         st.session_state.messages = []
     
+def wipe_index():
+    """Admin action: deletes every document in the shared persistent index, for all sessions."""
+    print(f"--- Wiping the persistent index at {INDEX_DIR} ---")
+    st.session_state.vector_store.index.clear()
+    st.session_state.indexed_documents = []
+    st.session_state.messages = []
+
 def get_current_retriever(selected_docs=None):
     if "vector_store" not in st.session_state:
         st.error("Vector store not initialized. Please ensure API key is set.")
         return None
-    return get_retriever_with_filter(st.session_state.vector_store, selected_docs)
+    return get_retriever_with_filter(
+        st.session_state.vector_store, selected_docs, mode=RETRIEVAL_MODE, token_budget=CONTEXT_TOKEN_BUDGET
+    )
 
 # --- Streamlit UI ---
 st.set_page_config(page_title="Chat with Your PDFs by Priyansh Saxena", layout="wide")
 
 st.title("💬 Chat with Your PDFs")
 st.markdown("### _A Project by Priyansh Saxena_") 
-st.markdown("_(Powered by Google Gemini - In-Memory DB)_")
+st.markdown(f"_(Powered by Google Gemini - {'Persistent' if INDEX_DIR else 'In-Memory'} DB)_")
 
 # --- API Key Input & Service Initialization ---
 st.sidebar.header("Configuration")
@@ -86,7 +124,7 @@ if not google_api_key:
 if "services_initialized" not in st.session_state or \
    st.session_state.get("current_api_key") != google_api_key:
     print("--- First time service initialization or API key change ---")
-    with st.spinner("Initializing services (in-memory)..."):
+    with st.spinner(f"Initializing services ({'persistent' if INDEX_DIR else 'in-memory'})..."):
         initialize_services(google_api_key, clear_existing_data=True) # Clear data on first init or key change
         st.session_state.services_initialized = True
         st.session_state.current_api_key = google_api_key
@@ -101,7 +139,7 @@ else:
 
 # --- PDF Upload and Processing ---
 st.sidebar.header("Upload & Process PDFs")
-st.sidebar.info("PDFs are processed for the current session (in-memory database).")
+st.sidebar.info(f"PDFs are processed for the current session ({'persistent' if INDEX_DIR else 'in-memory'} database).")
 uploaded_files = st.sidebar.file_uploader(
     "Upload one or more PDF files", type="pdf", accept_multiple_files=True, key="pdf_uploader"
 )
@@ -111,45 +149,57 @@ if st.sidebar.button("Process Uploaded PDFs", key="process_button"):
         if not google_api_key: # Should be caught by now
             st.error("Please ensure your Google API Key is set.")
         else:
-            temp_file_paths = []
-            os.makedirs(UPLOAD_DIR, exist_ok=True)
-            for uploaded_file in uploaded_files:
-                # Use a more unique temp name to avoid clashes if same filename uploaded in different sessions (though UPLOAD_DIR should be session-specific on cloud)
-                # For local or less isolated envs, this helps.
-                # unique_name = f"{uuid.uuid4()}_{uploaded_file.name}" 
-                # temp_file_path = os.path.join(UPLOAD_DIR, unique_name)
-                temp_file_path = os.path.join(UPLOAD_DIR, uploaded_file.name) # Keeping it simple for now
-                with open(temp_file_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                temp_file_paths.append(temp_file_path)
-
-            if temp_file_paths:
+            # Uploads are extracted straight from their in-memory buffers: no temp files, so
+            # same-named uploads from different sessions cannot overwrite each other
+            pdf_uploads = [PdfBytes(uploaded_file.name, uploaded_file.getbuffer()) for uploaded_file in uploaded_files]
+
+            if pdf_uploads:
                 with st.spinner("Processing PDFs for this session..."):
                     try:
-                        # With in-memory, vector_store should always be present after initial service init.
-                        # If we want to *replace* existing processed docs, we need to re-init the store.
-                        print("--- Processing PDFs: Re-initializing in-memory vector store for new batch ---")
-                        initialize_services(google_api_key, clear_existing_data=True) # This will create a new empty vector_store and clear indexed_docs
-
-                        chunks = process_pdfs(temp_file_paths)
-                        if chunks:
-                            print(f"--- Attempting to add {len(chunks)} chunks to IN-MEMORY vector store ---")
-                            add_documents_to_store(st.session_state.vector_store, chunks)
-                            st.success(f"Successfully processed and indexed {len(uploaded_files)} PDF(s) for this session.")
-                            # list_indexed_documents should now reflect only the newly processed docs
-                            st.session_state.indexed_documents = list_indexed_documents(st.session_state.vector_store)
-                            # Messages were already cleared by initialize_services if clear_existing_data=True
-                            st.info("Chat history cleared as new documents were processed for this session.")
-                        else:
+                        # Incremental indexing: files already indexed with identical content are skipped,
+                        # changed files replace their old chunks, and only new content gets embedded.
+                        source_hashes = {pdf.name: file_content_hash(pdf) for pdf in pdf_uploads}
+                        sources_to_index, unchanged_sources = sync_sources(st.session_state.vector_store, source_hashes)
+                        pdfs_to_index = [pdf for pdf in pdf_uploads if pdf.name in sources_to_index]
+                        print(f"--- Processing PDFs incrementally: {len(pdfs_to_index)} to index, {len(unchanged_sources)} unchanged ---")
+
+                        # Batches stream out page range by page range, so indexing starts while
+                        # later pages are still being extracted.
+                        total_chunks = 0
+                        file_errors = []
+                        for batch in iter_process_pdfs(pdfs_to_index):
+                            file_errors.extend(batch.errors)
+                            if batch.chunks:
+                                print(f"--- Attempting to add {len(batch.chunks)} chunks from {batch.source} pages {batch.page_range} to the {describe_store(st.session_state.vector_store)} ---")
+                                # A failed upload resumes from its checkpoint: sync_sources keeps offering
+                                # the file for indexing until finish_indexing marks it complete
+                                add_documents_to_store(
+                                    st.session_state.vector_store,
+                                    batch.chunks,
+                                    ids=[chunk.metadata["chunk_id"] for chunk in batch.chunks],
+                                    checkpoint_path=ingest_checkpoint_path(
+                                        st.session_state.vector_store, batch.source, batch.doc_hash, batch.page_range
+                                    ),
+                                )
+                                total_chunks += len(batch.chunks)
+                        failed_sources = {file_error.source for file_error in file_errors}
+                        finish_indexing(
+                            st.session_state.vector_store,
+                            {source: source_hashes[source] for source in sources_to_index if source not in failed_sources},
+                        )
+                        for file_error in file_errors:
+                            st.warning(f"Could not process {file_error.source}: {file_error.error}")
+                        if unchanged_sources:
+                            st.info(f"Already indexed and unchanged, skipped: {', '.join(unchanged_sources)}")
+                        if total_chunks:
+                            st.success(f"Successfully processed and indexed {len(pdfs_to_index)} PDF(s) for this session.")
+                        elif pdfs_to_index:
                             st.warning("No text could be extracted or chunked from the PDFs.")
+                        st.session_state.indexed_documents = list_indexed_documents(st.session_state.vector_store)
                     except Exception as e:
                         st.error(f"An error occurred during PDF processing: {e}")
                         print(f"--- FULL TRACEBACK FOR PDF PROCESSING ERROR (IN-MEMORY) ---")
                         traceback.print_exc()
-                    finally:
-                        for path in temp_file_paths:
-                            if os.path.exists(path):
-                                os.remove(path)
             st.rerun() # Rerun to update UI, especially the indexed documents list
     else:
         st.sidebar.warning("Please upload PDF files first.")
@@ -168,6 +218,11 @@ if current_indexed_docs:
         default=[], 
         key="doc_selector_sidebar_mem"
     )
+    if selected_documents_for_query and st.sidebar.button("Remove selected document(s) from index", key="remove_docs_button"):
+        for source in selected_documents_for_query:
+            remove_source(st.session_state.vector_store, source)
+        st.session_state.indexed_documents = list_indexed_documents(st.session_state.vector_store)
+        st.rerun()
 else:
     st.sidebar.info("No documents processed for this session yet.")
     selected_documents_for_query = []
@@ -198,19 +253,42 @@ if prompt := st.chat_input("Ask a question about the processed PDFs..."):
     with st.chat_message("assistant"):
         message_placeholder = st.empty()
         message_placeholder.markdown("Thinking...")
+        sources_container = st.container()
         try:
             current_retriever = get_current_retriever(selected_documents_for_query)
             if current_retriever:
                 qa_chain_instance = get_qa_chain(google_api_key, current_retriever)
-                answer, sources_text = query_rag(qa_chain_instance, prompt)
-                
-                full_response_content = answer
+                # Tokens are rendered as they arrive; sources show as soon as retrieval is done
+                full_response_content, sources_text, timings = "", "", {}
+                for event, payload in stream_rag(
+                    qa_chain_instance,
+                    prompt,
+                    answer_cache=ANSWER_CACHE,
+                    fingerprint=index_fingerprint(st.session_state.vector_store),
+                    sources_filter=selected_documents_for_query,
+                    embeddings=st.session_state.vector_store.embeddings,
+                ):
+                    if event == "sources":
+                        sources_text = payload
+                        with sources_container.expander("Sources", expanded=True):
+                            st.text_area("", value=sources_text, height=100, disabled=True, key=f"sources_current_{len(st.session_state.messages)}")
+                    elif event == "token":
+                        full_response_content += payload
+                        message_placeholder.markdown(full_response_content + "▌")
+                    elif event == "error":
+                        full_response_content = payload
+                    elif event == "done":
+                        timings = payload
+
                 message_placeholder.markdown(full_response_content)
+                if timings.get("total_ms") is not None:
+                    first_token = f"{timings['ttft_ms']:.0f} ms" if timings.get("ttft_ms") is not None else "n/a"
+                    st.caption(
+                        f"First token: {first_token} · Total: {timings['total_ms']:.0f} ms"
+                        + (f" · ~{timings['prompt_tokens_saved']} prompt tokens saved" if timings.get("prompt_tokens_saved") else "")
+                        + (" · cached" if timings.get("cached") else "")
+                    )
 
-                if sources_text:
-                    with st.expander("Sources", expanded=True):
-                         st.text_area("", value=sources_text, height=100, disabled=True, key=f"sources_current_{len(st.session_state.messages)}")
-                
                 st.session_state.messages.append({
                     "role": "assistant", 
                     "content": full_response_content,
@@ -229,13 +307,50 @@ if prompt := st.chat_input("Ask a question about the processed PDFs..."):
 
 # --- Admin / DB Reset (Optional) ---
 st.sidebar.markdown("---")
-if st.sidebar.button("⚠️ Reset Session Data (Clears In-Memory DB & Chat)", key="reset_session_button"):
+answer_cache_stats = ANSWER_CACHE.stats()
+st.sidebar.caption(
+    f"Answer cache: {answer_cache_stats['hit_rate']:.0%} hit rate "
+    f"({answer_cache_stats['exact_hits']} exact, {answer_cache_stats['semantic_hits']} semantic, {answer_cache_stats['misses']} misses)"
+)
+if telemetry.is_enabled():
+    with st.sidebar.expander("Performance (recent per-stage latency)", expanded=False):
+        stage_stats = telemetry.stage_percentiles()
+        if stage_stats:
+            st.table([
+                {
+                    "stage": stage,
+                    "count": stats["count"],
+                    "p50 ms": f"{stats['p50_ms']:.1f}",
+                    "p95 ms": f"{stats['p95_ms']:.1f}",
+                    "p99 ms": f"{stats['p99_ms']:.1f}",
+                }
+                for stage, stats in stage_stats.items()
+            ])
+            st.caption(" · ".join(f"{name}: {value:,.0f}" for name, value in sorted(telemetry.counters().items())))
+        else:
+            st.caption("No timings recorded yet.")
+if VECTOR_BACKEND == "shared" and not INDEX_DIR:
+    shared_stats = get_shared_index().stats()
+    st.sidebar.caption(
+        f"Shared index: {shared_stats['documents']} document(s), {shared_stats['referenced_documents']} in use, "
+        f"{shared_stats['bytes'] / 2**20:.1f} / {shared_stats['max_bytes'] / 2**20:.0f} MB, {shared_stats['evictions']} evicted"
+    )
+if st.sidebar.button(f"⚠️ Reset Session Data (Clears {'Chat' if INDEX_DIR else 'In-Memory DB & Chat'})", key="reset_session_button"):
     if google_api_key: 
         print("--- Reset Session Data button clicked ---")
         with st.spinner("Resetting session data..."):
             initialize_services(google_api_key, clear_existing_data=True) 
             # indexed_documents and messages are cleared within initialize_services now
-        st.sidebar.success("Session data (in-memory DB, processed PDFs, chat) has been reset.")
+        st.sidebar.success("Session data (processed PDFs, chat) has been reset.")
         st.rerun() # Rerun to reflect the cleared state in the UI immediately
     else:
         st.sidebar.error("Please provide Google API key before resetting.")
+if INDEX_DIR and ALLOW_INDEX_WIPE:
+    with st.sidebar.expander("Admin: persistent index", expanded=False):
+        st.caption(f"Deletes every document in {INDEX_DIR} for all sessions, not just this one.")
+        confirm_wipe = st.checkbox("I understand this cannot be undone", key="confirm_index_wipe")
+        if st.button("Delete all indexed documents", key="wipe_index_button", disabled=not confirm_wipe):
+            with st.spinner("Deleting every document in the persistent index..."):
+                wipe_index()
+            st.sidebar.success("Persistent index wiped.")
+            st.rerun()
@@ -0,0 +1,62 @@
+# benchmarks/corpus.py
+"""Deterministic synthetic PDF corpora for the benchmarks."""
+import os
+import random
+
+WORDS = [
+    "pressure", "valve", "assembly", "torque", "inspection", "warranty", "clause", "module", "sensor",
+    "calibration", "procedure", "safety", "limit", "operator", "maintenance", "interval", "fault", "code",
+]
+
+
+def page_text(rng, chars_per_page, page_number):
+    """Filler prose with an error code every ~40 words, so lexical queries have exact targets."""
+    words, size = [f"Page {page_number + 1}."], 0
+    while size < chars_per_page:
+        word = f"ERR-{rng.randint(1000, 9999)}" if rng.random() < 0.025 else rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+def make_pdf(path, pages, chars_per_page=2500, seed=0):
+    """Writes a synthetic text PDF with `pages` pages of about `chars_per_page` characters each."""
+    import fitz
+    rng = random.Random(seed)
+    pdf = fitz.open()
+    for page_number in range(pages):
+        page = pdf.new_page()
+        page.insert_textbox(fitz.Rect(36, 36, 576, 806), page_text(rng, chars_per_page, page_number), fontsize=7)
+    pdf.save(path, garbage=3, deflate=True)
+    pdf.close()
+
+
+def make_corpus(directory, documents, pages_per_document, chars_per_page=2500, seed=0):
+    """
+    Writes `documents` PDFs into `directory` (reusing files already there, since generation is
+    deterministic) and returns their paths in order.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(documents):
+        path = os.path.join(directory, f"doc-{i:04d}-{pages_per_document}p-{chars_per_page}c-s{seed}.pdf")
+        if not os.path.exists(path):
+            make_pdf(f"{path}.tmp", pages_per_document, chars_per_page=chars_per_page, seed=seed * 100003 + i)
+            os.replace(f"{path}.tmp", path)
+        paths.append(path)
+    return paths
+
+
+def make_questions(count, seed=0):
+    """Questions mixing prose and error codes, in a fixed order."""
+    rng = random.Random(seed)
+    templates = [
+        "What is the {a} {b} for the {c}?",
+        "How often should the {a} {b} be checked?",
+        "What does fault code ERR-{n} mean?",
+        "Which {a} procedure applies after {b} {c}?",
+    ]
+    return [
+        rng.choice(templates).format(a=rng.choice(WORDS), b=rng.choice(WORDS), c=rng.choice(WORDS), n=rng.randint(1000, 9999))
+        for _ in range(count)
+    ]
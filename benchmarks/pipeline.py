@@ -0,0 +1,229 @@
+# benchmarks/pipeline.py
+"""
+Offline ingest + query benchmark over synthetic corpora of growing size. Runs the real
+extraction, chunking, indexing, retrieval and context-packing code; only the Gemini models are
+replaced by the deterministic fakes in core.fakes, with configurable latency.
+
+For every corpus size (in a fresh subprocess, so peak RSS is per size) it reports pages/sec,
+chunks/sec, peak RSS of the main process and of the largest extraction worker, p50/p95/p99 end-to-end query latency and time to first token, and the
+per-stage percentiles from core.telemetry. Results are written as JSON so runs can be compared.
+
+    python -m benchmarks.pipeline --documents 4,16,64 --pages-per-document 25
+    python -m benchmarks.pipeline --baseline benchmarks/results/<earlier run>.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+import numpy as np
+from benchmarks.corpus import make_corpus, make_questions
+
+DEFAULT_RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DEFAULT_CORPUS_DIR = os.path.join(tempfile.gettempdir(), "pdf-qa-bench-corpus")
+
+def _percentiles(values_ms):
+    if not values_ms:
+        return {}
+    p50, p95, p99 = np.percentile(np.asarray(values_ms), [50, 95, 99])
+    return {"p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2)}
+
+
+def _make_store(backend, embeddings, quantization):
+    from core.numpy_store import NumpyVectorStore
+    if backend == "numpy":
+        return NumpyVectorStore(embeddings, quantization=quantization)
+    if backend == "shared":
+        from core.shared_index import SharedDocumentIndex
+        return SharedDocumentIndex(quantization=quantization).session_view(embeddings)
+    if backend == "chroma":
+        from langchain_community.vectorstores import Chroma
+        return Chroma(collection_name=f"bench-{uuid.uuid4().hex[:8]}", embedding_function=embeddings)
+    raise ValueError(f"Unknown backend {backend!r}")
+
+
+def run_size(paths, params):
+    """Ingests `paths` and runs the query workload in this process. Returns one result dict."""
+    from core import telemetry
+    from core.fakes import FlakyFakeEmbeddings, FakeStreamingChatModel
+    from core.pdf_processor import iter_process_pdfs
+    from core.qa_engine import get_qa_chain, stream_rag
+    from core.vector_store import add_documents_to_store, finish_indexing, get_retriever_with_filter
+
+    telemetry.configure()
+    embeddings = FlakyFakeEmbeddings(size=params["dim"], latency=params["embed_latency"])
+    store = _make_store(params["backend"], embeddings, params["quantization"])
+
+    started = time.perf_counter()
+    batches = list(iter_process_pdfs(paths, max_workers=params["workers"]))
+    extract_seconds = time.perf_counter() - started
+    pages = sum(b.page_range[1] - b.page_range[0] for b in batches)
+    chunks = [chunk for b in batches for chunk in b.chunks]
+
+    started = time.perf_counter()
+    add_documents_to_store(
+        store,
+        chunks,
+        ids=[c.metadata["chunk_id"] for c in chunks],
+        batch_size=params["batch_size"],
+        max_in_flight=params["max_in_flight"],
+    )
+    finish_indexing(store, {b.source: b.doc_hash for b in batches})
+    index_seconds = time.perf_counter() - started
+
+    llm = FakeStreamingChatModel(
+        answer_words=params["answer_words"],
+        first_token_latency=params["llm_first_token_latency"],
+        token_latency=params["llm_token_latency"],
+    )
+    total_ms, ttft_ms, tokens_saved = [], [], []
+    for question in make_questions(params["queries"], seed=params["seed"]):
+        retriever = get_retriever_with_filter(
+            store, None, k_results=params["k"], mode=params["mode"], token_budget=params["token_budget"]
+        )
+        timings = {}
+        for event, payload in stream_rag(get_qa_chain(None, retriever, llm=llm), question):
+            if event == "done":
+                timings = payload
+        total_ms.append(timings["total_ms"])
+        if timings.get("ttft_ms") is not None:
+            ttft_ms.append(timings["ttft_ms"])
+        tokens_saved.append(timings.get("prompt_tokens_saved", 0))
+
+    return {
+        "documents": len(paths),
+        "pages": pages,
+        "chunks": len(chunks),
+        "extract_seconds": round(extract_seconds, 3),
+        "pages_per_sec": round(pages / extract_seconds, 1) if extract_seconds else None,
+        "index_seconds": round(index_seconds, 3),
+        "chunks_per_sec": round(len(chunks) / index_seconds, 1) if index_seconds else None,
+        "query_latency": _percentiles(total_ms),
+        "time_to_first_token": _percentiles(ttft_ms),
+        "mean_prompt_tokens_saved": round(float(np.mean(tokens_saved)), 1) if tokens_saved else 0.0,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), # KB on Linux
+        # Extraction runs in the process pool; this is the largest worker's peak (0 when run inline)
+        "peak_worker_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        "stages": {name: {k: round(v, 3) for k, v in stats.items()} for name, stats in telemetry.stage_percentiles().items()},
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline):
+    """Per-size relative change of the headline metrics vs an earlier run, e.g. {"pages_per_sec": -0.08}."""
+    by_size = {(r["documents"], r["pages"]): r for r in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        old = by_size.get((result["documents"], result["pages"]))
+        if old is None:
+            continue
+        row = {"documents": result["documents"], "pages": result["pages"]}
+        for metric in ("pages_per_sec", "chunks_per_sec", "peak_rss_mb", "peak_worker_rss_mb"):
+            if old.get(metric):
+                row[metric] = round(result[metric] / old[metric] - 1, 3)
+        for metric in ("query_latency", "time_to_first_token"):
+            if old.get(metric, {}).get("p95_ms"):
+                row[f"{metric}_p95"] = round(result[metric]["p95_ms"] / old[metric]["p95_ms"] - 1, 3)
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", default="4,16,64", help="Comma-separated corpus sizes, in documents")
+    parser.add_argument("--pages-per-document", type=int, default=25)
+    parser.add_argument("--chars-per-page", type=int, default=2500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus-dir", default=DEFAULT_CORPUS_DIR, help="Generated PDFs are cached here")
+    parser.add_argument("--backend", choices=("numpy", "shared", "chroma"), default="numpy")
+    parser.add_argument("--quantization", choices=("int8", "float16"), default=None)
+    parser.add_argument("--mode", choices=("dense", "hybrid"), default="dense")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes (default: all CPUs)")
+    parser.add_argument("--dim", type=int, default=256, help="Fake embedding size")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per fake embedding call")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--token-budget", type=int, default=3000, help="0 disables context packing")
+    parser.add_argument("--answer-words", type=int, default=60)
+    parser.add_argument("--llm-first-token-latency", type=float, default=0.3)
+    parser.add_argument("--llm-token-latency", type=float, default=0.005)
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/pipeline-<UTC time>.json)")
+    parser.add_argument("--baseline", help="Earlier result file to compare against")
+    parser.add_argument("--run-size", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    params = {
+        key: getattr(args, key)
+        for key in (
+            "pages_per_document", "chars_per_page", "seed", "backend", "quantization", "mode", "workers", "dim",
+            "embed_latency", "batch_size", "max_in_flight", "queries", "k", "token_budget", "answer_words",
+            "llm_first_token_latency", "llm_token_latency",
+        )
+    }
+
+    if args.run_size:
+        paths = make_corpus(args.corpus_dir, int(args.run_size), args.pages_per_document, args.chars_per_page, args.seed)
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(run_size(paths, params), f)
+        return
+
+    sizes = [int(n) for n in args.documents.split(",")]
+    run = {
+        "benchmark": "pipeline",
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": params,
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            make_corpus(args.corpus_dir, size, args.pages_per_document, args.chars_per_page, args.seed)
+            result_file = os.path.join(tmp, f"{size}.json")
+            command = [sys.executable, "-m", "benchmarks.pipeline", "--run-size", str(size), "--result-file", result_file]
+            subprocess.run(command + sys.argv[1:], check=True, stdout=subprocess.DEVNULL)
+            with open(result_file, encoding="utf-8") as f:
+                result = json.load(f)
+            run["results"].append(result)
+            print(
+                f"{size} docs / {result['pages']} pages: {result['pages_per_sec']} pages/s, {result['chunks_per_sec']} chunks/s, "
+                f"query p50/p95/p99 {result['query_latency'].get('p50_ms')}/{result['query_latency'].get('p95_ms')}/"
+                f"{result['query_latency'].get('p99_ms')} ms, peak RSS {result['peak_rss_mb']} MB "
+                f"(largest extraction worker {result['peak_worker_rss_mb']} MB)",
+                file=sys.stderr,
+            )
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            run["compared_to"] = {"file": args.baseline, "changes": compare(run, json.load(f))}
+
+    output = args.output or os.path.join(DEFAULT_RESULTS_DIR, f"pipeline-{run['started_at'].replace(':', '')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(json.dumps(run, indent=2))
+    print(f"Results written to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/upload_memory.py
+"""
+Peak RSS of extracting and chunking one large uploaded PDF, old path vs new path:
+
+    tempfile  write the upload to disk, PyMuPDFLoader.load() every page, then split them all
+    stream    PdfBytes over the in-memory buffer, pages streamed into the splitter (iter_process_pdfs)
+
+Each mode runs in a fresh subprocess. Usage (from the repo root):
+
+    python -m benchmarks.upload_memory --pages 2000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import tempfile
+from benchmarks.corpus import make_pdf
+
+
+def _rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kilobytes on Linux
+
+
+def run_mode(mode, pdf_path):
+    """Runs one mode in this process and returns its measurements."""
+    from langchain_community.document_loaders import PyMuPDFLoader
+    from core.pdf_processor import PdfBytes, iter_process_pdfs, _make_text_splitter
+
+    with open(pdf_path, "rb") as f:
+        upload = bytearray(f.read()) # Stands in for the Streamlit upload buffer
+    baseline_mb = _rss_mb()
+    started = time.perf_counter()
+    chunks = 0
+    if mode == "tempfile":
+        with tempfile.TemporaryDirectory() as tmp:
+            temp_path = os.path.join(tmp, "upload.pdf")
+            with open(temp_path, "wb") as f:
+                f.write(memoryview(upload))
+            pages = PyMuPDFLoader(temp_path).load()
+            chunks = len(_make_text_splitter().split_documents(pages))
+    elif mode == "stream":
+        for batch in iter_process_pdfs([PdfBytes("upload.pdf", memoryview(upload))], max_workers=1):
+            chunks += len(batch.chunks) # Batches are dropped once consumed, as the indexer does
+    else:
+        raise ValueError(f"Unknown mode {mode!r}")
+    return {
+        "mode": mode,
+        "chunks": chunks,
+        "seconds": round(time.perf_counter() - started, 2),
+        "baseline_rss_mb": round(baseline_mb, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "peak_over_baseline_mb": round(_peak_rss_mb() - baseline_mb, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--modes", default="tempfile,stream")
+    parser.add_argument("--run-mode", help=argparse.SUPPRESS)
+    parser.add_argument("--pdf", help="Use this PDF instead of generating one")
+    args = parser.parse_args()
+
+    if args.run_mode:
+        print(json.dumps(run_mode(args.run_mode, args.pdf)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = args.pdf or os.path.join(tmp, f"synthetic-{args.pages}.pdf")
+        if not args.pdf:
+            make_pdf(pdf_path, args.pages)
+        results = {"pages": args.pages, "pdf_mb": round(os.path.getsize(pdf_path) / 2**20, 1), "modes": []}
+        for mode in args.modes.split(","):
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.upload_memory", "--run-mode", mode, "--pdf", pdf_path],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            results["modes"].append(json.loads(output.strip().splitlines()[-1]))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
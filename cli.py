@@ -0,0 +1,130 @@
+# cli.py
+"""
+Headless batch indexing and question answering, without Streamlit.
+
+    python cli.py --index-dir .index index docs/ more-docs/
+    python cli.py ask questions.jsonl --output answers.jsonl --index-dir .index --concurrency 8
+
+--index-dir, --quantization, --workers, --fake and --trace-file go before or after the command.
+
+questions.jsonl holds one {"question": ..., "id": optional, "sources": optional [file names]}
+per line. Answers are appended to --output as they complete, one JSON object per question with
+its timings, so a long run can be followed with `tail -f` and continued with --resume.
+GOOGLE_API_KEY is read from the environment; --fake runs fully offline with the
+deterministic fake embeddings and chat model.
+"""
+import os
+import sys
+import json
+import argparse
+from core import telemetry
+from core.batch import (
+    DEFAULT_CONCURRENCY, DEFAULT_QUERY_BATCH_SIZE, answer_questions, fake_llm, index_directories, open_store,
+    read_questions,
+)
+from core.context_packing import DEFAULT_TOKEN_BUDGET
+
+DEFAULT_INDEX_DIR = ".index"
+SHARED_DEFAULTS = {"index_dir": DEFAULT_INDEX_DIR, "quantization": None, "workers": None, "fake": False, "trace_file": None}
+
+
+def _api_key(args):
+    if args.fake:
+        return None
+    key = os.getenv("GOOGLE_API_KEY")
+    if not key:
+        sys.exit("GOOGLE_API_KEY is not set (or pass --fake for an offline run)")
+    return key
+
+
+def _open(args, key):
+    return open_store(key, index_dir=args.index_dir, quantization=args.quantization, fake=args.fake)
+
+
+def cmd_index(args):
+    key = _api_key(args)
+    store = _open(args, key)
+    summary = index_directories(
+        store, args.paths, recursive=not args.no_recursive, max_workers=args.workers,
+        batch_size=args.batch_size, max_in_flight=args.max_in_flight,
+    )
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+def cmd_ask(args):
+    key = _api_key(args)
+    store = _open(args, key)
+    if args.docs:
+        index_directories(store, args.docs, max_workers=args.workers)
+    if args.fake:
+        llm = fake_llm(first_token_latency=args.fake_first_token_latency, token_latency=args.fake_token_latency)
+    else:
+        llm = None
+    summary = answer_questions(
+        store,
+        read_questions(args.questions),
+        args.output,
+        google_api_key=key,
+        llm=llm,
+        concurrency=args.concurrency,
+        k_results=args.k,
+        mode=args.mode,
+        token_budget=args.token_budget or None,
+        query_batch_size=args.query_batch_size,
+        resume=args.resume,
+    )
+    if telemetry.is_enabled():
+        summary["stages"] = telemetry.stage_percentiles()
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["errors"] else 0
+
+
+def _shared_options():
+    """
+    Options accepted before or after the subcommand. They default to SUPPRESS, so a subcommand's
+    copy doesn't overwrite a value given before it; main() starts from SHARED_DEFAULTS instead.
+    """
+    shared = argparse.ArgumentParser(add_help=False, argument_default=argparse.SUPPRESS)
+    shared.add_argument("--index-dir", help=f"On-disk index shared by index and ask runs (default: {DEFAULT_INDEX_DIR})")
+    shared.add_argument("--quantization", choices=("int8", "float16"))
+    shared.add_argument("--workers", type=int, help="Extraction processes (default: all CPUs)")
+    shared.add_argument("--fake", action="store_true", help="Offline fake embeddings and chat model")
+    shared.add_argument("--trace-file", help="Append per-stage telemetry spans to this JSONL file")
+    return shared
+
+
+def main(argv=None):
+    shared = _shared_options()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter, parents=[shared])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index = commands.add_parser("index", help="Index every PDF under the given directories", parents=[shared])
+    index.add_argument("paths", nargs="+", help="Directories (or single PDF files)")
+    index.add_argument("--no-recursive", action="store_true")
+    index.add_argument("--batch-size", type=int, default=64, help="Chunks per embedding request")
+    index.add_argument("--max-in-flight", type=int, default=4, help="Concurrent embedding requests")
+    index.set_defaults(func=cmd_index)
+
+    ask = commands.add_parser("ask", help="Answer a JSONL file of questions", parents=[shared])
+    ask.add_argument("questions", help="JSONL file of questions")
+    ask.add_argument("--output", required=True, help="JSONL file answers are appended to")
+    ask.add_argument("--docs", nargs="+", help="Index these directories first")
+    ask.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Answers generated at once")
+    ask.add_argument("--k", type=int, default=5)
+    ask.add_argument("--mode", choices=("dense", "hybrid"), default="dense")
+    ask.add_argument("--token-budget", type=int, default=DEFAULT_TOKEN_BUDGET, help="0 disables context packing")
+    ask.add_argument("--query-batch-size", type=int, default=DEFAULT_QUERY_BATCH_SIZE)
+    ask.add_argument("--resume", action="store_true", help="Skip question ids already answered without an error in --output")
+    ask.add_argument("--fake-first-token-latency", type=float, default=0.0)
+    ask.add_argument("--fake-token-latency", type=float, default=0.0)
+    ask.set_defaults(func=cmd_ask)
+
+    args = parser.parse_args(argv, namespace=argparse.Namespace(**SHARED_DEFAULTS))
+    if args.trace_file:
+        telemetry.configure(exporters=[telemetry.InMemoryExporter(), telemetry.JsonLinesExporter(args.trace_file)])
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+# core/answer_cache.py
+"""
+Answer cache for query_rag, keyed by (document-set fingerprint, source filter, normalized question).
+An optional semantic tier reuses an answer when a new question's embedding is close enough to
+a cached one under the same fingerprint and filter. Both tiers use TTL + LRU eviction.
+Because the fingerprint changes whenever documents are added or removed, answers computed over
+an older document set can never be returned; they age out, or invalidate() drops them eagerly.
+"""
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_question(question):
+    return _WS_RE.sub(" ", question.strip().lower()).rstrip(" ?!.")
+
+
+def _filter_key(sources_filter):
+    return tuple(sorted(sources_filter)) if sources_filter else ()
+
+
+class AnswerCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 semantic=False, similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic = semantic
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._exact = OrderedDict() # key -> (expires_at, answer, sources)
+        self._semantic = OrderedDict() # key -> (expires_at, unit vector, answer, sources)
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _expire(self, store, now):
+        expired = [key for key, entry in store.items() if entry[0] <= now]
+        for key in expired:
+            del store[key]
+
+    def get(self, fingerprint, sources_filter, question, question_vector=None):
+        """
+        Returns (answer, sources, tier) on a hit, or None. tier is "exact" or "semantic".
+        question_vector may be a callable returning the vector (or None); it is only called,
+        outside the lock, after the exact tier missed, so exact hits never pay for an embedding.
+        """
+        key = (fingerprint, _filter_key(sources_filter), normalize_question(question))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._exact.get(key)
+            if entry and entry[0] > now:
+                self._exact.move_to_end(key)
+                self.exact_hits += 1
+                return entry[1], entry[2], "exact"
+            if entry:
+                del self._exact[key] # Expired
+        if self.semantic and callable(question_vector):
+            question_vector = question_vector()
+        with self._lock:
+            if self.semantic and question_vector is not None:
+                self._expire(self._semantic, now)
+                candidates = [(k, e) for k, e in self._semantic.items() if k[:2] == key[:2]]
+                if candidates:
+                    query = np.asarray(question_vector, dtype=np.float32)
+                    query /= (np.linalg.norm(query) or 1.0)
+                    similarities = np.stack([e[1] for _, e in candidates]) @ query
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.similarity_threshold:
+                        best_key, best_entry = candidates[best]
+                        self._semantic.move_to_end(best_key)
+                        self.semantic_hits += 1
+                        return best_entry[2], best_entry[3], "semantic"
+            self.misses += 1
+            return None
+
+    def put(self, fingerprint, sources_filter, question, answer, sources, question_vector=None):
+        key = (fingerprint, _filter_key(sources_filter), normalize_question(question))
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._exact[key] = (expires_at, answer, sources)
+            self._exact.move_to_end(key)
+            while len(self._exact) > self.max_entries:
+                self._exact.popitem(last=False)
+            if self.semantic and question_vector is not None:
+                vector = np.asarray(question_vector, dtype=np.float32)
+                vector /= (np.linalg.norm(vector) or 1.0)
+                self._semantic[key] = (expires_at, vector, answer, sources)
+                self._semantic.move_to_end(key)
+                while len(self._semantic) > self.max_entries:
+                    self._semantic.popitem(last=False)
+
+    def invalidate(self, fingerprint):
+        """Drops every entry computed over the document set `fingerprint`."""
+        with self._lock:
+            for store in (self._exact, self._semantic):
+                for key in [k for k in store if k[0] == fingerprint]:
+                    del store[key]
+
+    def clear(self):
+        with self._lock:
+            self._exact.clear()
+            self._semantic.clear()
+
+    def stats(self):
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": ((self.exact_hits + self.semantic_hits) / lookups) if lookups else 0.0,
+            "entries": len(self._exact),
+        }
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_answer_cache(**kwargs):
+    """Process-wide cache. Sessions over the same documents share answers via the fingerprint."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = AnswerCache(**kwargs)
+        return _shared_cache
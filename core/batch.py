@@ -0,0 +1,321 @@
+# core/batch.py
+"""
+Headless API for bulk work outside Streamlit: index folders of PDFs and answer JSONL files
+of questions. Used by cli.py; importable on its own.
+
+    store = open_store(index_dir=".index", fake=True)
+    index_directories(store, ["docs/"])
+    answer_questions(store, read_questions("questions.jsonl"), "answers.jsonl", llm=fake_llm())
+
+Questions that share a source filter are retrieved together: their query embeddings are
+computed in one batched call and searched in one batched matmul (NumPy backends), and identical
+questions are answered once. Generation runs on a bounded thread pool, and every answer is
+appended to the output file as soon as it is ready.
+"""
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from langchain_core.documents import Document
+from core import telemetry
+from core.answer_cache import normalize_question
+from core.context_packing import estimate_tokens, pack_context
+from core.embedding_cache import embed_queries
+from core.fakes import DeterministicFakeEmbeddings, FakeStreamingChatModel
+from core.numpy_store import NumpyVectorStore
+from core.pdf_processor import iter_process_pdfs, file_content_hash, source_name
+from core.persistent_index import open_persistent_index
+from core.qa_engine import format_sources, get_answer_chain, get_llm
+from core.vector_store import (
+    add_documents_to_store, finish_indexing, get_retriever_with_filter, get_vector_store, ingest_checkpoint_path, sync_sources,
+)
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_QUERY_BATCH_SIZE = 64
+FAKE_EMBEDDING_SIZE = 256
+
+
+def open_store(google_api_key=None, index_dir=None, backend="numpy", quantization=None, fake=False):
+    """
+    Vector store for headless runs. With index_dir the on-disk index is used, so an overnight
+    index run and later question runs share it. fake=True uses DeterministicFakeEmbeddings
+    (no API key, no network).
+    """
+    if not fake:
+        return get_vector_store(google_api_key, persist_directory=index_dir, backend=backend, quantization=quantization)
+    embeddings = DeterministicFakeEmbeddings(size=FAKE_EMBEDDING_SIZE)
+    index = open_persistent_index(index_dir) if index_dir else None
+    return NumpyVectorStore(embeddings, index, quantization=quantization)
+
+
+def fake_llm(first_token_latency=0.0, token_latency=0.0, answer_words=40):
+    return FakeStreamingChatModel(
+        answer_words=answer_words, first_token_latency=first_token_latency, token_latency=token_latency
+    )
+
+
+def find_pdfs(directories, recursive=True):
+    """Sorted PDF paths under `directories` (plain file paths are passed through)."""
+    paths = []
+    for directory in directories:
+        if os.path.isfile(directory):
+            paths.append(directory)
+            continue
+        for root, dirs, files in os.walk(directory):
+            paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(".pdf"))
+            if not recursive:
+                break
+    return sorted(paths)
+
+
+def index_directories(vector_store, directories, recursive=True, max_workers=None, **ingest_kwargs):
+    """
+    Incrementally indexes every PDF under `directories`: unchanged files are skipped, changed
+    ones replaced. Extraction runs on the process pool (iter_process_pdfs, the streaming form of
+    process_pdfs) and each page-range batch is embedded as soon as it is ready.
+    Returns a summary dict.
+    """
+    started = time.perf_counter()
+    paths = find_pdfs(directories, recursive=recursive)
+    by_source = {}
+    for path in paths:
+        source = source_name(path)
+        if source in by_source:
+            # Documents are keyed by file name throughout the app
+            print(f"--- WARNING: '{path}' has the same file name as '{by_source[source]}'; skipping it ---")
+            continue
+        by_source[source] = path
+    source_hashes = {source: file_content_hash(path) for source, path in by_source.items()}
+    to_index, unchanged = sync_sources(vector_store, source_hashes)
+    print(f"--- Headless indexing: {len(paths)} PDF(s) found, {len(to_index)} to index, {len(unchanged)} unchanged ---")
+
+    chunks, pages, errors = 0, 0, []
+    for batch in iter_process_pdfs([by_source[source] for source in to_index], max_workers=max_workers):
+        errors.extend(batch.errors)
+        pages += batch.page_range[1] - batch.page_range[0]
+        if batch.chunks:
+            add_documents_to_store(
+                vector_store,
+                batch.chunks,
+                ids=[c.metadata["chunk_id"] for c in batch.chunks],
+                checkpoint_path=ingest_checkpoint_path(vector_store, batch.source, batch.doc_hash, batch.page_range),
+                **ingest_kwargs,
+            )
+            chunks += len(batch.chunks)
+    failed = {error.source for error in errors}
+    finish_indexing(vector_store, {source: source_hashes[source] for source in to_index if source not in failed})
+    seconds = time.perf_counter() - started
+    summary = {
+        "found": len(paths),
+        "indexed": [source for source in to_index if source not in failed],
+        "unchanged": unchanged,
+        "failed": [{"source": e.source, "error": e.error, "page_range": e.page_range} for e in errors],
+        "pages": pages,
+        "chunks": chunks,
+        "seconds": round(seconds, 2),
+    }
+    print(f"--- Headless indexing done: {chunks} chunks from {pages} pages in {seconds:.1f}s ---")
+    return summary
+
+
+def read_questions(path):
+    """
+    Reads a JSONL file of {"question": ..., "id": optional, "sources": optional [file names]}.
+    Plain strings are accepted too. Missing ids become the line number.
+    """
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"question": record}
+            record.setdefault("id", line_number)
+            questions.append(record)
+    return questions
+
+
+def _filter_for(sources):
+    return {"source": {"$in": list(sources)}} if sources else None
+
+
+def search_by_vectors(vector_store, vectors, k, filter=None):
+    """One result list per query vector, in a single batched search where the store supports it."""
+    if hasattr(vector_store, "similarity_search_by_vectors_with_score"):
+        results = vector_store.similarity_search_by_vectors_with_score(vectors, k=k, filter=filter)
+        return [[doc for doc, _ in hits] for hits in results]
+    collection = getattr(vector_store, "_collection", None)
+    if collection is not None: # Chroma
+        result = collection.query(query_embeddings=vectors, n_results=k, where=filter, include=["documents", "metadatas"])
+        return [
+            [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+            for texts, metadatas in zip(result["documents"], result["metadatas"])
+        ]
+    return [vector_store.similarity_search_by_vector(v, k=k, filter=filter) for v in vectors]
+
+
+def _plan_retrieval_groups(questions, batch_size):
+    """
+    Groups questions by source filter, collapses identical questions within a group, and cuts
+    each group into batches. Yields (sources, [(normalized question, [records])]).
+    """
+    groups = {}
+    for record in questions:
+        sources = tuple(sorted(record.get("sources") or []))
+        by_question = groups.setdefault(sources, {})
+        by_question.setdefault(normalize_question(record["question"]), []).append(record)
+    for sources, by_question in groups.items():
+        items = list(by_question.items())
+        for start in range(0, len(items), batch_size):
+            yield sources, items[start:start + batch_size]
+
+
+def _answered_ids(output_path):
+    """
+    Ids already answered without an error in `output_path`, so failed questions are retried.
+    Lines that don't decode are skipped, and a torn last line (a run killed mid-write) is cut off
+    so appended answers start on a fresh line.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    done_ids, offset, torn_at = set(), 0, None
+    with open(output_path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                torn_at = offset
+                break
+            try:
+                record = json.loads(line)
+                if record.get("error") is None:
+                    done_ids.add(record["id"])
+            except (ValueError, KeyError, TypeError):
+                if line.strip():
+                    print(f"--- Batch QA: skipping unreadable line at byte {offset} of {output_path} ---")
+            offset += len(line)
+    if torn_at is not None:
+        with open(output_path, "r+b") as f:
+            f.truncate(torn_at)
+    return done_ids
+
+
+def answer_questions(
+    vector_store,
+    questions,
+    output_path,
+    google_api_key=None,
+    llm=None,
+    concurrency=DEFAULT_CONCURRENCY,
+    k_results=5,
+    mode="dense",
+    token_budget=None,
+    query_batch_size=DEFAULT_QUERY_BATCH_SIZE,
+    resume=False,
+):
+    """
+    Answers `questions` (records from read_questions) and appends one JSON line per question to
+    `output_path` as soon as its answer is ready: id, question, sources filter, answer, cited
+    sources and timings (retrieval_ms is the shared batch's time, with retrieval_batch its size).
+    At most `concurrency` answers are generated at once. mode="hybrid" retrieves per question
+    through the hybrid retriever instead of the batched dense search. A question whose generation
+    fails is written with its error and counted in "errors"; with resume=True, ids already
+    answered without an error in `output_path` are skipped. Returns a summary dict; "failed" lists
+    the ids whose answer could not be written.
+    """
+    done_ids = _answered_ids(output_path) if resume else set()
+    pending = [q for q in questions if q["id"] not in done_ids]
+    print(f"--- Batch QA: {len(pending)} question(s) to answer ({len(done_ids)} already in {output_path}) ---")
+
+    started = time.perf_counter()
+    write_lock = threading.Lock()
+    stats = {"answered": 0, "errors": 0, "generation_ms": []}
+    # Bounds the retrieved-but-not-yet-answered backlog, so memory stays flat on huge runs
+    backlog = threading.BoundedSemaphore(max(1, concurrency) * 4)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    output = open(output_path, "a", encoding="utf-8")
+    futures = []
+
+    def _generate(records, documents, retrieval_ms, batch):
+        try:
+            generation_started = time.perf_counter()
+            try:
+                # The documents are already retrieved, so only the answer chain runs. Unlike
+                # query_rag, a failed call is recorded as an error instead of becoming the answer.
+                answer_chain = get_answer_chain(llm if llm is not None else get_llm(google_api_key))
+                with telemetry.span("generation") as span:
+                    answer = answer_chain.invoke({"input_documents": documents, "question": records[0]["question"]})["output_text"]
+                    span.set(completion_tokens=estimate_tokens(answer))
+                sources_text, error = format_sources(documents), None
+            except Exception as e:
+                print(f"--- Batch QA: could not answer {[r['id'] for r in records]}: {e} ---")
+                answer, sources_text, error = None, None, str(e)
+            generation_ms = (time.perf_counter() - generation_started) * 1000
+            with write_lock:
+                for record in records:
+                    output.write(json.dumps({
+                        "id": record["id"],
+                        "question": record["question"],
+                        "sources_filter": record.get("sources") or [],
+                        "answer": answer,
+                        "sources": sources_text,
+                        "error": error,
+                        "timings": {
+                            "retrieval_ms": round(retrieval_ms, 2),
+                            "retrieval_batch": batch,
+                            "generation_ms": round(generation_ms, 2),
+                            "completed_at_ms": round((time.perf_counter() - started) * 1000, 2),
+                        },
+                    }) + "\n")
+                output.flush()
+                stats["errors" if error else "answered"] += len(records)
+                stats["generation_ms"].append(generation_ms)
+        finally:
+            backlog.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            for sources, items in _plan_retrieval_groups(pending, query_batch_size):
+                filter = _filter_for(sources)
+                retrieval_started = time.perf_counter()
+                texts = [records[0]["question"] for _, records in items]
+                with telemetry.span("batch_retrieval", questions=len(texts), mode=mode):
+                    if mode == "dense":
+                        vectors = embed_queries(vector_store.embeddings, texts)
+                        results = search_by_vectors(vector_store, vectors, k_results, filter=filter)
+                    else:
+                        retriever = get_retriever_with_filter(vector_store, list(sources), k_results=k_results, mode=mode)
+                        results = [retriever.invoke(text) for text in texts]
+                if token_budget:
+                    results = [pack_context(docs, token_budget=token_budget)[0] for docs in results]
+                retrieval_ms = (time.perf_counter() - retrieval_started) * 1000
+                for (_, records), documents in zip(items, results):
+                    backlog.acquire()
+                    futures.append((executor.submit(_generate, records, documents, retrieval_ms, len(texts)), records))
+    finally:
+        output.close()
+
+    failed = []
+    for future, records in futures:
+        if future.exception() is not None:
+            print(f"--- Batch QA: could not answer {[r['id'] for r in records]}: {future.exception()} ---")
+            failed.extend(record["id"] for record in records)
+
+    seconds = time.perf_counter() - started
+    generation_ms = stats["generation_ms"]
+    summary = {
+        "questions": len(questions),
+        "skipped": len(done_ids),
+        "answered": stats["answered"],
+        "errors": stats["errors"],
+        "failed": failed,
+        "seconds": round(seconds, 2),
+        "questions_per_sec": round(stats["answered"] / seconds, 2) if seconds else 0.0,
+        "generation_p50_ms": round(float(np.percentile(generation_ms, 50)), 2) if generation_ms else None,
+        "generation_p95_ms": round(float(np.percentile(generation_ms, 95)), 2) if generation_ms else None,
+        "output": output_path,
+    }
+    print(f"--- Batch QA done: {stats['answered']} answered, {stats['errors']} errors, {len(failed)} failed in {seconds:.1f}s ({summary['questions_per_sec']} questions/sec) ---")
+    return summary
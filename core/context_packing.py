@@ -0,0 +1,165 @@
+# core/context_packing.py
+"""
+Context assembly between retrieval and generation. Retrieved chunks from the same source and
+page that are adjacent or share the splitter's overlap are merged into one block, near-duplicate
+blocks are dropped, and the rest is packed in relevance order up to a token budget.
+"""
+import re
+from dataclasses import dataclass
+from typing import Any, List, Optional
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from core import telemetry
+from core.pdf_processor import CHUNK_OVERLAP
+
+DEFAULT_TOKEN_BUDGET = 3000
+DEFAULT_DUPLICATE_THRESHOLD = 0.85 # Share of a block's word shingles already present in a kept block
+CHARS_PER_TOKEN = 4 # Rough average for English text with Gemini's tokenizer
+MIN_OVERLAP_CHARS = 20
+SHINGLE_WORDS = 3
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _chunk_position(doc):
+    """Position of the chunk on its page, from the chunk_id assigned by assign_chunk_ids."""
+    chunk_id = doc.metadata.get("chunk_id") or ""
+    try:
+        return int(chunk_id.rsplit(":", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def overlap_length(left, right, max_overlap=CHUNK_OVERLAP * 2, min_overlap=MIN_OVERLAP_CHARS):
+    """Length of the longest suffix of `left` that is a prefix of `right` (0 if under min_overlap)."""
+    if len(right) < min_overlap:
+        return 0
+    probe = right[:min_overlap]
+    start = max(0, len(left) - max_overlap)
+    while True:
+        i = left.find(probe, start)
+        if i < 0:
+            return 0
+        if right.startswith(left[i:]):
+            return len(left) - i
+        start = i + 1
+
+
+def merge_texts(left, right):
+    """Joins two consecutive chunks, keeping their shared overlap once."""
+    if right in left:
+        return left
+    overlap = overlap_length(left, right)
+    if overlap:
+        return left + right[overlap:]
+    return left + "\n" + right
+
+
+def _shingles(text):
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+@dataclass
+class PackingReport:
+    retrieved_chunks: int = 0
+    packed_blocks: int = 0
+    merged_chunks: int = 0
+    dropped_duplicates: int = 0
+    dropped_over_budget: int = 0
+    original_tokens: int = 0
+    packed_tokens: int = 0
+
+    @property
+    def saved_tokens(self):
+        return self.original_tokens - self.packed_tokens
+
+
+def _merge_same_page(ranked_docs):
+    """
+    Merges [(rank, Document)] of one source page that are adjacent (consecutive positions) or
+    overlap in text. Each block keeps the best relevance rank of its members. Returns [(rank, Document)].
+    """
+    members = sorted(ranked_docs, key=lambda item: (_chunk_position(item[1]) is None, _chunk_position(item[1]) or 0, item[0]))
+    blocks = [] # [best_rank, text, last_position, count, metadata]
+    for rank, doc in members:
+        position = _chunk_position(doc)
+        if blocks:
+            block = blocks[-1]
+            adjacent = position is not None and block[2] is not None and position - block[2] <= 1
+            if adjacent or overlap_length(block[1], doc.page_content) or doc.page_content in block[1]:
+                block[0] = min(block[0], rank)
+                block[1] = merge_texts(block[1], doc.page_content)
+                block[2] = position if position is not None else block[2]
+                block[3] += 1
+                continue
+        blocks.append([rank, doc.page_content, position, 1, doc.metadata])
+    return [
+        (rank, Document(page_content=text, metadata=dict(metadata, merged_chunks=count) if count > 1 else dict(metadata)))
+        for rank, text, _, count, metadata in blocks
+    ]
+
+
+def pack_context(docs, token_budget=DEFAULT_TOKEN_BUDGET, duplicate_threshold=DEFAULT_DUPLICATE_THRESHOLD):
+    """
+    Returns (packed Documents, PackingReport). `docs` must be in relevance order; blocks come
+    out in the order of their best-ranked chunk. The top block is always kept (truncated to
+    the budget if it alone exceeds it); later blocks that do not fit are skipped.
+    """
+    report = PackingReport(retrieved_chunks=len(docs), original_tokens=sum(estimate_tokens(d.page_content) for d in docs))
+    pages = {}
+    for rank, doc in enumerate(docs):
+        pages.setdefault((doc.metadata.get("source"), doc.metadata.get("page")), []).append((rank, doc))
+    ranked = sorted((block for page_docs in pages.values() for block in _merge_same_page(page_docs)), key=lambda item: item[0])
+    report.merged_chunks = len(docs) - len(ranked)
+
+    packed, kept_shingles, used_tokens = [], [], 0
+    for _, block in ranked:
+        shingles = _shingles(block.page_content)
+        if shingles and any(len(shingles & kept) / len(shingles) >= duplicate_threshold for kept in kept_shingles):
+            report.dropped_duplicates += 1
+            continue
+        tokens = estimate_tokens(block.page_content)
+        if used_tokens + tokens > token_budget:
+            if packed:
+                report.dropped_over_budget += 1
+                continue
+            block = Document(page_content=block.page_content[:token_budget * CHARS_PER_TOKEN], metadata=block.metadata)
+            tokens = estimate_tokens(block.page_content)
+        packed.append(block)
+        kept_shingles.append(shingles)
+        used_tokens += tokens
+    report.packed_blocks = len(packed)
+    report.packed_tokens = used_tokens
+    return packed, report
+
+
+class PackedContextRetriever(BaseRetriever):
+    """Wraps a retriever and returns its results packed by pack_context."""
+
+    retriever: Any
+    token_budget: int = DEFAULT_TOKEN_BUDGET
+    duplicate_threshold: float = DEFAULT_DUPLICATE_THRESHOLD
+    last_report: Optional[PackingReport] = None # For diagnostics
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        docs = self.retriever.invoke(query)
+        with telemetry.span("context_assembly", chunks=len(docs), token_budget=self.token_budget) as span:
+            packed, report = pack_context(docs, token_budget=self.token_budget, duplicate_threshold=self.duplicate_threshold)
+            span.set(blocks=report.packed_blocks, saved_tokens=report.saved_tokens)
+        telemetry.increment("prompt_tokens_saved", report.saved_tokens)
+        self.last_report = report
+        print(
+            f"--- Context packing: {report.retrieved_chunks} chunks -> {report.packed_blocks} blocks, "
+            f"~{report.packed_tokens} tokens (saved ~{report.saved_tokens}) ---"
+        )
+        return packed
@@ -0,0 +1,235 @@
+# core/embedding_cache.py
+import os
+import sqlite3
+import threading
+import time
+import hashlib
+from array import array
+from langchain_core.embeddings import Embeddings
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from core import telemetry
+
+DEFAULT_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(".cache", "embeddings.sqlite3"))
+DEFAULT_MAX_ENTRIES = 200_000
+_SQLITE_MAX_PARAMS = 500  # Stay well below SQLITE_MAX_VARIABLE_NUMBER on old sqlite builds
+TOUCH_FLUSH_ENTRIES = 1000 # Buffered LRU touches are written once this many are pending
+
+
+def text_hash(text):
+    """Content hash used as the cache key for a chunk of text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _encode_vector(vector):
+    return array("f", vector).tobytes()
+
+
+def _decode_vector(blob):
+    values = array("f")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class EmbeddingCache:
+    """
+    On-disk (SQLite) embedding cache keyed by (model name, sha256 of text).
+    Keeps at most `max_entries` vectors and evicts the least recently used ones. Lookups never
+    commit: the last_used touches of hits are buffered and written with the next put_many (before
+    it evicts), once TOUCH_FLUSH_ENTRIES are pending, or on close.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._pending_touches = {} # (model, text_hash) -> last_used not yet written
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # A cache can lose its last commits on power loss without harm, so skip the fsync per commit
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model, texts):
+        """
+        Batch lookup. Returns a list aligned with `texts` holding the cached vector
+        or None for every miss. Hits are touched (see the class docstring) so they survive LRU eviction.
+        """
+        hashes = [text_hash(t) for t in texts]
+        found = {}
+        with self._lock:
+            unique_hashes = list(dict.fromkeys(hashes))
+            for start in range(0, len(unique_hashes), _SQLITE_MAX_PARAMS):
+                batch = unique_hashes[start:start + _SQLITE_MAX_PARAMS]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                found.update((h, _decode_vector(blob)) for h, blob in rows)
+            if found:
+                now = time.time()
+                self._pending_touches.update(((model, h), now) for h in found)
+                if len(self._pending_touches) >= TOUCH_FLUSH_ENTRIES:
+                    self._flush_touches()
+                    self._conn.commit()
+            results = [found.get(h) for h in hashes]
+            hit_count = sum(1 for r in results if r is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+        return results
+
+    def _flush_touches(self):
+        """Writes the buffered last_used touches. Caller holds the lock and commits."""
+        if self._pending_touches:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                [(now, model, h) for (model, h), now in self._pending_touches.items()],
+            )
+            self._pending_touches.clear()
+
+    def put_many(self, model, texts, vectors):
+        """Stores vectors for `texts` and evicts the oldest entries if over capacity."""
+        if not texts:
+            return
+        now = time.time()
+        rows = {text_hash(t): (model, text_hash(t), _encode_vector(v), now) for t, v in zip(texts, vectors)}
+        with self._lock:
+            self._flush_touches() # So eviction sees every recent hit
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                list(rows.values()),
+            )
+            self._entries += self._conn.total_changes - before
+            overflow = self._entries - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self._entries -= overflow
+                self.evictions += overflow
+            self._conn.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "entries": self._entries,
+            "evictions": self.evictions,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._pending_touches.clear()
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._entries = 0
+
+    def close(self):
+        with self._lock:
+            self._flush_touches()
+            self._conn.commit()
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends cache misses to the underlying model.
+    `model_name` is part of the cache key so switching models never returns stale vectors.
+    """
+
+    def __init__(self, underlying, model_name, cache):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        vectors = self.cache.get_many(self.model_name, texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        telemetry.increment("embedding_cache.hits", len(texts) - sum(1 for v in vectors if v is None))
+        telemetry.increment("embedding_cache.misses", len(missing))
+        if missing:
+            hit_count = sum(1 for v in vectors if v is not None)
+            print(f"--- Embedding cache: {hit_count} hits, {len(missing)} texts sent to {self.model_name} ---")
+            fresh = dict(zip(missing, self.underlying.embed_documents(missing)))
+            self.cache.put_many(self.model_name, list(fresh.keys()), list(fresh.values()))
+            vectors = [v if v is not None else fresh[t] for t, v in zip(texts, vectors)]
+        return vectors
+
+    def embed_query(self, text):
+        # Query embeddings use a different task type than documents, so keep them apart.
+        query_model = f"{self.model_name}#query"
+        with telemetry.span("query_embed", queries=1) as span:
+            cached = self.cache.get_many(query_model, [text])[0]
+            span.set(cached=cached is not None)
+            if cached is not None:
+                telemetry.increment("embedding_cache.hits")
+                return cached
+            telemetry.increment("embedding_cache.misses")
+            vector = self.underlying.embed_query(text)
+            self.cache.put_many(query_model, [text], [vector])
+            return vector
+
+    def embed_queries(self, texts):
+        """Batched embed_query: cached queries are reused, the rest go out in one batch."""
+        query_model = f"{self.model_name}#query"
+        texts = list(texts)
+        with telemetry.span("query_embed", queries=len(texts)) as span:
+            vectors = self.cache.get_many(query_model, texts)
+            missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+            span.set(embedded=len(missing))
+            telemetry.increment("embedding_cache.hits", len(texts) - sum(1 for v in vectors if v is None))
+            telemetry.increment("embedding_cache.misses", len(missing))
+            if missing:
+                fresh = dict(zip(missing, embed_queries(self.underlying, missing)))
+                self.cache.put_many(query_model, list(fresh.keys()), list(fresh.values()))
+                vectors = [v if v is not None else fresh[t] for t, v in zip(texts, vectors)]
+            return vectors
+
+
+def embed_queries(embeddings, texts):
+    """
+    Embeds many queries in as few model calls as possible. Gemini embeddings are batched through
+    a copy of the client set to the retrieval_query task type; other models fall back to
+    one embed_query call per text.
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    if isinstance(embeddings, GoogleGenerativeAIEmbeddings):
+        return embeddings.copy(update={"task_type": "retrieval_query"}).embed_documents(texts)
+    return [embeddings.embed_query(t) for t in texts]
+
+
+_shared_caches = {}
+_shared_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+    """Returns the process-wide cache for `path`, so all sessions share one SQLite connection."""
+    with _shared_caches_lock:
+        if path not in _shared_caches:
+            _shared_caches[path] = EmbeddingCache(path, max_entries=max_entries)
+        return _shared_caches[path]
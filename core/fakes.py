@@ -0,0 +1,126 @@
+# core/fakes.py
+"""
+Offline stand-ins for the Gemini models, used for local testing and benchmarks.
+They are deterministic: the same text always produces the same vector.
+"""
+import hashlib
+import math
+import random
+import threading
+import time
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import SimpleChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+
+
+class DeterministicFakeEmbeddings(Embeddings):
+    """Hash-seeded unit vectors. Counts how many texts were actually embedded."""
+
+    def __init__(self, size=64):
+        self.size = size
+        self.embedded_texts = 0
+        self.calls = 0
+
+    def _embed(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        rng = random.Random(seed)
+        vector = [rng.gauss(0.0, 1.0) for _ in range(self.size)]
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.embedded_texts += len(texts)
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        self.embedded_texts += 1
+        return self._embed(text)
+
+
+class FakeQuotaError(Exception):
+    """Mimics the 429 the Gemini API raises when the quota is exhausted."""
+
+    def __init__(self, message="429 Resource has been exhausted (e.g. check quota)."):
+        super().__init__(message)
+
+
+class FlakyFakeEmbeddings(DeterministicFakeEmbeddings):
+    """
+    Deterministic fake that also injects per-call latency and errors, for exercising
+    batching, concurrency limits and retries. `error_rate` is the chance a call raises
+    `error_factory()`; `fail_first` makes the first N calls fail regardless.
+    """
+
+    def __init__(self, size=64, latency=0.0, error_rate=0.0, fail_first=0, error_factory=FakeQuotaError, seed=0):
+        super().__init__(size=size)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.fail_first = fail_first
+        self.error_factory = error_factory
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _maybe_fail(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            failing = self.fail_first > 0 or self._rng.random() < self.error_rate
+            if self.fail_first > 0:
+                self.fail_first -= 1
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            if failing:
+                raise self.error_factory()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def embed_documents(self, texts):
+        self._maybe_fail()
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self._maybe_fail()
+        return super().embed_query(text)
+
+
+class FakeStreamingChatModel(SimpleChatModel):
+    """
+    Chat model stand-in that answers with words taken from the prompt's context, streamed
+    one word per chunk. `first_token_latency` and `token_latency` simulate generation time.
+    """
+
+    answer_words: int = 40
+    first_token_latency: float = 0.0
+    token_latency: float = 0.0
+
+    @property
+    def _llm_type(self):
+        return "fake-streaming-chat-model"
+
+    def _words(self, messages):
+        prompt = "\n".join(str(m.content) for m in messages)
+        context = prompt.split("Context:", 1)[-1]
+        words = context.split() or ["The", "answer", "is", "not", "found", "in", "the", "provided", "documents."]
+        seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:8], "big")
+        rng = random.Random(seed)
+        return [rng.choice(words) for _ in range(self.answer_words)]
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        words = self._words(messages)
+        time.sleep(self.first_token_latency + self.token_latency * max(0, len(words) - 1))
+        return " ".join(words)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for i, word in enumerate(self._words(messages)):
+            time.sleep(self.first_token_latency if i == 0 else self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else f" {word}"))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
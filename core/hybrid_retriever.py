@@ -0,0 +1,63 @@
+# core/hybrid_retriever.py
+import hashlib
+from typing import Any, List, Optional
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from core import telemetry
+from core.lexical_index import lexical_is_confident
+
+DEFAULT_RRF_K = 60 # Standard reciprocal rank fusion constant
+DEFAULT_CANDIDATES = 20
+
+
+def document_key(doc):
+    """Identity used to fuse the same chunk across rankings: chunk_id, else source/page/text."""
+    chunk_id = doc.metadata.get("chunk_id")
+    if chunk_id:
+        return chunk_id
+    raw = f"{doc.metadata.get('source')}|{doc.metadata.get('page')}|{doc.page_content}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=DEFAULT_RRF_K):
+    """Fuses ranked Document lists; each list contributes 1 / (rrf_k + rank) per document."""
+    scores, docs = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = document_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    ordered = sorted(scores, key=lambda key: -scores[key])[:k]
+    return [docs[key] for key in ordered]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses BM25 (lexical) and dense similarity rankings with reciprocal rank fusion.
+    If the lexical result is confident (an identifier from the query clearly wins), the dense
+    search is skipped entirely, saving the query-embedding round trip.
+    """
+
+    vector_store: Any
+    lexical_index: Any
+    k: int = 5
+    filter: Optional[dict] = None
+    candidates: int = DEFAULT_CANDIDATES
+    rrf_k: int = DEFAULT_RRF_K
+    allow_lexical_only: bool = True
+    last_mode: str = "" # "lexical" or "hybrid", for diagnostics
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        with telemetry.span("lexical_search", k=self.candidates):
+            lexical = self.lexical_index.search(query, k=self.candidates, filter=self.filter)
+        if self.allow_lexical_only and lexical_is_confident(query, lexical):
+            self.last_mode = "lexical"
+            print("--- Hybrid retrieval: lexical match is confident, skipping dense search ---")
+            return [doc for doc, _ in lexical[:self.k]]
+        self.last_mode = "hybrid"
+        search_kwargs = {"filter": self.filter} if self.filter else {}
+        dense = self.vector_store.similarity_search(query, k=self.candidates, **search_kwargs)
+        return reciprocal_rank_fusion([[doc for doc, _ in lexical], dense], self.k, rrf_k=self.rrf_k)
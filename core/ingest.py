@@ -0,0 +1,212 @@
+# core/ingest.py
+import os
+import json
+import time
+import uuid
+import random
+import hashlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Tuple
+from core import telemetry
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 1.0 # Seconds; doubled on every retry
+DEFAULT_MAX_DELAY = 60.0
+
+_RETRYABLE_MARKERS = ("429", "quota", "resource has been exhausted", "resourceexhausted", "rate limit", "503", "unavailable", "deadline")
+
+
+def is_retryable_error(error):
+    """True for quota / rate-limit / transient availability errors from the embedding API."""
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in _RETRYABLE_MARKERS)
+
+
+class TokenBucket:
+    """Thread-safe token bucket. `rate` tokens are added per second, up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1.0):
+        """Blocks until `tokens` are available, then takes them."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class IngestCheckpoint:
+    """
+    Records which batches have been written, in a small JSON file, so a failed
+    ingest can be resumed. Each save replaces the file atomically.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.completed = set()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.completed = set(json.load(f).get("completed_batches", []))
+
+    def is_done(self, batch_key):
+        return batch_key in self.completed
+
+    def mark_done(self, batch_key):
+        with self._lock:
+            self.completed.add(batch_key)
+            if not self.path:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"completed_batches": sorted(self.completed)}, f)
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        with self._lock:
+            self.completed = set()
+            if self.path and os.path.exists(self.path):
+                os.remove(self.path)
+
+
+@dataclass
+class IngestReport:
+    total_chunks: int = 0
+    ingested_chunks: int = 0
+    resumed_chunks: int = 0 # Skipped because the checkpoint says they were already written
+    retries: int = 0
+    seconds: float = 0.0
+    failed_batches: List[Tuple[int, str]] = field(default_factory=list)
+
+    @property
+    def chunks_per_sec(self):
+        return self.ingested_chunks / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def ok(self):
+        return not self.failed_batches
+
+
+def _batch_key(texts, metadatas):
+    digest = hashlib.sha256()
+    for text, metadata in zip(texts, metadatas):
+        digest.update(str(metadata.get("source", "")).encode("utf-8"))
+        digest.update(str(metadata.get("page", "")).encode("utf-8"))
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def write_embedded_batch(vector_store, texts, metadatas, ids, vectors):
+    """Writes pre-computed embeddings so the store does not embed the batch a second time."""
+    if hasattr(vector_store, "add_embeddings"):
+        vector_store.add_embeddings(text_embeddings=list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+    elif getattr(vector_store, "_collection", None) is not None: # Chroma
+        vector_store._collection.upsert(embeddings=vectors, documents=texts, metadatas=metadatas, ids=ids)
+    else:
+        vector_store.add_texts(texts, metadatas=metadatas, ids=ids)
+
+
+def ingest_documents(
+    vector_store,
+    documents,
+    ids=None,
+    batch_size=DEFAULT_BATCH_SIZE,
+    max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+    requests_per_second=None,
+    max_retries=DEFAULT_MAX_RETRIES,
+    base_delay=DEFAULT_BASE_DELAY,
+    max_delay=DEFAULT_MAX_DELAY,
+    checkpoint_path=None,
+):
+    """
+    Embeds `documents` in batches on a thread pool with at most `max_in_flight` embedding
+    requests outstanding, optionally rate limited to `requests_per_second`. Quota and transient
+    errors are retried with exponential backoff. Completed batches are recorded in the
+    checkpoint file, so calling this again with the same documents only redoes failed batches.
+    Store writes are serialized; only the embedding calls run concurrently.
+    """
+    documents = list(documents)
+    if ids is None:
+        ids = [str(uuid.uuid4()) for _ in documents]
+    embeddings = vector_store.embeddings
+    bucket = TokenBucket(requests_per_second) if requests_per_second else None
+    checkpoint = IngestCheckpoint(checkpoint_path)
+    write_lock = threading.Lock()
+    report = IngestReport(total_chunks=len(documents))
+    report_lock = threading.Lock()
+
+    batches = []
+    for start in range(0, len(documents), batch_size):
+        batch_docs = documents[start:start + batch_size]
+        texts = [d.page_content for d in batch_docs]
+        metadatas = [d.metadata for d in batch_docs]
+        batches.append((len(batches), texts, metadatas, ids[start:start + batch_size]))
+
+    def _run_batch(batch):
+        index, texts, metadatas, batch_ids = batch
+        key = _batch_key(texts, metadatas)
+        if checkpoint.is_done(key):
+            with report_lock:
+                report.resumed_chunks += len(texts)
+            return
+        attempt = 0
+        while True:
+            try:
+                if bucket:
+                    bucket.acquire()
+                with telemetry.span("embed", chunks=len(texts), attempt=attempt):
+                    vectors = embeddings.embed_documents(texts)
+                break
+            except Exception as e:
+                if attempt >= max_retries or not is_retryable_error(e):
+                    print(f"--- Ingest batch {index} failed after {attempt} retries: {e} ---")
+                    with report_lock:
+                        report.failed_batches.append((index, str(e)))
+                    return
+                delay = min(max_delay, base_delay * (2 ** attempt)) * (0.5 + random.random() / 2)
+                attempt += 1
+                with report_lock:
+                    report.retries += 1
+                telemetry.increment("embed_retries")
+                print(f"--- Ingest batch {index} hit a retryable error ({e}); retry {attempt}/{max_retries} in {delay:.1f}s ---")
+                time.sleep(delay)
+        with write_lock, telemetry.span("index_write", chunks=len(texts)):
+            write_embedded_batch(vector_store, texts, metadatas, batch_ids, vectors)
+        telemetry.increment("chunks_indexed", len(texts))
+        checkpoint.mark_done(key)
+        with report_lock:
+            report.ingested_chunks += len(texts)
+
+    started = time.perf_counter()
+    # Each batch runs in a copy of the caller's context, so its spans join the caller's trace
+    contexts = [contextvars.copy_context() for _ in batches]
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as executor:
+        list(executor.map(lambda context, batch: context.run(_run_batch, batch), contexts, batches))
+    report.seconds = time.perf_counter() - started
+
+    if report.ok and checkpoint_path:
+        checkpoint.clear() # Everything landed; nothing to resume
+    print(
+        f"--- Ingested {report.ingested_chunks}/{report.total_chunks} chunks in {report.seconds:.2f}s "
+        f"({report.chunks_per_sec:.1f} chunks/sec, {report.resumed_chunks} resumed, {report.retries} retries, "
+        f"{len(report.failed_batches)} failed batches) ---"
+    )
+    return report
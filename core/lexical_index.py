@@ -0,0 +1,125 @@
+# core/lexical_index.py
+"""
+In-process BM25 inverted index over chunk text, kept next to the vector index so exact
+identifiers (part numbers, error codes) can be matched lexically. Supports incremental
+add/remove by chunk id.
+"""
+import re
+import math
+import threading
+from collections import Counter, defaultdict
+from langchain_core.documents import Document
+from core.partitions import partition_filter
+from core.persistent_index import matches_where
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./:][a-z0-9]+)*")
+_SPLIT_RE = re.compile(r"[-_./:]")
+
+
+def tokenize(text):
+    """
+    Lowercased word tokens. Compound identifiers like "ERR-4021" or "A7.3b" are kept whole
+    and also split into their parts, so both "err-4021" and "4021" match.
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if _SPLIT_RE.search(token):
+            tokens.extend(part for part in _SPLIT_RE.split(token) if part)
+    return tokens
+
+
+def is_identifier(token):
+    """Tokens that look like codes rather than words: they contain a digit."""
+    return any(ch.isdigit() for ch in token)
+
+
+class BM25Index:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict) # term -> {chunk_id: term frequency}
+        self._doc_len = {}
+        self._docs = {} # chunk_id -> (text, metadata)
+        self._total_len = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, ids, texts, metadatas):
+        """Adds or replaces chunks."""
+        with self._lock:
+            self.remove([i for i in ids if i in self._docs])
+            for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    self._postings[term][chunk_id] = tf
+                length = sum(counts.values())
+                self._doc_len[chunk_id] = length
+                self._total_len += length
+                self._docs[chunk_id] = (text, metadata or {})
+
+    def remove(self, ids):
+        with self._lock:
+            for chunk_id in ids:
+                if chunk_id not in self._docs:
+                    continue
+                text, _ = self._docs.pop(chunk_id)
+                for term in set(tokenize(text)):
+                    postings = self._postings.get(term)
+                    if postings is not None:
+                        postings.pop(chunk_id, None)
+                        if not postings:
+                            del self._postings[term]
+                self._total_len -= self._doc_len.pop(chunk_id)
+
+    def _allowed(self, metadata, filter):
+        if not filter:
+            return True
+        partition = partition_filter(filter)
+        if partition:
+            key, values = partition
+            return metadata.get(key) in values
+        return matches_where(metadata, filter)
+
+    def search(self, query, k=5, filter=None):
+        """Returns [(Document, score)] by descending BM25 score; only chunks sharing a term are scored."""
+        with self._lock:
+            n_docs = len(self._docs)
+            if not n_docs:
+                return []
+            avg_len = self._total_len / n_docs
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._doc_len[chunk_id] / avg_len)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / norm
+            ranked = sorted(
+                ((cid, s) for cid, s in scores.items() if self._allowed(self._docs[cid][1], filter)),
+                key=lambda item: -item[1],
+            )[:k]
+            return [
+                (Document(page_content=self._docs[cid][0], metadata=dict(self._docs[cid][1])), score)
+                for cid, score in ranked
+            ]
+
+
+def lexical_is_confident(query, results, min_ratio=1.5):
+    """
+    True when the lexical ranking alone is trustworthy: the query contains an identifier-like
+    token that the top hit contains, and the top hit clearly beats the runner-up.
+    """
+    if not results:
+        return False
+    identifiers = [t for t in tokenize(query) if is_identifier(t)]
+    if not identifiers:
+        return False
+    top_tokens = set(tokenize(results[0][0].page_content))
+    if not any(t in top_tokens for t in identifiers):
+        return False
+    return len(results) == 1 or results[0][1] >= min_ratio * results[1][1]
@@ -0,0 +1,213 @@
+# core/memory_index.py
+"""
+In-memory counterpart of PersistentIndex with the same interface, for sessions that do not
+need persistence. Vectors are kept in one contiguous, geometrically grown float32 matrix.
+With spill_vectors=True that matrix is memory-mapped from an unlinked temporary file instead of
+living on the heap, for quantized stores that only read the float32 rows of their shortlist.
+"""
+import tempfile
+import threading
+import numpy as np
+from core.persistent_index import normalize_rows, matches_where
+from core.lexical_index import BM25Index
+from core.partitions import PARTITION_KEYS, RowRangeMap
+
+
+class InMemoryIndex:
+    def __init__(self, initial_capacity=1024, spill_vectors=False):
+        self._lock = threading.RLock()
+        self._initial_capacity = initial_capacity
+        self._spill_vectors = spill_vectors
+        self._completed = {} # source -> doc_hash of fully indexed documents; survives compaction
+        self._version = 0
+        self._bm25 = None # Built on the first hybrid search, then kept current by append/delete
+        self._reset(generation=0)
+
+    def _reset(self, generation):
+        self._capacity = self._initial_capacity
+        self._matrix = None
+        self._deleted = np.zeros(self._capacity, dtype=bool)
+        self._rows = 0
+        self._ids = []
+        self._texts = []
+        self._metadatas = []
+        self._live_row_by_id = {}
+        self._partitions = {key: RowRangeMap() for key in PARTITION_KEYS}
+        self._generation = generation
+
+    @property
+    def dim(self):
+        return None if self._matrix is None else self._matrix.shape[1]
+
+    @property
+    def rows(self):
+        return self._rows
+
+    @property
+    def vectors_in_memory(self):
+        """False when the float32 rows are memory-mapped, so the OS can drop their pages."""
+        return not self._spill_vectors
+
+    @property
+    def version(self):
+        """Bumped by every write, so state derived from the contents (e.g. fingerprints) can be revalidated."""
+        return self._version
+
+    @property
+    def generation(self):
+        """Bumped whenever existing rows are renumbered (compaction)."""
+        return self._generation
+
+    def __len__(self):
+        return len(self._live_row_by_id)
+
+    def vectors(self):
+        return np.empty((0, 0), dtype=np.float32) if self._matrix is None else self._matrix[:self._rows]
+
+    def deleted_mask(self):
+        return self._deleted[:self._rows]
+
+    def snapshot(self):
+        """(vectors, deleted_mask) taken together, so a concurrent append cannot skew them."""
+        with self._lock:
+            vectors = self.vectors()
+            return vectors, self.deleted_mask()[:len(vectors)]
+
+    def records(self, rows):
+        return [(self._ids[r], self._texts[r], self._metadatas[r]) for r in (int(r) for r in rows)]
+
+    def source_hashes(self):
+        """{source: doc_hash} of the live rows, looking at one row per source."""
+        with self._lock:
+            deleted = self.deleted_mask()
+            hashes = {}
+            for source in self._partitions["source"].values():
+                rows = self._partitions["source"].rows([source])
+                live = rows[~deleted[rows]]
+                if len(live):
+                    hashes[source] = self._metadatas[int(live[0])].get("doc_hash")
+            return hashes
+
+    def partition_rows(self, key, values):
+        """Rows (deleted ones included) of the given partitions; cost scales with the selection."""
+        with self._lock:
+            return self._partitions[key].rows(values)
+
+    def rows_where(self, where=None, ids=None):
+        with self._lock:
+            if ids is not None:
+                rows = sorted(self._live_row_by_id[i] for i in set(ids) if i in self._live_row_by_id)
+            else:
+                rows = np.flatnonzero(~self.deleted_mask()).tolist()
+            if where:
+                rows = [r for r in rows if matches_where(self._metadatas[r], where)]
+            return rows
+
+    def _allocate(self, capacity, dim):
+        if not self._spill_vectors:
+            return np.empty((capacity, dim), dtype=np.float32)
+        # The mapping keeps the unlinked file alive; it is freed with the matrix
+        with tempfile.TemporaryFile(prefix="pdf_qa_vectors-") as spill:
+            spill.truncate(capacity * dim * 4)
+            return np.memmap(spill, dtype=np.float32, mode="r+", shape=(capacity, dim))
+
+    def _grow(self, needed, dim):
+        if self._matrix is None:
+            self._capacity = max(self._capacity, needed)
+            self._matrix = self._allocate(self._capacity, dim)
+            self._deleted = np.zeros(self._capacity, dtype=bool)
+            return
+        if needed <= self._capacity:
+            return
+        while self._capacity < needed:
+            self._capacity *= 2
+        matrix = self._allocate(self._capacity, dim)
+        matrix[:self._rows] = self._matrix[:self._rows]
+        deleted = np.zeros(self._capacity, dtype=bool)
+        deleted[:self._rows] = self._deleted[:self._rows]
+        self._matrix, self._deleted = matrix, deleted
+
+    def append(self, ids, vectors, texts, metadatas):
+        """Appends rows; rows with an existing id are tombstoned first (upsert)."""
+        vectors = normalize_rows(vectors)
+        if not len(ids):
+            return []
+        with self._lock:
+            if self.dim is not None and vectors.shape[1] != self.dim:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} does not match index dimension {self.dim}")
+            self._grow(self._rows + len(ids), vectors.shape[1])
+            self.delete(ids=[i for i in ids if i in self._live_row_by_id])
+            first_row = self._rows
+            self._matrix[first_row:first_row + len(ids)] = vectors
+            metadatas = metadatas or [{} for _ in ids]
+            for offset, (chunk_id, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+                self._ids.append(chunk_id)
+                self._texts.append(text)
+                self._metadatas.append(metadata or {})
+                self._live_row_by_id[chunk_id] = first_row + offset
+            for key, partition in self._partitions.items():
+                partition.add_many([(m or {}).get(key) for m in metadatas], first_row)
+            self._rows += len(ids)
+            self._version += 1
+            if self._bm25 is not None:
+                self._bm25.add(list(ids), list(texts), [m or {} for m in metadatas])
+            return list(range(first_row, self._rows))
+
+    def delete(self, ids=None, rows=None):
+        with self._lock:
+            if rows is None:
+                rows = [self._live_row_by_id[i] for i in ids if i in self._live_row_by_id]
+            rows = [int(r) for r in rows if not self._deleted[int(r)]]
+            for r in rows:
+                self._deleted[r] = True
+                self._live_row_by_id.pop(self._ids[r], None)
+            if rows:
+                self._version += 1
+                if self._bm25 is not None:
+                    self._bm25.remove([self._ids[r] for r in rows])
+            return len(rows)
+
+    def compact(self):
+        with self._lock:
+            live = np.flatnonzero(~self.deleted_mask())
+            ids = [self._ids[r] for r in live]
+            texts = [self._texts[r] for r in live]
+            metadatas = [self._metadatas[r] for r in live]
+            vectors = self.vectors()[live].copy()
+            bm25, self._bm25 = self._bm25, None # Same live chunks under the same ids; no need to re-tokenize
+            self._reset(generation=self._generation + 1)
+            if len(ids):
+                self.append(ids, vectors, texts, metadatas)
+            self._bm25 = bm25
+
+    def clear(self):
+        with self._lock:
+            self._completed = {}
+            self._bm25 = None
+            self._reset(generation=self._generation + 1)
+            self._version += 1
+
+    def lexical_index(self):
+        """BM25 index over the live chunks, built on first use and then maintained on every write."""
+        with self._lock:
+            if self._bm25 is None:
+                live = np.flatnonzero(~self.deleted_mask())
+                self._bm25 = BM25Index()
+                self._bm25.add([self._ids[r] for r in live], [self._texts[r] for r in live], [self._metadatas[r] for r in live])
+                print(f"--- Built BM25 index from {len(live)} stored chunks ---")
+            return self._bm25
+
+    # --- Document completion markers ---
+
+    def completed_documents(self):
+        with self._lock:
+            return dict(self._completed)
+
+    def mark_complete(self, source_hashes):
+        with self._lock:
+            self._completed.update(source_hashes)
+
+    def forget_documents(self, sources):
+        with self._lock:
+            for source in sources:
+                self._completed.pop(source, None)
@@ -0,0 +1,230 @@
+# core/numpy_store.py
+"""
+LangChain VectorStore over a contiguous NumPy matrix of L2-normalized vectors, so similarity
+is a plain dot product (cosine). The rows live in an index object (InMemoryIndex or
+PersistentIndex); this class handles embedding, filtering and ranking.
+
+Search is exact brute force by default (see core.vector_search). With quantization="int8" or
+"float16" a compressed copy of the matrix is scanned first and only the shortlist is re-ranked
+exactly against the float32 rows, which then stay memory-mapped (on disk, or in a temporary file
+for the default in-memory index) rather than on the heap next to the compressed copy. Filters on "source" or "doc_hash" use the index's partition
+row ranges, so they only scan the selected documents.
+"""
+import time
+import uuid
+import threading
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from core import telemetry
+from core.memory_index import InMemoryIndex
+from core.partitions import partition_filter
+from core.persistent_index import normalize_rows
+from core.vector_search import QUANTIZATION_MODES, QuantizedMatrix, exact_top_k, quantized_top_k, recall_at_k
+
+DEFAULT_SHORTLIST_FACTOR = 4
+
+
+class NumpyVectorStore(VectorStore):
+    def __init__(self, embedding, index=None, quantization=None, shortlist_factor=DEFAULT_SHORTLIST_FACTOR):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"quantization must be one of {QUANTIZATION_MODES}, got {quantization!r}")
+        self._embedding = embedding
+        self.index = index if index is not None else InMemoryIndex(spill_vectors=quantization is not None)
+        self.quantization = quantization
+        self.shortlist_factor = shortlist_factor
+        self._quantized = None
+        self._quantized_generation = None
+        self._quantized_lock = threading.Lock()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    # --- Writes ---
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        vectors = self._embedding.embed_documents(texts)
+        return self.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, **kwargs):
+        """Adds pre-computed (text, vector) pairs; existing ids are replaced."""
+        text_embeddings = list(text_embeddings)
+        if not text_embeddings:
+            return []
+        texts = [t for t, _ in text_embeddings]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        self.index.append(ids, [v for _, v in text_embeddings], texts, metadatas)
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        if ids is None:
+            return False
+        return self.index.delete(ids=ids) > 0
+
+    # --- Reads ---
+
+    def _read_consistent(self, read):
+        """
+        Runs read() again until no compaction or clear switched the index generation while it ran.
+        Row numbers are only meaningful within one generation, and holding the index lock for a
+        whole search would serialize every reader behind it.
+        """
+        while True:
+            generation = self.index.generation
+            try:
+                result = read()
+            except (KeyError, IndexError):
+                if self.index.generation == generation:
+                    raise
+                continue
+            if self.index.generation == generation:
+                return result
+
+    def get(self, ids=None, where=None, include=("metadatas", "documents"), **kwargs):
+        """Chroma-compatible `get`, so list/remove helpers in core.vector_store work unchanged."""
+        def _read():
+            rows = self.index.rows_where(where=where, ids=ids)
+            records = self.index.records(rows) if rows else []
+            vectors = self.index.vectors()[rows].tolist() if rows and "embeddings" in include else []
+            return records, vectors
+
+        records, vectors = self._read_consistent(_read)
+        result = {"ids": [r[0] for r in records], "metadatas": None, "documents": None, "embeddings": None}
+        if "metadatas" in include:
+            result["metadatas"] = [r[2] for r in records]
+        if "documents" in include:
+            result["documents"] = [r[1] for r in records]
+        if "embeddings" in include:
+            result["embeddings"] = vectors
+        return result
+
+    def _quantized_matrix(self, vectors):
+        """The quantized copy, extended in place as the index grows and rebuilt after compaction."""
+        with self._quantized_lock:
+            if self._quantized is None or self._quantized_generation != self.index.generation or len(self._quantized) > len(vectors):
+                self._quantized = QuantizedMatrix(self.quantization)
+                self._quantized_generation = self.index.generation
+            if len(self._quantized) < len(vectors):
+                self._quantized.extend(vectors[len(self._quantized):])
+            return self._quantized
+
+    def _search(self, query_vectors, k, filter=None, exact=None):
+        """Top-k (row, score) lists for a batch of query vectors."""
+        with telemetry.span("search", queries=len(query_vectors), k=k, quantization=self.quantization) as span:
+            row_ids, scores, scanned = self._search_rows(query_vectors, k, filter=filter, exact=exact)
+            span.set(rows_scanned=scanned)
+        return row_ids, scores
+
+    def _search_rows(self, query_vectors, k, filter=None, exact=None):
+        queries = normalize_rows(query_vectors)
+        vectors, deleted = self.index.snapshot()
+        rows, excluded = None, (deleted if deleted.any() else None)
+        partition = partition_filter(filter)
+        if partition:
+            # Only the selected sources' row ranges are scanned; results merge across them
+            rows = self.index.partition_rows(*partition)
+            rows = rows[rows < len(vectors)]
+        elif filter:
+            rows, excluded = np.asarray(self.index.rows_where(where=filter), dtype=np.int64), None
+        use_exact = not self.quantization if exact is None else exact
+        if use_exact:
+            row_ids, scores = exact_top_k(vectors, queries, k, rows=rows, excluded=excluded)
+        else:
+            quantized = self._quantized_matrix(vectors)
+            row_ids, scores = quantized_top_k(
+                vectors, quantized, queries, k, shortlist_factor=self.shortlist_factor, rows=rows, excluded=excluded
+            )
+        return row_ids, scores, (len(vectors) if rows is None else len(rows))
+
+    def similarity_search_by_vectors_with_score(self, embeddings, k=4, filter=None, **kwargs):
+        """Batched search: one matmul per block for all queries. Returns one result list per query."""
+        if len(embeddings) == 0:
+            return []
+        def _read():
+            row_ids, scores = self._search(embeddings, k, filter=filter)
+            unique_rows = np.unique(row_ids)
+            return row_ids, scores, dict(zip(unique_rows.tolist(), self.index.records(unique_rows) if row_ids.size else []))
+
+        row_ids, scores, by_row = self._read_consistent(_read)
+        return [
+            [
+                (Document(page_content=by_row[r][1], metadata=by_row[r][2]), float(s))
+                for r, s in zip(query_rows.tolist(), query_scores.tolist())
+            ]
+            for query_rows, query_scores in zip(row_ids, scores)
+        ]
+
+    def batch_similarity_search(self, queries, k=4, filter=None):
+        vectors = [self._embedding.embed_query(q) for q in queries]
+        return [[doc for doc, _ in hits] for hits in self.similarity_search_by_vectors_with_score(vectors, k=k, filter=filter)]
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vectors_with_score([embedding], k=k, filter=filter)[0]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        vector = self._embedding.embed_query(query)
+        return self.similarity_search_by_vector_with_score(vector, k=k, filter=filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k, filter=filter)]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1.0) / 2.0 # Cosine similarity -> [0, 1]
+
+    # --- Diagnostics ---
+
+    def memory_report(self):
+        """
+        Vector bytes held on the heap (resident_bytes) against a plain float32 matrix. Memory-mapped
+        float32 rows are not counted, since the OS can drop their pages; a quantized copy is.
+        """
+        vectors, _ = self.index.snapshot()
+        float32_bytes = int(vectors.shape[0] * (vectors.shape[1] if vectors.ndim == 2 else 0) * 4)
+        quantized_bytes = self._quantized_matrix(vectors).nbytes if self.quantization else 0
+        resident_bytes = (float32_bytes if self.index.vectors_in_memory else 0) + quantized_bytes
+        report = {
+            "rows": int(vectors.shape[0]),
+            "float32_bytes": float32_bytes,
+            "float32_in_memory": self.index.vectors_in_memory,
+            "quantization": self.quantization,
+            "resident_bytes": resident_bytes,
+            "saved_bytes": float32_bytes - resident_bytes,
+            "ratio": (resident_bytes / float32_bytes) if float32_bytes else 0.0,
+        }
+        if self.quantization:
+            report["quantized_bytes"] = quantized_bytes
+        return report
+
+    def evaluate_quantization(self, query_vectors, k=5):
+        """
+        Recall@k of the quantized search against exact float32 search on the same queries,
+        with the latency of both, so the memory/recall trade-off can be checked on real data.
+        """
+        if not self.quantization:
+            raise ValueError("evaluate_quantization needs a store created with quantization='int8' or 'float16'")
+        started = time.perf_counter()
+        exact_rows, _ = self._search(query_vectors, k, exact=True)
+        exact_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        approx_rows, _ = self._search(query_vectors, k, exact=False)
+        approx_ms = (time.perf_counter() - started) * 1000
+        return dict(
+            self.memory_report(),
+            k=k,
+            queries=len(query_vectors),
+            recall_at_k=recall_at_k(exact_rows, approx_rows),
+            exact_ms=exact_ms,
+            quantized_ms=approx_ms,
+        )
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, index=None, **kwargs):
+        store = cls(embedding, index, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -0,0 +1,56 @@
+# core/partitions.py
+"""
+Partition value (e.g. source filename) -> row ranges, so a filtered search only touches the
+rows of the selected partitions. Chunks of one file are appended together, so each source is
+usually a single contiguous [start, stop) range.
+"""
+import numpy as np
+
+PARTITION_KEYS = ("source", "doc_hash")
+
+
+class RowRangeMap:
+    def __init__(self):
+        self._ranges = {}
+
+    def add(self, value, row):
+        ranges = self._ranges.setdefault(value, [])
+        if ranges and ranges[-1][1] == row:
+            ranges[-1][1] = row + 1
+        else:
+            ranges.append([row, row + 1])
+
+    def add_many(self, values, first_row):
+        for offset, value in enumerate(values):
+            if value is not None:
+                self.add(value, first_row + offset)
+
+    def rows(self, values):
+        """Sorted row numbers of every selected partition (deleted rows included)."""
+        ranges = [r for value in set(values) for r in self._ranges.get(value, [])]
+        if not ranges:
+            return np.empty(0, dtype=np.int64)
+        ranges.sort()
+        return np.concatenate([np.arange(start, stop, dtype=np.int64) for start, stop in ranges])
+
+    def values(self):
+        return list(self._ranges)
+
+
+def partition_filter(filter, keys=PARTITION_KEYS):
+    """
+    Returns (key, values) when `filter` selects whole partitions, i.e. {key: value} or
+    {key: {"$in": [...]}} on a partitioned key; None for anything else.
+    """
+    if not filter or len(filter) != 1:
+        return None
+    key, condition = next(iter(filter.items()))
+    if key not in keys:
+        return None
+    if isinstance(condition, dict):
+        if set(condition) == {"$in"}:
+            return key, list(condition["$in"])
+        if set(condition) == {"$eq"}:
+            return key, [condition["$eq"]]
+        return None
+    return key, [condition]
@@ -1,28 +1,344 @@
 import os
-from langchain_community.document_loaders import PyMuPDFLoader
+import time
+import hashlib
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Tuple
+import fitz  # PyMuPDF
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from core import telemetry
 
-def process_pdfs(pdf_files_paths):
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+PAGES_PER_TASK = 50 # Large files are split into page ranges of this size for the process pool
+
+_Task = namedtuple("_Task", ["pdf_path", "start", "stop", "total_pages", "doc_hash", "error"])
+# What a worker receives for an in-memory PDF: the name of a shared memory block holding its bytes
+_SharedPdf = namedtuple("_SharedPdf", ["name", "shm_name", "size"])
+
+
+@dataclass
+class PdfBytes:
+    """
+    A PDF held in memory (e.g. a Streamlit upload): its file name and a bytes-like buffer such as
+    the memoryview from UploadedFile.getbuffer(). It is extracted straight from the buffer,
+    without a temp file.
+    """
+    name: str
+    data: Any
+
+
+@dataclass
+class FileError:
+    """A structured per-file (or per page range) extraction failure."""
+    source: str
+    error: str
+    page_range: Optional[Tuple[int, int]] = None
+
+
+@dataclass
+class ChunkBatch:
+    """Chunks for one page range of one file, yielded in deterministic order."""
+    source: str
+    page_range: Tuple[int, int]
+    total_pages: int
+    doc_hash: Optional[str] = None
+    chunks: List[Document] = field(default_factory=list)
+    errors: List[FileError] = field(default_factory=list)
+    load_ms: float = 0.0 # Page text extraction time (in the worker that produced the batch)
+    split_ms: float = 0.0
+
+
+def file_content_hash(pdf_path):
+    """sha256 of the file bytes; identifies a document version independent of its filename."""
+    if isinstance(pdf_path, PdfBytes):
+        return hashlib.sha256(pdf_path.data).hexdigest()
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_name(pdf):
+    """The 'source' metadata value for a path or PdfBytes: the bare file name."""
+    return pdf.name if isinstance(pdf, (PdfBytes, _SharedPdf)) else os.path.basename(pdf)
+
+
+def _open_pdf(pdf):
+    if isinstance(pdf, PdfBytes):
+        return fitz.open(stream=pdf.data, filetype="pdf")
+    return fitz.open(pdf)
+
+
+@contextmanager
+def _opened_pdf(pdf):
+    """Opens a path, PdfBytes or _SharedPdf; a shared block is detached again once the document is closed."""
+    if not isinstance(pdf, _SharedPdf):
+        with _open_pdf(pdf) as pdf_doc:
+            yield pdf_doc
+        return
+    shm = shared_memory.SharedMemory(name=pdf.shm_name)
+    data = shm.buf[:pdf.size]
+    try:
+        with fitz.open(stream=data, filetype="pdf") as pdf_doc:
+            yield pdf_doc
+    finally:
+        data.release()
+        shm.close()
+
+
+def source_chunk_id(source, content_id):
+    """
+    The chunk_id of a content-keyed chunk ("<doc_hash>:<page>:<position>") under one file name,
+    so byte-identical files indexed under different names do not overwrite each other.
+    """
+    return f"{hashlib.sha256(source.encode('utf-8')).hexdigest()[:12]}/{content_id}"
+
+
+def content_chunk_id(chunk_id):
+    """The file-name-independent part of a chunk_id, shared by every copy of the same file."""
+    return chunk_id.rpartition("/")[2]
+
+
+def assign_chunk_ids(chunks, doc_hash):
+    """
+    Tags chunks with the document hash and a stable chunk_id derived from (source, doc_hash,
+    page, position on page), so re-processing an unchanged file produces identical IDs.
+    """
+    position_on_page = {}
+    for chunk in chunks:
+        page = chunk.metadata.get("page", 0)
+        position = position_on_page.get(page, 0)
+        position_on_page[page] = position + 1
+        chunk.metadata["doc_hash"] = doc_hash
+        chunk.metadata["chunk_id"] = source_chunk_id(chunk.metadata.get("source", ""), f"{doc_hash[:32]}:{page}:{position}")
+    return chunks
+
+
+def _make_text_splitter():
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len,
+    )
+
+
+def _page_documents(pdf_doc, pdf, start, stop):
+    """Yields one Document per page in [start, stop), with the same metadata PyMuPDFLoader produces."""
+    doc_metadata = {k: v for k, v in pdf_doc.metadata.items() if type(v) in [str, int]}
+    for page_number in range(start, stop):
+        page = pdf_doc.load_page(page_number)
+        yield Document(
+            page_content=page.get_text(),
+            metadata=dict(
+                doc_metadata,
+                source=source_name(pdf), # Consistent key for filtering
+                file_path=pdf.name if isinstance(pdf, (PdfBytes, _SharedPdf)) else pdf,
+                page=page_number,
+                total_pages=len(pdf_doc),
+            ),
+        )
+
+
+def _split_pages(pdf_doc, pdf, start, stop, text_splitter):
+    """
+    Streams pages into the splitter one at a time, so only the current page's text is held.
+    Returns (chunks, load_ms, split_ms).
+    """
+    chunks, load_ms, split_ms = [], 0.0, 0.0
+    pages = _page_documents(pdf_doc, pdf, start, stop)
+    while True:
+        loading = time.perf_counter()
+        page_doc = next(pages, None)
+        splitting = time.perf_counter()
+        load_ms += (splitting - loading) * 1000
+        if page_doc is None:
+            return chunks, load_ms, split_ms
+        chunks.extend(text_splitter.split_documents([page_doc]))
+        split_ms += (time.perf_counter() - splitting) * 1000
+
+
+def _process_page_range(pdf, start, stop, doc_hash):
+    """
+    Process-pool worker (or inline for small PdfBytes): extracts and splits one page range of one
+    file. Returns (chunks, load_ms, split_ms); workers cannot report spans themselves.
+    """
+    with _opened_pdf(pdf) as pdf_doc:
+        chunks, load_ms, split_ms = _split_pages(pdf_doc, pdf, start, stop, _make_text_splitter())
+    return assign_chunk_ids(chunks, doc_hash), load_ms, split_ms
+
+
+def _plan_tasks(pdf_files_paths, pages_per_task):
+    """Splits every file into page-range tasks. Files that cannot be opened become error tasks."""
+    tasks = []
+    for pdf_path in pdf_files_paths:
+        source = source_name(pdf_path)
+        try:
+            doc_hash = file_content_hash(pdf_path)
+            with _open_pdf(pdf_path) as pdf_doc:
+                total_pages = len(pdf_doc)
+        except Exception as e:
+            tasks.append(_Task(pdf_path, 0, 0, 0, None, FileError(source=source, error=str(e))))
+            continue
+        for start in range(0, total_pages, pages_per_task):
+            tasks.append(_Task(pdf_path, start, min(start + pages_per_task, total_pages), total_pages, doc_hash, None))
+    return tasks
+
+
+def iter_process_pdfs(pdf_files_paths, max_workers=None, pages_per_task=PAGES_PER_TASK):
+    """
+    Extracts and chunks PDFs in parallel, yielding a ChunkBatch per page range as soon as it
+    (and every batch before it) is ready. Batches come out in file order, then page order, so
+    callers can start indexing before extraction has finished.
+    Items may be file paths or PdfBytes. A PdfBytes that spans several page ranges is copied
+    once into a shared memory block that every worker reads its pages from; the block is
+    unlinked after the file's last batch. Single-range PdfBytes are extracted in the calling
+    process, straight from their buffer, since one task gains nothing from a worker.
+    max_workers=1 runs everything in the calling process.
+    """
+    tasks = _plan_tasks(pdf_files_paths, pages_per_task)
+    max_workers = max_workers or os.cpu_count() or 1
+    shared_blocks = {} # id(PdfBytes) -> [SharedMemory, size, tasks of that file not yet yielded]
+
+    def _in_pool(task):
+        if task.error is not None:
+            return False
+        return not isinstance(task.pdf_path, PdfBytes) or task.total_pages > pages_per_task
+
+    def _shared_pdf(pdf, task_count):
+        """The _SharedPdf for `pdf`, copying its bytes into shared memory on first use."""
+        if id(pdf) not in shared_blocks:
+            data = memoryview(pdf.data).cast("B")
+            shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+            shm.buf[:data.nbytes] = data
+            shared_blocks[id(pdf)] = [shm, data.nbytes, task_count]
+        shm, size, _ = shared_blocks[id(pdf)]
+        return _SharedPdf(pdf.name, shm.name, size)
+
+    def _release_shared(pdf):
+        """Unlinks a file's shared block once its last batch was yielded."""
+        block = shared_blocks.get(id(pdf))
+        if block is not None:
+            block[2] -= 1
+            if not block[2]:
+                del shared_blocks[id(pdf)]
+                block[0].close()
+                block[0].unlink()
+
+    def _to_batch(task, result=None, error=None):
+        batch = ChunkBatch(
+            source=source_name(task.pdf_path),
+            page_range=(task.start, task.stop),
+            total_pages=task.total_pages,
+            doc_hash=task.doc_hash,
+        )
+        if task.error is not None:
+            batch.errors.append(task.error)
+        elif error is not None:
+            batch.errors.append(FileError(source=batch.source, error=str(error), page_range=batch.page_range))
+        else:
+            batch.chunks, batch.load_ms, batch.split_ms = result
+            pages = task.stop - task.start
+            telemetry.record("load", batch.load_ms, source=batch.source, pages=pages)
+            telemetry.record("split", batch.split_ms, source=batch.source, chunks=len(batch.chunks))
+            telemetry.increment("pages", pages)
+            telemetry.increment("chunks", len(batch.chunks))
+        return batch
+
+    def _submit(executor, task):
+        if not _in_pool(task):
+            return None # Error batch, or extracted inline when its turn comes
+        pdf = task.pdf_path
+        if isinstance(pdf, PdfBytes):
+            pdf = _shared_pdf(pdf, -(-task.total_pages // pages_per_task))
+        return executor.submit(_process_page_range, pdf, task.start, task.stop, task.doc_hash)
+
+    def _run_inline(task):
+        if task.error is not None:
+            return _to_batch(task)
+        try:
+            return _to_batch(task, result=_process_page_range(task.pdf_path, task.start, task.stop, task.doc_hash))
+        except Exception as e:
+            return _to_batch(task, error=e)
+
+    if max_workers == 1 or not any(_in_pool(task) for task in tasks):
+        for task in tasks:
+            yield _run_inline(task)
+        return
+
+    # Keep a bounded window of in-flight tasks so memory does not grow with the whole batch
+    window = max_workers * 2
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            task_iter = iter(tasks)
+            for task in task_iter:
+                pending.append((task, _submit(executor, task)))
+                if len(pending) >= window:
+                    break
+            while pending:
+                task, future = pending.popleft()
+                if future is None:
+                    yield _run_inline(task)
+                else:
+                    try:
+                        batch = _to_batch(task, result=future.result())
+                    except Exception as e:
+                        batch = _to_batch(task, error=e)
+                    if isinstance(task.pdf_path, PdfBytes):
+                        _release_shared(task.pdf_path)
+                    yield batch
+                next_task = next(task_iter, None)
+                if next_task is not None:
+                    pending.append((next_task, _submit(executor, next_task)))
+    finally:
+        # Abandoned or failed runs: workers are done (the executor was shut down), so unlink what is left
+        for shm, _, _ in shared_blocks.values():
+            shm.close()
+            shm.unlink()
+        shared_blocks.clear()
+
+
+def process_pdfs(pdf_files_paths, parallel=False, max_workers=None, errors=None):
+    """
+    Loads and chunks every PDF. With parallel=True, extraction runs on a process pool
+    (see iter_process_pdfs). Per-file failures are appended to `errors` as FileError records
+    when a list is passed in.
+    """
     all_docs_for_db = []
+    if parallel:
+        for batch in iter_process_pdfs(pdf_files_paths, max_workers=max_workers):
+            all_docs_for_db.extend(batch.chunks)
+            for error in batch.errors:
+                print(f"Error processing {error.source} (pages {error.page_range}): {error.error}")
+                if errors is not None:
+                    errors.append(error)
+        print(f"Processed and chunked {len(pdf_files_paths)} PDF(s) in parallel -> {len(all_docs_for_db)} chunks")
+        return all_docs_for_db
+
+    text_splitter = _make_text_splitter()
     for pdf_path in pdf_files_paths:
         try:
-            loader = PyMuPDFLoader(pdf_path)
-            documents_from_pdf_pages = loader.load() 
-
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len,
-            )
-            
-            for doc_page in documents_from_pdf_pages:
-                doc_page.metadata["source"] = os.path.basename(pdf_path) # Consistent key for filtering
-
-            split_chunks = text_splitter.split_documents(documents_from_pdf_pages)
+            # Pages stream into the splitter one by one instead of being loaded all at once
+            with _open_pdf(pdf_path) as pdf_doc:
+                page_count = len(pdf_doc)
+                split_chunks, load_ms, split_ms = _split_pages(pdf_doc, pdf_path, 0, page_count, text_splitter)
+            telemetry.record("load", load_ms, source=source_name(pdf_path), pages=page_count)
+            telemetry.record("split", split_ms, source=source_name(pdf_path), chunks=len(split_chunks))
+            telemetry.increment("pages", page_count)
+            telemetry.increment("chunks", len(split_chunks))
+            split_chunks = assign_chunk_ids(split_chunks, file_content_hash(pdf_path))
             all_docs_for_db.extend(split_chunks)
-            print(f"Processed and chunked {os.path.basename(pdf_path)}: {len(documents_from_pdf_pages)} pages -> {len(split_chunks)} chunks")
+            print(f"Processed and chunked {source_name(pdf_path)}: {page_count} pages -> {len(split_chunks)} chunks")
         except Exception as e:
-            print(f"Error processing {os.path.basename(pdf_path)}: {e}")
+            print(f"Error processing {source_name(pdf_path)}: {e}")
+            if errors is not None:
+                errors.append(FileError(source=source_name(pdf_path), error=str(e)))
             continue
-            
+
     return all_docs_for_db
@@ -0,0 +1,475 @@
+# core/persistent_index.py
+"""
+On-disk vector index: a contiguous float32 matrix in a raw file (memory-mapped on open)
+plus a SQLite sidecar holding chunk ids, text and metadata.
+
+Layout of an index directory:
+    manifest.json            format name/version, dimension, current generation
+    vectors-<gen>.f32        row-major float32 matrix, one L2-normalized row per chunk
+    chunks-<gen>.sqlite3     row -> (id, text, metadata, deleted) plus the committed row count
+
+The SQLite transaction is the commit point: vectors are appended and fsynced first, then the
+rows and the new committed row count are written in one transaction. On open, anything in the
+vector file past the committed count (a torn append) is truncated away. Compaction writes a
+new generation of both files and switches to it by atomically replacing the manifest.
+"""
+import os
+import json
+import shutil
+import sqlite3
+import threading
+import numpy as np
+from core.partitions import PARTITION_KEYS, RowRangeMap
+
+FORMAT_NAME = "pdf-qa-index"
+FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+CHECKPOINT_DIR = "checkpoints" # Ingest checkpoints for this index (see core.vector_store.ingest_checkpoint_path)
+_DTYPE = np.float32
+_SQLITE_MAX_PARAMS = 500
+
+
+class IndexFormatError(Exception):
+    """Raised when an index directory was written by an incompatible format version."""
+
+
+def _atomic_write_json(path, payload):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=_DTYPE)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def matches_where(metadata, where):
+    """Evaluates the subset of Chroma's `where` syntax the app uses against one metadata dict."""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, c) for c in condition):
+                return False
+        elif isinstance(condition, dict):
+            for op, value in condition.items():
+                actual = metadata.get(key)
+                if op == "$in" and actual not in value:
+                    return False
+                if op == "$nin" and actual in value:
+                    return False
+                if op == "$eq" and actual != value:
+                    return False
+                if op == "$ne" and actual == value:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+class PersistentIndex:
+    """
+    A versioned, crash-safe on-disk index. Opening it only reads the manifest, maps the
+    vector file and connects to SQLite, so cold start does not depend on the index size.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = threading.RLock()
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                self._manifest = json.load(f)
+            if self._manifest.get("format") != FORMAT_NAME or self._manifest.get("version") != FORMAT_VERSION:
+                raise IndexFormatError(
+                    f"Index at {self.path} has format {self._manifest.get('format')} v{self._manifest.get('version')}, "
+                    f"expected {FORMAT_NAME} v{FORMAT_VERSION}"
+                )
+        else:
+            self._manifest = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "dim": None, "generation": 0}
+            _atomic_write_json(manifest_path, self._manifest)
+        self._conn = None
+        self._version = 0
+        self._bm25 = None # Built on the first hybrid search, then kept current by append/delete
+        self._open_generation()
+
+    # --- File management ---
+
+    def _vectors_path(self, generation=None):
+        return os.path.join(self.path, f"vectors-{self._generation if generation is None else generation}.f32")
+
+    def _chunks_path(self, generation=None):
+        return os.path.join(self.path, f"chunks-{self._generation if generation is None else generation}.sqlite3")
+
+    @staticmethod
+    def _connect(db_path):
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " row INTEGER PRIMARY KEY,"
+            " id TEXT NOT NULL,"
+            " source TEXT,"
+            " text TEXT NOT NULL,"
+            " metadata TEXT NOT NULL,"
+            " deleted INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_id ON chunks (id)")
+        # Covers source filters and the per-source listing (source_hashes) without touching row data
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_source_live ON chunks (source, deleted)")
+        conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO state (key, value) VALUES ('committed_rows', 0)")
+        has_documents = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'documents'").fetchone()
+        # source -> doc_hash of documents whose indexing finished (see core.vector_store.finish_indexing)
+        conn.execute("CREATE TABLE IF NOT EXISTS documents (source TEXT PRIMARY KEY, doc_hash TEXT)")
+        if not has_documents:
+            # Indexes written before completion markers existed: what they hold was always treated as complete
+            conn.execute(
+                "INSERT INTO documents (source, doc_hash) "
+                "SELECT source, MAX(json_extract(metadata, '$.doc_hash')) FROM chunks "
+                "WHERE deleted = 0 AND source IS NOT NULL GROUP BY source"
+            )
+        conn.commit()
+        return conn
+
+    def _open_generation(self):
+        self._generation = self._manifest["generation"]
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = self._connect(self._chunks_path())
+        self._rows = self._conn.execute("SELECT value FROM state WHERE key = 'committed_rows'").fetchone()[0]
+        self._recover()
+        self._remove_stale_generations()
+        self._map_vectors()
+        self._deleted_mask = None
+        self._partitions = None # Built on the first filtered search, so opening stays O(1)
+
+    def _recover(self):
+        """Drops anything written after the last committed transaction."""
+        vectors_path = self._vectors_path()
+        if not os.path.exists(vectors_path):
+            open(vectors_path, "wb").close()
+        dim = self._manifest["dim"]
+        expected_bytes = self._rows * (dim or 0) * np.dtype(_DTYPE).itemsize
+        if os.path.getsize(vectors_path) > expected_bytes:
+            print(f"--- Persistent index: truncating uncommitted vector data in {vectors_path} ---")
+            with open(vectors_path, "rb+") as f:
+                f.truncate(expected_bytes)
+        self._conn.execute("DELETE FROM chunks WHERE row >= ?", (self._rows,))
+        self._conn.commit()
+
+    def _remove_stale_generations(self):
+        current = {os.path.basename(self._vectors_path()), os.path.basename(self._chunks_path())}
+        for name in os.listdir(self.path):
+            if (name.startswith("vectors-") or name.startswith("chunks-")) and not any(name.startswith(c) for c in current):
+                os.remove(os.path.join(self.path, name))
+
+    def _map_vectors(self):
+        dim = self._manifest["dim"]
+        if not self._rows or not dim:
+            self._vectors = np.empty((0, dim or 0), dtype=_DTYPE)
+        else:
+            self._vectors = np.memmap(self._vectors_path(), dtype=_DTYPE, mode="r", shape=(self._rows, dim))
+
+    # --- Read API ---
+
+    @property
+    def dim(self):
+        return self._manifest["dim"]
+
+    @property
+    def rows(self):
+        """Number of committed rows, including deleted ones."""
+        return self._rows
+
+    @property
+    def version(self):
+        """
+        Bumped by every write through this instance (open_persistent_index shares one per path),
+        so state derived from the contents (e.g. fingerprints) can be revalidated.
+        """
+        return self._version
+
+    @property
+    def generation(self):
+        """Bumped whenever existing rows are renumbered (compaction)."""
+        return self._generation
+
+    @property
+    def vectors_in_memory(self):
+        """Always False: the float32 rows are memory-mapped from the vectors file."""
+        return False
+
+    def __len__(self):
+        return self._rows - int(self.deleted_mask().sum())
+
+    def vectors(self):
+        """The (rows, dim) float32 matrix. Memory-mapped: pages are only read when touched."""
+        return self._vectors
+
+    def deleted_mask(self):
+        with self._lock:
+            if self._deleted_mask is None:
+                mask = np.zeros(self._rows, dtype=bool)
+                deleted = [r for (r,) in self._conn.execute("SELECT row FROM chunks WHERE deleted = 1")]
+                if deleted:
+                    mask[np.asarray(deleted, dtype=np.int64)] = True
+                self._deleted_mask = mask
+            return self._deleted_mask
+
+    def snapshot(self):
+        """(vectors, deleted_mask) taken together, so a concurrent append cannot skew them."""
+        with self._lock:
+            vectors = self.vectors()
+            return vectors, self.deleted_mask()[:len(vectors)]
+
+    def records(self, rows):
+        """Returns [(id, text, metadata)] aligned with `rows`."""
+        rows = [int(r) for r in rows]
+        found = {}
+        with self._lock:
+            for start in range(0, len(rows), _SQLITE_MAX_PARAMS):
+                batch = rows[start:start + _SQLITE_MAX_PARAMS]
+                placeholders = ",".join("?" * len(batch))
+                for row, chunk_id, text, metadata in self._conn.execute(
+                    f"SELECT row, id, text, metadata FROM chunks WHERE row IN ({placeholders})", batch
+                ):
+                    found[row] = (chunk_id, text, json.loads(metadata))
+        return [found[r] for r in rows]
+
+    def source_hashes(self):
+        """
+        {source: doc_hash} of the live rows. Answered from the source index plus one row per
+        source, so listing documents does not read or parse every chunk.
+        """
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT chunks.source, json_extract(chunks.metadata, '$.doc_hash') FROM chunks JOIN ("
+                " SELECT MIN(row) AS first_row FROM chunks WHERE deleted = 0 AND source IS NOT NULL GROUP BY source"
+                ") ON chunks.row = first_row"
+            ))
+
+    def partition_rows(self, key, values):
+        """Rows (deleted ones included) of the given partitions; cost scales with the selection."""
+        with self._lock:
+            if self._partitions is None:
+                partitions = {k: RowRangeMap() for k in PARTITION_KEYS}
+                columns = ", ".join(f"json_extract(metadata, '$.{k}')" for k in PARTITION_KEYS)
+                for row, *values_for_row in self._conn.execute(f"SELECT row, {columns} FROM chunks ORDER BY row"):
+                    for k, value in zip(PARTITION_KEYS, values_for_row):
+                        if value is not None:
+                            partitions[k].add(value, row)
+                self._partitions = partitions
+            return self._partitions[key].rows(values)
+
+    def rows_where(self, where=None, ids=None):
+        """Live rows matching `where` / `ids`, in row order."""
+        query = "SELECT row, metadata FROM chunks WHERE deleted = 0"
+        params = []
+        if ids is not None:
+            ids = list(ids)
+            if not ids:
+                return []
+            if len(ids) <= _SQLITE_MAX_PARAMS:
+                query += f" AND id IN ({','.join('?' * len(ids))})"
+                params.extend(ids)
+        # "source" has its own indexed column, so the common filter never parses JSON
+        source_condition = (where or {}).get("source")
+        if isinstance(source_condition, str):
+            query += " AND source = ?"
+            params.append(source_condition)
+        elif isinstance(source_condition, dict) and set(source_condition) == {"$in"} and len(source_condition["$in"]) <= _SQLITE_MAX_PARAMS:
+            query += f" AND source IN ({','.join('?' * len(source_condition['$in']))})"
+            params.extend(source_condition["$in"])
+        query += " ORDER BY row"
+        id_set = set(ids) if ids is not None else None
+        with self._lock:
+            result = []
+            for row, metadata in self._conn.execute(query, params):
+                if where and not matches_where(json.loads(metadata), where):
+                    continue
+                result.append(row)
+        if id_set is not None and len(id_set) > _SQLITE_MAX_PARAMS:
+            kept = {r for r, rec in zip(result, self.records(result)) if rec[0] in id_set}
+            result = [r for r in result if r in kept]
+        return result
+
+    # --- Write API ---
+
+    def append(self, ids, vectors, texts, metadatas):
+        """
+        Appends rows atomically. Existing rows with the same ids are tombstoned in the same
+        transaction, so this behaves as an upsert. Vectors are L2-normalized on the way in.
+        """
+        vectors = normalize_rows(vectors)
+        if len(ids) != len(vectors) or len(ids) != len(texts):
+            raise ValueError("ids, vectors and texts must have the same length")
+        if not len(ids):
+            return []
+        with self._lock:
+            if self._manifest["dim"] is None:
+                self._manifest = dict(self._manifest, dim=int(vectors.shape[1]))
+                _atomic_write_json(os.path.join(self.path, MANIFEST_FILE), self._manifest)
+            elif vectors.shape[1] != self._manifest["dim"]:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} does not match index dimension {self._manifest['dim']}")
+
+            first_row = self._rows
+            vectors_path = self._vectors_path()
+            with open(vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            new_rows = list(range(first_row, first_row + len(ids)))
+            metadatas = metadatas or [{} for _ in ids]
+            try:
+                with self._conn: # One transaction: tombstones, new rows and the committed count
+                    for start in range(0, len(ids), _SQLITE_MAX_PARAMS):
+                        batch = list(ids[start:start + _SQLITE_MAX_PARAMS])
+                        self._conn.execute(
+                            f"UPDATE chunks SET deleted = 1 WHERE deleted = 0 AND id IN ({','.join('?' * len(batch))})", batch
+                        )
+                    self._conn.executemany(
+                        "INSERT INTO chunks (row, id, source, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                        [
+                            (row, chunk_id, (meta or {}).get("source"), text, json.dumps(meta or {}))
+                            for row, chunk_id, text, meta in zip(new_rows, ids, texts, metadatas)
+                        ],
+                    )
+                    self._conn.execute("UPDATE state SET value = ? WHERE key = 'committed_rows'", (first_row + len(ids),))
+            except Exception:
+                with open(vectors_path, "rb+") as f:
+                    f.truncate(first_row * self._manifest["dim"] * np.dtype(_DTYPE).itemsize)
+                raise
+            if self._partitions is not None:
+                for key, partition in self._partitions.items():
+                    partition.add_many([(m or {}).get(key) for m in metadatas], first_row)
+            self._rows = first_row + len(ids)
+            self._map_vectors()
+            self._deleted_mask = None
+            self._version += 1
+            if self._bm25 is not None:
+                self._bm25.add(list(ids), list(texts), [meta or {} for meta in metadatas])
+            return new_rows
+
+    def delete(self, ids=None, rows=None):
+        """Tombstones rows by id or row number. Returns the number of rows deleted."""
+        with self._lock:
+            if rows is None:
+                rows = self.rows_where(ids=ids)
+            rows = [int(r) for r in rows]
+            if self._bm25 is not None:
+                self._bm25.remove([record[0] for record in self.records(rows)])
+            with self._conn:
+                for start in range(0, len(rows), _SQLITE_MAX_PARAMS):
+                    batch = rows[start:start + _SQLITE_MAX_PARAMS]
+                    self._conn.execute(f"UPDATE chunks SET deleted = 1 WHERE row IN ({','.join('?' * len(batch))})", batch)
+            self._deleted_mask = None
+            self._version += 1
+            return len(rows)
+
+    def compact(self):
+        """Rewrites only live rows into a new generation and atomically switches to it."""
+        with self._lock:
+            live_rows = np.flatnonzero(~self.deleted_mask())
+            new_generation = self._generation + 1
+            new_vectors_path = self._vectors_path(new_generation)
+            new_chunks_path = self._chunks_path(new_generation)
+            for stale in (new_vectors_path, new_chunks_path):
+                if os.path.exists(stale):
+                    os.remove(stale)
+            with open(new_vectors_path, "wb") as f:
+                for start in range(0, len(live_rows), 65536): # Bounded memory for large indexes
+                    f.write(np.ascontiguousarray(self._vectors[live_rows[start:start + 65536]]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            new_conn = self._connect(new_chunks_path)
+            new_conn.execute("ATTACH DATABASE ? AS old", (self._chunks_path(),))
+            with new_conn:
+                new_conn.execute(
+                    "INSERT INTO chunks (row, id, source, text, metadata) "
+                    "SELECT ROW_NUMBER() OVER (ORDER BY row) - 1, id, source, text, metadata "
+                    "FROM old.chunks WHERE deleted = 0 ORDER BY row"
+                )
+                new_conn.execute("UPDATE state SET value = ? WHERE key = 'committed_rows'", (len(live_rows),))
+                new_conn.execute("INSERT INTO documents (source, doc_hash) SELECT source, doc_hash FROM old.documents")
+            new_conn.execute("DETACH DATABASE old")
+            new_conn.close()
+            self._manifest = dict(self._manifest, generation=new_generation)
+            _atomic_write_json(os.path.join(self.path, MANIFEST_FILE), self._manifest)
+            self._vectors = None
+            self._open_generation()
+            print(f"--- Persistent index compacted to generation {new_generation}: {len(live_rows)} live rows ---")
+
+    def clear(self):
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM documents")
+            self._bm25 = None
+            shutil.rmtree(os.path.join(self.path, CHECKPOINT_DIR), ignore_errors=True)
+            self.delete(rows=range(self._rows))
+            self.compact()
+
+    def lexical_index(self):
+        """
+        BM25 index over the live chunks, built on first use (which reads every chunk's text, so
+        only hybrid retrieval asks for it) and then maintained on every write.
+        """
+        from core.lexical_index import BM25Index # lexical_index imports this module
+        with self._lock:
+            if self._bm25 is None:
+                ids, texts, metadatas = [], [], []
+                for chunk_id, text, metadata in self._conn.execute("SELECT id, text, metadata FROM chunks WHERE deleted = 0 ORDER BY row"):
+                    ids.append(chunk_id)
+                    texts.append(text)
+                    metadatas.append(json.loads(metadata))
+                self._bm25 = BM25Index()
+                self._bm25.add(ids, texts, metadatas)
+                print(f"--- Built BM25 index from {len(ids)} stored chunks ---")
+            return self._bm25
+
+    # --- Document completion markers ---
+
+    def completed_documents(self):
+        """{source: doc_hash} of documents whose indexing finished."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT source, doc_hash FROM documents"))
+
+    def mark_complete(self, source_hashes):
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO documents (source, doc_hash) VALUES (?, ?)", list(source_hashes.items()))
+
+    def forget_documents(self, sources):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM documents WHERE source = ?", [(source,) for source in sources])
+
+    def close(self):
+        with self._lock:
+            self._vectors = None
+            self._conn.close()
+
+
+_open_indexes = {}
+_open_indexes_lock = threading.Lock()
+
+
+def open_persistent_index(path):
+    """Returns the process-wide PersistentIndex for `path`, so every session shares one writer."""
+    key = os.path.abspath(path)
+    with _open_indexes_lock:
+        if key not in _open_indexes:
+            _open_indexes[key] = PersistentIndex(key)
+        return _open_indexes[key]
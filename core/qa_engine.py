@@ -1,20 +1,17 @@
+import time
+import hashlib
+import threading
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.chains import RetrievalQA
+from langchain.chains.question_answering import load_qa_chain
 from langchain.prompts import PromptTemplate
+from core import telemetry
+from core.context_packing import estimate_tokens
 
-def get_qa_chain(google_api_key, retriever):
-    try:
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash-lite", 
-            google_api_key=google_api_key,
-            temperature=0.5,
-            convert_system_message_to_human=True
-        )
-    except Exception as e:
-        print(f"Error initializing ChatGoogleGenerativeAI: {e}")
-        raise
+LLM_MODEL = "gemini-2.5-flash-lite"
+LLM_TEMPERATURE = 0.5
 
-    prompt_template_str = """You are an AI assistant. Your task is to answer questions based ONLY on the provided context.
+QA_PROMPT_TEMPLATE = """You are an AI assistant. Your task is to answer questions based ONLY on the provided context.
 If the answer is not found in the context, explicitly state "The answer is not found in the provided documents."
 Do not make up information or answer from your general knowledge.
 When you use information from the context, you MUST cite the source.
@@ -29,47 +26,220 @@ Context:
 Question: {question}
 
 Helpful Answer (Remember to cite sources from the context if information is used):"""
-    
-    PROMPT = PromptTemplate(
-        template=prompt_template_str, input_variables=["context", "question"]
-    )
 
-    chain_type_kwargs = {"prompt": PROMPT}
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        chain_type="stuff",
+# Compiled once per process and shared by every chain
+QA_PROMPT = PromptTemplate(template=QA_PROMPT_TEMPLATE, input_variables=["context", "question"])
+
+# Process-wide pools: one LLM client per (API key, model config), and one "stuff" answer
+# chain per LLM. Sessions and chat turns share them, so the client's connection pool and
+# the compiled prompt are reused; only the retriever changes per call.
+_llm_pool = {}
+_answer_chain_pool = {}
+_pool_lock = threading.Lock()
+
+def _api_key_id(google_api_key):
+    return hashlib.sha256((google_api_key or "").encode("utf-8")).hexdigest()
+
+def get_llm(google_api_key, model=LLM_MODEL, temperature=LLM_TEMPERATURE):
+    """Shared ChatGoogleGenerativeAI client for this API key and model config."""
+    key = (_api_key_id(google_api_key), model, temperature)
+    with _pool_lock:
+        llm = _llm_pool.get(key)
+        if llm is None:
+            try:
+                llm = ChatGoogleGenerativeAI(
+                    model=model, 
+                    google_api_key=google_api_key,
+                    temperature=temperature,
+                    convert_system_message_to_human=True
+                )
+            except Exception as e:
+                print(f"Error initializing ChatGoogleGenerativeAI: {e}")
+                raise
+            print(f"--- Created pooled LLM client for model {model} (pool size: {len(_llm_pool) + 1}) ---")
+            _llm_pool[key] = llm
+        return llm
+
+def get_answer_chain(llm):
+    """Shared "stuff" documents chain (QA_PROMPT + llm) for an LLM instance."""
+    with _pool_lock:
+        entry = _answer_chain_pool.get(id(llm))
+        if entry is None or entry[0] is not llm:
+            entry = (llm, load_qa_chain(llm, chain_type="stuff", prompt=QA_PROMPT))
+            _answer_chain_pool[id(llm)] = entry
+        return entry[1]
+
+def clear_llm_pool():
+    with _pool_lock:
+        _llm_pool.clear()
+        _answer_chain_pool.clear()
+
+def get_qa_chain(google_api_key, retriever, model=LLM_MODEL, temperature=LLM_TEMPERATURE, llm=None):
+    """
+    RetrievalQA over `retriever`, built around the pooled LLM client and answer chain, so a
+    chat turn only pays for a thin wrapper. Pass `llm` to use a specific model instance
+    (e.g. core.fakes.FakeStreamingChatModel) instead of the pooled Gemini client.
+    """
+    if llm is None:
+        llm = get_llm(google_api_key, model=model, temperature=temperature)
+    return RetrievalQA(
+        combine_documents_chain=get_answer_chain(llm),
         retriever=retriever,
         return_source_documents=True,
-        chain_type_kwargs=chain_type_kwargs
     )
-    return qa_chain
 
-def query_rag(qa_chain, question):
+def format_sources(source_documents):
+    """Formats the de-duplicated (filename, page) citations shown under an answer."""
+    sources_text_list = []
+    if source_documents:
+        unique_sources = {}
+        for doc in source_documents:
+            filename = doc.metadata.get('source', 'Unknown Document')
+            page_num_0_indexed = doc.metadata.get('page', None)
+            
+            page_display = int(page_num_0_indexed) + 1 if page_num_0_indexed is not None else 'N/A'
+            
+            source_key = (filename, page_display)
+            if source_key not in unique_sources:
+                sources_text_list.append(f"- {filename}, Page: {page_display}")
+                unique_sources[source_key] = True
+    
+    return "\n".join(sources_text_list) if sources_text_list else "No specific sources cited by the model for this answer, or sources not found in metadata."
+
+def _cache_lookup(answer_cache, fingerprint, sources_filter, question, embeddings):
+    """
+    Looks `question` up in the answer cache. The question is embedded for the semantic tier only
+    after an exact miss, and if embedding fails the semantic tier is skipped instead of failing
+    the query. Returns (cached entry or None, question vector or None).
+    """
+    question_vector = []
+
+    def _embed():
+        try:
+            question_vector.append(embeddings.embed_query(question))
+        except Exception as e:
+            print(f"--- Could not embed the question for the semantic answer cache, skipping it: {e} ---")
+            question_vector.append(None)
+        return question_vector[0]
+
+    cached = answer_cache.get(
+        fingerprint, sources_filter, question, question_vector=_embed if embeddings is not None else None
+    )
+    telemetry.increment("answer_cache.hits" if cached else "answer_cache.misses")
+    return cached, (question_vector[0] if question_vector else None)
+
+def query_rag(qa_chain, question, answer_cache=None, fingerprint=None, sources_filter=None, embeddings=None):
+    """
+    Runs the QA chain for `question`. With an answer_cache (and the index fingerprint from
+    core.vector_store.index_fingerprint), repeated questions over the same documents and filter
+    are answered from the cache. Passing `embeddings` enables the cache's semantic tier.
+    """
+    question_vector = None
+    if answer_cache is not None and fingerprint is not None:
+        cached, question_vector = _cache_lookup(answer_cache, fingerprint, sources_filter, question, embeddings)
+        if cached:
+            answer, formatted_sources, tier = cached
+            print(f"--- Answer cache {tier} hit (hit rate {answer_cache.stats()['hit_rate']:.0%}) ---")
+            return answer, formatted_sources
     try:
-        result = qa_chain.invoke({"query": question})
-        answer = result["result"]
-        source_documents = result["source_documents"]
-        
-        sources_text_list = []
-        if source_documents:
-            unique_sources = {}
-            for doc in source_documents:
-                filename = doc.metadata.get('source', 'Unknown Document')
-                page_num_0_indexed = doc.metadata.get('page', None)
-                
-                page_display = int(page_num_0_indexed) + 1 if page_num_0_indexed is not None else 'N/A'
-                
-                source_key = (filename, page_display)
-                if source_key not in unique_sources:
-                    sources_text_list.append(f"- {filename}, Page: {page_display}")
-                    unique_sources[source_key] = True
-        
-        formatted_sources = "\n".join(sources_text_list) if sources_text_list else "No specific sources cited by the model for this answer, or sources not found in metadata."
+        # The chain's two steps run separately so retrieval and generation are timed on their own
+        with telemetry.span("query"):
+            with telemetry.span("retrieval") as span:
+                source_documents = qa_chain.retriever.invoke(question)
+                span.set(documents=len(source_documents))
+            with telemetry.span("generation") as span:
+                answer = qa_chain.combine_documents_chain.invoke(
+                    {"input_documents": source_documents, "question": question}
+                )["output_text"]
+                span.set(completion_tokens=estimate_tokens(answer))
+        formatted_sources = format_sources(source_documents)
+        if answer_cache is not None and fingerprint is not None:
+            answer_cache.put(fingerprint, sources_filter, question, answer, formatted_sources, question_vector=question_vector)
         return answer, formatted_sources
     
     except Exception as e:
-        error_message = f"An error occurred during RAG query: {e}"
-        print(error_message)
-        if "response was blocked" in str(e).lower() or "SAFETY" in str(e).upper():
-            return "The response was blocked due to safety settings or other API restrictions. Try rephrasing your question or check the document content.", "No sources available due to API restriction."
-        return error_message, "No sources available due to error."
+        return _error_response(e)
+
+def _error_response(e):
+    error_message = f"An error occurred during RAG query: {e}"
+    print(error_message)
+    if "response was blocked" in str(e).lower() or "SAFETY" in str(e).upper():
+        return "The response was blocked due to safety settings or other API restrictions. Try rephrasing your question or check the document content.", "No sources available due to API restriction."
+    return error_message, "No sources available due to error."
+
+def stream_rag(qa_chain, question, answer_cache=None, fingerprint=None, sources_filter=None, embeddings=None):
+    """
+    Streaming variant of query_rag. Runs the chain's retriever, then streams the chain's LLM on
+    the same "stuff" prompt. Yields (event, payload) tuples:
+        ("sources", formatted_sources)  as soon as retrieval finishes
+        ("token", text)                 for every chunk the model produces
+        ("error", message)              if retrieval or generation fails
+        ("done", timings)               last; timings has retrieval_ms, ttft_ms, total_ms, cached
+                                        and prompt_tokens_saved (by a PackedContextRetriever, else 0)
+    ttft_ms (time to first token) is measured from the call, separately from total_ms.
+    """
+    started = time.perf_counter()
+    timings = {"retrieval_ms": None, "ttft_ms": None, "total_ms": None, "cached": False, "prompt_tokens_saved": 0}
+
+    def _elapsed_ms():
+        return (time.perf_counter() - started) * 1000
+
+    question_vector = None
+    if answer_cache is not None and fingerprint is not None:
+        cached, question_vector = _cache_lookup(answer_cache, fingerprint, sources_filter, question, embeddings)
+        if cached:
+            answer, formatted_sources, _ = cached
+            yield "sources", formatted_sources
+            timings["ttft_ms"] = _elapsed_ms()
+            yield "token", answer
+            timings.update(total_ms=_elapsed_ms(), cached=True)
+            yield "done", timings
+            return
+
+    answer_parts = []
+    try:
+        with telemetry.span("retrieval") as span:
+            source_documents = qa_chain.retriever.invoke(question)
+            span.set(documents=len(source_documents))
+        timings["retrieval_ms"] = _elapsed_ms()
+        packing_report = getattr(qa_chain.retriever, "last_report", None)
+        if packing_report is not None:
+            timings["prompt_tokens_saved"] = packing_report.saved_tokens
+        formatted_sources = format_sources(source_documents)
+        yield "sources", formatted_sources
+
+        stuff_chain = qa_chain.combine_documents_chain
+        inputs = stuff_chain._get_inputs(source_documents, question=question)
+        prompt_value = stuff_chain.llm_chain.prompt.format_prompt(**inputs)
+        prompt_tokens = estimate_tokens(prompt_value.to_string())
+        telemetry.increment("prompt_tokens", prompt_tokens)
+        generation_started = time.perf_counter()
+        for chunk in stuff_chain.llm_chain.llm.stream(prompt_value.to_messages()):
+            text = getattr(chunk, "content", chunk)
+            if not text:
+                continue
+            if timings["ttft_ms"] is None:
+                timings["ttft_ms"] = _elapsed_ms()
+            answer_parts.append(text)
+            yield "token", text
+    except Exception as e:
+        error_message, _ = _error_response(e)
+        yield "error", error_message
+        timings["total_ms"] = _elapsed_ms()
+        yield "done", timings
+        return
+
+    timings["total_ms"] = _elapsed_ms()
+    completion_tokens = estimate_tokens("".join(answer_parts))
+    telemetry.increment("completion_tokens", completion_tokens)
+    telemetry.record(
+        "generation",
+        (time.perf_counter() - generation_started) * 1000,
+        ttft_ms=timings["ttft_ms"],
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+    )
+    print(f"--- Streamed answer: retrieval {timings['retrieval_ms']:.0f} ms, first token {timings['ttft_ms'] or 0:.0f} ms, total {timings['total_ms']:.0f} ms ---")
+    if answer_cache is not None and fingerprint is not None:
+        answer_cache.put(fingerprint, sources_filter, question, "".join(answer_parts), formatted_sources, question_vector=question_vector)
+    yield "done", timings
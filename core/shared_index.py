@@ -0,0 +1,411 @@
+# core/shared_index.py
+"""
+Process-wide document index shared by every session. Each distinct document (by content
+hash) is stored and embedded once, and refcounted by the sessions that use it; a session only
+holds a SessionIndexView, i.e. its {source name: doc_hash} map, which is applied as a doc_hash
+partition filter on every read. Documents no session references stay cached (so a later
+upload of the same file is free) until the memory cap forces them out, least recently used first.
+"""
+import os
+import time
+import uuid
+import hashlib
+import weakref
+import threading
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Set
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from core.lexical_index import BM25Index
+from core.numpy_store import NumpyVectorStore
+from core.pdf_processor import content_chunk_id
+from core.partitions import partition_filter
+
+DEFAULT_MAX_BYTES = int(os.environ.get("PDF_QA_SHARED_INDEX_MAX_MB", "1024")) * 1024 * 1024
+DEFAULT_COMPACT_RATIO = 0.5 # Compact once half the rows are evicted tombstones
+
+
+class _ReadWriteLock:
+    """
+    Many concurrent readers (searches) or one writer (ingest, eviction, compaction). Writers take
+    precedence: once one is waiting, new readers queue behind it, so a steady stream of searches
+    cannot starve it. Not reentrant: a thread holding read() must not take read() again.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            try:
+                while self._writing or self._readers:
+                    self._condition.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+@dataclass
+class SharedDocument:
+    doc_hash: str
+    ids: Set[str] = field(default_factory=set)
+    nbytes: int = 0
+    sessions: Set[str] = field(default_factory=set)
+    complete: bool = False # Set once a session finished indexing it; only complete documents are reused
+    last_used: float = 0.0
+
+
+class SharedDocumentIndex:
+    def __init__(self, quantization=None, max_bytes=DEFAULT_MAX_BYTES, compact_ratio=DEFAULT_COMPACT_RATIO):
+        # Views embed with their own session's client, so the shared store needs none
+        self.store = NumpyVectorStore(None, quantization=quantization)
+        self.lexical_index = BM25Index()
+        self.max_bytes = max_bytes
+        self.compact_ratio = compact_ratio
+        self._lock = _ReadWriteLock()
+        self._documents = {} # doc_hash -> SharedDocument
+        self._ended_sessions = deque() # Released on the next write; see end_session
+        self.total_bytes = 0
+        self.evictions = 0
+
+    def session_view(self, embedding):
+        return SessionIndexView(self, embedding)
+
+    @contextmanager
+    def reading(self):
+        with self._lock.read():
+            yield self.store
+
+    @contextmanager
+    def _writing(self):
+        with self._lock.write():
+            while self._ended_sessions:
+                self._release(self._ended_sessions.popleft(), None)
+            yield
+
+    def write_chunks(self, session_id, ids, vectors, texts, metadatas):
+        """Upserts chunks (metadata must carry doc_hash) and references their documents from `session_id`."""
+        with self._writing():
+            self.store.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+            self.lexical_index.add(ids, texts, metadatas)
+            now = time.monotonic()
+            for chunk_id, vector, text, metadata in zip(ids, vectors, texts, metadatas):
+                document = self._documents.setdefault(metadata["doc_hash"], SharedDocument(metadata["doc_hash"]))
+                if chunk_id not in document.ids:
+                    document.ids.add(chunk_id)
+                    nbytes = len(vector) * 4 + len(text.encode("utf-8"))
+                    document.nbytes += nbytes
+                    self.total_bytes += nbytes
+                document.sessions.add(session_id)
+                document.last_used = now
+            self._evict()
+
+    def acquire(self, session_id, doc_hash):
+        """References an already indexed document from `session_id`. False if it has to be indexed."""
+        with self._writing():
+            document = self._documents.get(doc_hash)
+            if document is None or not document.complete:
+                return False
+            document.sessions.add(session_id)
+            document.last_used = time.monotonic()
+            return True
+
+    def complete_documents(self, doc_hashes):
+        """The subset of `doc_hashes` whose indexing finished."""
+        with self._lock.read():
+            return {h for h in doc_hashes if h in self._documents and self._documents[h].complete}
+
+    def mark_complete(self, doc_hashes):
+        with self._writing():
+            for doc_hash in doc_hashes:
+                if doc_hash in self._documents:
+                    self._documents[doc_hash].complete = True
+
+    def release(self, session_id, doc_hashes=None):
+        """
+        Drops `session_id`'s references to `doc_hashes` (all of its documents if None);
+        unreferenced documents become eligible for eviction.
+        """
+        with self._writing():
+            self._release(session_id, doc_hashes)
+            self._evict()
+
+    def _release(self, session_id, doc_hashes):
+        now = time.monotonic()
+        for doc_hash in (doc_hashes if doc_hashes is not None else list(self._documents)):
+            document = self._documents.get(doc_hash)
+            if document is not None and session_id in document.sessions:
+                document.sessions.discard(session_id)
+                document.last_used = now
+
+    def end_session(self, session_id):
+        """
+        Queues all of a session's references for release. Called from a view's finalizer, which
+        may run inside garbage collection on a thread that already holds the lock, so it only enqueues.
+        """
+        self._ended_sessions.append(session_id)
+
+    def _evict(self):
+        """Evicts unreferenced documents, least recently used first, until under max_bytes. Caller holds the write lock."""
+        if self.total_bytes <= self.max_bytes:
+            return
+        candidates = sorted((d for d in self._documents.values() if not d.sessions), key=lambda d: d.last_used)
+        for document in candidates:
+            if self.total_bytes <= self.max_bytes:
+                break
+            self.store.index.delete(ids=list(document.ids))
+            self.lexical_index.remove(list(document.ids))
+            self.total_bytes -= document.nbytes
+            del self._documents[document.doc_hash]
+            self.evictions += 1
+            print(f"--- Shared index: evicted unreferenced document {document.doc_hash[:12]} ({document.nbytes} bytes) ---")
+        if self.total_bytes > self.max_bytes:
+            print(f"--- WARNING: Shared index holds {self.total_bytes} bytes, over its {self.max_bytes} byte cap, but every document is in use ---")
+        index = self.store.index
+        if index.rows and (index.rows - len(index)) / index.rows >= self.compact_ratio:
+            index.compact()
+
+    def stats(self):
+        with self._lock.read():
+            documents = list(self._documents.values())
+            return {
+                "documents": len(documents),
+                "referenced_documents": sum(1 for d in documents if d.sessions),
+                "sessions": len({s for d in documents for s in d.sessions}),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "rows": len(self.store.index),
+            }
+
+
+class _ViewLexicalIndex:
+    """The shared BM25 index, scoped to one session's documents. The shared index keeps it current on write."""
+
+    def __init__(self, view):
+        self._view = view
+
+    def __len__(self):
+        return len(self._view.get(include=[])["ids"])
+
+    def add(self, ids, texts, metadatas):
+        pass
+
+    def remove(self, ids):
+        pass
+
+    def search(self, query, k=5, filter=None):
+        hits = self._view.shared.lexical_index.search(query, k=k, filter=self._view.scoped_filter(filter))
+        return [(self._view._session_document(doc), score) for doc, score in hits]
+
+
+class SessionIndexView(VectorStore):
+    """
+    One session's view of a SharedDocumentIndex. Reads are restricted to the session's documents
+    and report them under the session's own file names; writes go to the shared index. Deleting
+    releases whole documents rather than removing chunks. The view's references are released
+    when it is garbage collected (e.g. the Streamlit session ends).
+    """
+
+    def __init__(self, shared, embedding):
+        self.shared = shared
+        self._embedding = embedding
+        self.session_id = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._sources = {} # source name -> doc_hash
+        self._version = 0 # Bumped whenever the session's documents change
+        self.lexical_index = _ViewLexicalIndex(self)
+        weakref.finalize(self, shared.end_session, self.session_id)
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    @property
+    def version(self):
+        return self._version
+
+    def doc_hashes(self):
+        with self._lock:
+            return sorted(set(self._sources.values()))
+
+    def indexed_sources(self):
+        """{source name: doc_hash} for this session; several names may share one document."""
+        with self._lock:
+            return dict(self._sources)
+
+    def completed_sources(self):
+        """The indexed_sources whose document finished indexing."""
+        sources = self.indexed_sources()
+        complete = self.shared.complete_documents(set(sources.values()))
+        return {source: doc_hash for source, doc_hash in sources.items() if doc_hash in complete}
+
+    def scoped_filter(self, filter=None):
+        """Rewrites a session filter into one on the shared index, limited to this session's documents."""
+        partition = partition_filter(filter)
+        if not filter:
+            selected = self.doc_hashes()
+        elif partition and partition[0] == "source":
+            with self._lock:
+                selected = sorted({self._sources[s] for s in partition[1] if s in self._sources})
+        elif partition:
+            selected = sorted(set(partition[1]) & set(self.doc_hashes()))
+        else:
+            return {"$and": [{"doc_hash": {"$in": self.doc_hashes()}}, filter]}
+        return {"doc_hash": {"$in": selected}}
+
+    def _session_metadata(self, metadata):
+        """Copy of a shared chunk's metadata, with source set to this session's name for the document."""
+        metadata = dict(metadata or {})
+        with self._lock:
+            for source, doc_hash in self._sources.items():
+                if doc_hash == metadata.get("doc_hash"):
+                    metadata["source"] = source
+                    break
+        return metadata
+
+    def _session_document(self, doc):
+        return Document(page_content=doc.page_content, metadata=self._session_metadata(doc.metadata))
+
+    def attach(self, source, doc_hash):
+        """Reuses a document another session already indexed. Returns False if it must be indexed."""
+        if not self.shared.acquire(self.session_id, doc_hash):
+            return False
+        with self._lock:
+            self._sources[source] = doc_hash
+            self._version += 1
+        return True
+
+    def detach(self, source):
+        """Drops one file name; its document is released once no other name of this session uses it."""
+        with self._lock:
+            doc_hash = self._sources.pop(source, None)
+            self._version += 1
+            if doc_hash is None or doc_hash in self._sources.values():
+                return doc_hash is not None
+        self.shared.release(self.session_id, [doc_hash])
+        return True
+
+    def mark_complete(self, doc_hashes):
+        self.shared.mark_complete(doc_hashes)
+
+    # --- Writes ---
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        vectors = self._embedding.embed_documents(texts)
+        return self.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, **kwargs):
+        text_embeddings = list(text_embeddings)
+        if not text_embeddings:
+            return []
+        texts = [t for t, _ in text_embeddings]
+        # Chunks are stored once per content, whichever file name they were uploaded under
+        ids = [content_chunk_id(i) for i in ids] if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        metadatas = [dict(m or {}) for m in metadatas] if metadatas is not None else [{} for _ in texts]
+        with self._lock:
+            for metadata in metadatas:
+                if metadata.get("chunk_id"):
+                    metadata["chunk_id"] = content_chunk_id(metadata["chunk_id"])
+                if not metadata.get("doc_hash"):
+                    # Chunks without a content hash stay private to this session
+                    raw = f"{self.session_id}:{metadata.get('source', '')}"
+                    metadata["doc_hash"] = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+                self._sources[metadata.get("source", metadata["doc_hash"])] = metadata["doc_hash"]
+            self._version += 1
+        self.shared.write_chunks(self.session_id, ids, [v for _, v in text_embeddings], texts, metadatas)
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        """Releases every document that one of `ids` belongs to."""
+        if ids is None:
+            return False
+        doc_hashes = {m.get("doc_hash") for m in self.get(ids=ids, include=["metadatas"])["metadatas"]}
+        if not doc_hashes:
+            return False
+        with self._lock:
+            self._sources = {s: h for s, h in self._sources.items() if h not in doc_hashes}
+            self._version += 1
+        self.shared.release(self.session_id, doc_hashes)
+        return True
+
+    # --- Reads ---
+
+    def get(self, ids=None, where=None, include=("metadatas", "documents"), **kwargs):
+        with self.shared.reading() as store:
+            result = store.get(ids=ids, where=self.scoped_filter(where), include=include)
+        if result["metadatas"] is not None:
+            result["metadatas"] = [self._session_metadata(m) for m in result["metadatas"]]
+        return result
+
+    def similarity_search_by_vectors_with_score(self, embeddings, k=4, filter=None, **kwargs):
+        with self.shared.reading() as store:
+            results = store.similarity_search_by_vectors_with_score(embeddings, k=k, filter=self.scoped_filter(filter))
+        return [[(self._session_document(doc), score) for doc, score in hits] for hits in results]
+
+    def batch_similarity_search(self, queries, k=4, filter=None):
+        vectors = [self._embedding.embed_query(q) for q in queries]
+        return [[doc for doc, _ in hits] for hits in self.similarity_search_by_vectors_with_score(vectors, k=k, filter=filter)]
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vectors_with_score([embedding], k=k, filter=filter)[0]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        vector = self._embedding.embed_query(query)
+        return self.similarity_search_by_vector_with_score(vector, k=k, filter=filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k, filter=filter)]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def _select_relevance_score_fn(self):
+        return self.shared.store._select_relevance_score_fn()
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, shared=None, **kwargs):
+        view = (shared or get_shared_index()).session_view(embedding)
+        view.add_texts(texts, metadatas=metadatas, ids=ids)
+        return view
+
+
+_shared_index = None
+_shared_index_lock = threading.Lock()
+
+
+def get_shared_index(**kwargs):
+    """Process-wide SharedDocumentIndex; kwargs only apply on the first call."""
+    global _shared_index
+    with _shared_index_lock:
+        if _shared_index is None:
+            _shared_index = SharedDocumentIndex(**kwargs)
+        return _shared_index
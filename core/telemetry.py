@@ -0,0 +1,207 @@
+# core/telemetry.py
+"""
+Lightweight timing spans and counters for the ingest and query pipelines.
+
+    with telemetry.span("search", k=5):
+        ...
+    telemetry.increment("chunks", len(chunks))
+
+Finished spans go to the configured exporters (InMemoryExporter and/or JsonLinesExporter).
+Telemetry is off until configure(enabled=True); while off, span() returns a shared no-op
+context manager and increment() returns immediately, so instrumented code pays one flag check.
+"""
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque, defaultdict
+import numpy as np
+
+DEFAULT_MAX_RECORDS = 5000
+
+_enabled = False
+_exporters = []
+_counters = defaultdict(float)
+_counters_lock = threading.Lock()
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class InMemoryExporter:
+    """Keeps the most recent span records in a ring buffer, for the sidebar panel and tests."""
+
+    def __init__(self, max_records=DEFAULT_MAX_RECORDS):
+        self._records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def export(self, record):
+        with self._lock:
+            self._records.append(record)
+
+    def records(self, name=None):
+        with self._lock:
+            return [r for r in self._records if name is None or r["name"] == name]
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+
+class JsonLinesExporter:
+    """Appends one JSON object per span to `path` (line buffered, so each span lands whole)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def export(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def configure(enabled=True, exporters=None):
+    """Turns telemetry on or off. Defaults to a single InMemoryExporter. Returns the exporters."""
+    global _enabled, _exporters
+    _exporters = list(exporters) if exporters is not None else [InMemoryExporter()]
+    _enabled = enabled
+    return _exporters
+
+
+def is_enabled():
+    return _enabled
+
+
+def exporters():
+    return list(_exporters)
+
+
+def _export(record):
+    for exporter in _exporters:
+        try:
+            exporter.export(record)
+        except Exception as e:
+            print(f"--- Telemetry exporter {type(exporter).__name__} failed: {e} ---")
+
+
+class _Span:
+    __slots__ = ("name", "attributes", "trace_id", "span_id", "parent_id", "_started", "_token")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        """Adds attributes while the span is open (e.g. result sizes)."""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.span_id = uuid.uuid4().hex[:16]
+        self._token = _current_span.set(self)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self._started) * 1000
+        _current_span.reset(self._token)
+        record = {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "timestamp": time.time(),
+            "duration_ms": duration_ms,
+            "attributes": self.attributes,
+        }
+        if exc_type is not None:
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        _export(record)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name, **attributes):
+    """Context manager timing a pipeline stage. Nested spans share the enclosing span's trace_id."""
+    if not _enabled:
+        return _NOOP_SPAN
+    return _Span(name, attributes)
+
+
+def record(name, duration_ms, **attributes):
+    """Exports a span measured elsewhere (e.g. inside a worker process) under the current trace."""
+    if not _enabled:
+        return
+    parent = _current_span.get()
+    _export({
+        "name": name,
+        "trace_id": parent.trace_id if parent else uuid.uuid4().hex[:16],
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent.span_id if parent else None,
+        "timestamp": time.time(),
+        "duration_ms": duration_ms,
+        "attributes": attributes,
+    })
+
+
+def increment(name, value=1):
+    if not _enabled:
+        return
+    with _counters_lock:
+        _counters[name] += value
+
+
+def counters():
+    with _counters_lock:
+        return dict(_counters)
+
+
+def reset():
+    """Clears counters and every in-memory exporter."""
+    with _counters_lock:
+        _counters.clear()
+    for exporter in _exporters:
+        if isinstance(exporter, InMemoryExporter):
+            exporter.clear()
+
+
+def stage_percentiles(last_n=200, percentiles=(50, 95, 99)):
+    """
+    {stage: {"count", "p50_ms", "p95_ms", "p99_ms"}} over the last `last_n` spans of each stage,
+    from the first InMemoryExporter.
+    """
+    memory = next((e for e in _exporters if isinstance(e, InMemoryExporter)), None)
+    if memory is None:
+        return {}
+    durations = defaultdict(list)
+    for r in memory.records():
+        durations[r["name"]].append(r["duration_ms"])
+    stats = {}
+    for name, values in sorted(durations.items()):
+        recent = np.asarray(values[-last_n:])
+        stats[name] = {"count": len(values)}
+        for p, value in zip(percentiles, np.percentile(recent, percentiles)):
+            stats[name][f"p{p}_ms"] = float(value)
+    return stats
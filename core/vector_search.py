@@ -0,0 +1,137 @@
+# core/vector_search.py
+"""
+Brute-force search kernels over a contiguous (rows, dim) float32 matrix of normalized vectors.
+Scores are computed block by block (so a memory-mapped matrix is streamed, not copied) with one
+matmul per block for the whole query batch, and top-k is taken with argpartition.
+"""
+import numpy as np
+
+BLOCK_ROWS = 65536
+QUANTIZATION_MODES = (None, "float16", "int8")
+
+
+def _top_k_per_column(scores, k):
+    """Indices (k, q) of the k largest entries in each column, unsorted."""
+    if scores.shape[0] <= k:
+        return np.broadcast_to(np.arange(scores.shape[0])[:, None], scores.shape)
+    return np.argpartition(-scores, k - 1, axis=0)[:k]
+
+
+def _merge_sorted(candidate_scores, candidate_rows, k):
+    """Final (q, k) top-k from per-block candidates, sorted by descending score."""
+    k = min(k, candidate_scores.shape[1])
+    if candidate_scores.shape[1] > k:
+        part = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.tile(np.arange(k), (len(candidate_scores), 1))
+    top_scores = np.take_along_axis(candidate_scores, part, axis=1)
+    top_rows = np.take_along_axis(candidate_rows, part, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top_rows, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def _blocked_top_k(score_block_fn, n_rows, n_queries, k, rows=None, excluded=None, block_rows=BLOCK_ROWS):
+    """
+    Shared driver: score_block_fn(row_indices_or_slice) -> (block_len, q) scores.
+    `rows` restricts the search to those row numbers; `excluded` is a boolean mask of rows to skip.
+    Returns (row_ids (q, k'), scores (q, k')) with k' = min(k, candidates), -inf padded rows removed.
+    """
+    total = n_rows if rows is None else len(rows)
+    if total == 0 or k <= 0:
+        return np.empty((n_queries, 0), dtype=np.int64), np.empty((n_queries, 0), dtype=np.float32)
+    cand_scores, cand_rows = [], []
+    for start in range(0, total, block_rows):
+        stop = min(start + block_rows, total)
+        block_ids = np.arange(start, stop) if rows is None else np.asarray(rows[start:stop], dtype=np.int64)
+        scores = score_block_fn(slice(start, stop) if rows is None else block_ids)
+        if excluded is not None:
+            scores[excluded[block_ids]] = -np.inf
+        top = _top_k_per_column(scores, k)
+        cand_scores.append(np.take_along_axis(scores, top, axis=0).T)
+        cand_rows.append(block_ids[top].T)
+    row_ids, top_scores = _merge_sorted(np.hstack(cand_scores), np.hstack(cand_rows), k)
+    keep = np.isfinite(top_scores).all(axis=0)
+    return row_ids[:, keep], top_scores[:, keep]
+
+
+def exact_top_k(matrix, queries, k, rows=None, excluded=None, block_rows=BLOCK_ROWS):
+    """Exact cosine top-k for a batch of normalized queries (q, dim) against `matrix`."""
+    queries = np.asarray(queries, dtype=np.float32)
+    return _blocked_top_k(
+        lambda sel: np.asarray(matrix[sel], dtype=np.float32) @ queries.T,
+        len(matrix), len(queries), k, rows=rows, excluded=excluded, block_rows=block_rows,
+    )
+
+
+class QuantizedMatrix:
+    """
+    Compressed copy of a float32 matrix used for a first-pass shortlist.
+    "float16" halves memory; "int8" stores one byte per value plus a float32 scale per row.
+    """
+
+    def __init__(self, mode):
+        if mode not in ("float16", "int8"):
+            raise ValueError(f"Unsupported quantization mode: {mode}")
+        self.mode = mode
+        self.values = None
+        self.scales = None
+
+    def __len__(self):
+        return 0 if self.values is None else len(self.values)
+
+    def extend(self, vectors):
+        """Quantizes and appends rows, so an index that grows is never re-quantized from scratch."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.mode == "float16":
+            values, scales = vectors.astype(np.float16), None
+        else:
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            values = np.round(vectors / scales[:, None]).astype(np.int8)
+            scales = scales.astype(np.float32)
+        if self.values is None:
+            self.values, self.scales = values, scales
+        else:
+            self.values = np.concatenate([self.values, values])
+            if scales is not None:
+                self.scales = np.concatenate([self.scales, scales])
+
+    def score_block(self, sel, queries):
+        scores = self.values[sel].astype(np.float32) @ queries.T
+        if self.scales is not None:
+            scores *= self.scales[sel][:, None]
+        return scores
+
+    @property
+    def nbytes(self):
+        return 0 if self.values is None else self.values.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+
+def quantized_top_k(matrix, quantized, queries, k, shortlist_factor=4, rows=None, excluded=None, block_rows=BLOCK_ROWS):
+    """
+    Shortlists k * shortlist_factor candidates per query on the quantized copy, then re-ranks
+    the shortlist exactly against the float32 rows. Only the shortlist rows are read from `matrix`.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    shortlist, _ = _blocked_top_k(
+        lambda sel: quantized.score_block(sel, queries),
+        len(quantized), len(queries), k * shortlist_factor, rows=rows, excluded=excluded, block_rows=block_rows,
+    )
+    if shortlist.shape[1] == 0:
+        return shortlist, np.empty((len(queries), 0), dtype=np.float32)
+    row_ids, row_scores = [], []
+    for qi in range(len(queries)):
+        candidates = np.sort(shortlist[qi])
+        exact = np.asarray(matrix[candidates], dtype=np.float32) @ queries[qi]
+        order = np.argsort(-exact, kind="stable")[:k]
+        row_ids.append(candidates[order])
+        row_scores.append(exact[order])
+    return np.vstack(row_ids), np.vstack(row_scores)
+
+
+def recall_at_k(exact_rows, approx_rows):
+    """Mean fraction of the exact top-k found by the approximate search."""
+    if exact_rows.size == 0:
+        return 1.0
+    hits = [len(set(e.tolist()) & set(a.tolist())) / max(1, len(e)) for e, a in zip(exact_rows, approx_rows)]
+    return float(np.mean(hits))
@@ -1,29 +1,153 @@
 # core/vector_store.py
 import os
+import uuid
+import hashlib
+import tempfile
+import weakref
+import threading
 # import shutil # No longer needed for deleting directories
 from langchain_community.vectorstores import Chroma
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from core.embedding_cache import CachedEmbeddings, get_embedding_cache
+from core.ingest import ingest_documents, write_embedded_batch, DEFAULT_BATCH_SIZE, DEFAULT_MAX_IN_FLIGHT
+from core.numpy_store import NumpyVectorStore
+from core.pdf_processor import content_chunk_id, source_chunk_id
+from core.persistent_index import CHECKPOINT_DIR, PersistentIndex, open_persistent_index
+from core.lexical_index import BM25Index
+from core.hybrid_retriever import HybridRetriever
+from core.shared_index import SessionIndexView, get_shared_index
+from core.context_packing import PackedContextRetriever
+from core import telemetry
 # import time # No longer needed for delays
 
 # COLLECTION_NAME can still be used for in-memory, though less critical
 # Using a versioned name is still good if you ever switch back to persistence.
 COLLECTION_NAME = "pdf_gemini_in_memory_v1"
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+RETRIEVAL_MODES = ("dense", "hybrid")
 
-def get_vector_store(google_api_key): # Removed db_path and force_recreate
+# Memoized document-set fingerprints, as (version, fingerprint) per index, shared by every wrapper
+_fingerprints = weakref.WeakKeyDictionary()
+# Embedding clients shared across sessions, keyed by (API key hash, model)
+_embedding_clients = {}
+_embedding_clients_lock = threading.Lock()
+# Bookkeeping for Chroma collections, which have no index object to hold it, keyed by collection id
+_collection_states = {}
+_collection_states_lock = threading.Lock()
+# Per-store directory names for ingest checkpoints of in-memory stores
+_checkpoint_tokens = weakref.WeakKeyDictionary()
+
+
+class _CollectionState:
+    """
+    Completion markers, a write version and the BM25 index of one Chroma collection, like the
+    NumPy indexes keep themselves.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._completed = {} # source -> doc_hash
+        self._lexical_index = None
+        self.version = 0
+
+    def lexical_index(self, load):
+        """The BM25 index, built on first use from load() (a Chroma `get` result with documents and metadatas)."""
+        with self._lock:
+            if self._lexical_index is None:
+                lexical_index = BM25Index()
+                existing = load()
+                if existing and existing["ids"]:
+                    lexical_index.add(existing["ids"], existing["documents"], existing["metadatas"])
+                print(f"--- Built BM25 index from {len(lexical_index)} stored chunks ---")
+                self._lexical_index = lexical_index
+            return self._lexical_index
+
+    def record_write(self, added=None, removed=None, partial=False):
+        """
+        Bumps the version and keeps a built BM25 index current: `added` is (ids, texts, metadatas),
+        `removed` a list of ids. After a partial write it is dropped and rebuilt on next use.
+        """
+        with self._lock:
+            self.version += 1
+            if self._lexical_index is None:
+                return
+            if partial:
+                self._lexical_index = None
+                return
+            if removed:
+                self._lexical_index.remove(removed)
+            if added:
+                self._lexical_index.add(*added)
+
+    def completed_documents(self):
+        with self._lock:
+            return dict(self._completed)
+
+    def mark_complete(self, source_hashes):
+        with self._lock:
+            self._completed.update(source_hashes)
+
+    def forget_documents(self, sources):
+        with self._lock:
+            for source in sources:
+                self._completed.pop(source, None)
+
+
+def get_embeddings_client(google_api_key, model=EMBEDDING_MODEL):
+    """Process-wide GoogleGenerativeAIEmbeddings client for this API key, reused by every session."""
+    key = (hashlib.sha256((google_api_key or "").encode("utf-8")).hexdigest(), model)
+    with _embedding_clients_lock:
+        client = _embedding_clients.get(key)
+        if client is None:
+            client = GoogleGenerativeAIEmbeddings(model=model, google_api_key=google_api_key)
+            _embedding_clients[key] = client
+        return client
+
+def get_vector_store(google_api_key, embedding_cache=None, use_embedding_cache=True, persist_directory=None,
+                     backend="chroma", quantization=None): # Removed db_path and force_recreate
     """
-    Initializes and returns an IN-MEMORY Chroma vector store.
+    Initializes and returns the session's vector store: an in-memory Chroma collection by default.
+    With backend="numpy", returns an in-memory NumpyVectorStore (brute-force matmul search,
+    optionally int8/float16 quantized) instead. With backend="shared", returns this session's
+    view of the process-wide shared index (see core.shared_index), so identical documents
+    uploaded by different sessions are stored and embedded once. With persist_directory, returns a NumpyVectorStore
+    over the memory-mapped on-disk index in that directory, which survives restarts and opens
+    in constant time.
+    Embeddings go through the persistent on-disk embedding cache, so re-processing
+    the same PDFs only sends new chunks to the remote model.
     """
-    print(f"--- Initializing IN-MEMORY Chroma with collection_name: {COLLECTION_NAME} ---")
+    if persist_directory:
+        print(f"--- Opening PERSISTENT index at: {persist_directory} ---")
+    elif backend == "numpy":
+        print(f"--- Initializing IN-MEMORY NumPy vector store (quantization: {quantization}) ---")
+    elif backend == "shared":
+        print(f"--- Opening session view of the SHARED in-memory index (quantization: {quantization}) ---")
+    else:
+        print(f"--- Initializing IN-MEMORY Chroma with collection_name: {COLLECTION_NAME} ---")
     try:
-        embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/gemini-embedding-001",
-            google_api_key=google_api_key,
-        )
-        print("--- GoogleGenerativeAIEmbeddings initialized successfully (for in-memory store) ---")
+        embeddings = get_embeddings_client(google_api_key)
+        if use_embedding_cache:
+            embeddings = CachedEmbeddings(embeddings, EMBEDDING_MODEL, embedding_cache or get_embedding_cache())
+        print("--- GoogleGenerativeAIEmbeddings initialized successfully ---")
     except Exception as e:
         print(f"--- CRITICAL: Error initializing GoogleGenerativeAIEmbeddings: {e} ---")
         raise
 
+    if persist_directory:
+        try:
+            vector_store = NumpyVectorStore(embeddings, open_persistent_index(persist_directory), quantization=quantization)
+            print(f"--- PERSISTENT index opened: {vector_store.index.rows} rows, dim {vector_store.index.dim} ---")
+            return vector_store
+        except Exception as e:
+            print(f"--- CRITICAL ERROR opening PERSISTENT index at {persist_directory}: {e} ---")
+            raise
+
+    if backend == "numpy":
+        return NumpyVectorStore(embeddings, quantization=quantization)
+
+    if backend == "shared":
+        return get_shared_index(quantization=quantization).session_view(embeddings)
+
     try:
         # For an in-memory Chroma instance with LangChain,
         # you simply don't provide a persist_directory.
@@ -51,49 +175,283 @@ def get_vector_store(google_api_key): # Removed db_path and force_recreate
         traceback.print_exc()
         raise
 
-def add_documents_to_store(vector_store, documents):
-    """Adds Langchain Document objects to the in-memory Chroma vector store."""
+def describe_store(vector_store):
+    """Names the backend behind `vector_store`, for log lines."""
+    if isinstance(vector_store, SessionIndexView):
+        return "session view of the shared in-memory index"
+    if isinstance(vector_store, NumpyVectorStore):
+        if isinstance(vector_store.index, PersistentIndex):
+            return f"persistent NumPy index at {vector_store.index.path}"
+        return "in-memory NumPy store"
+    collection = getattr(vector_store, "_collection", None)
+    if collection is not None:
+        return f"in-memory Chroma collection '{collection.name}'"
+    return type(vector_store).__name__
+
+def _document_state(vector_store):
+    """The object holding `vector_store`'s completion markers: its index, or its Chroma collection's state."""
+    if isinstance(vector_store, NumpyVectorStore):
+        return vector_store.index
+    with _collection_states_lock:
+        return _collection_states.setdefault(str(vector_store._collection.id), _CollectionState())
+
+def _content_state(vector_store):
+    """The object whose `version` changes with `vector_store`'s contents, whichever wrapper wrote them."""
+    return vector_store if isinstance(vector_store, SessionIndexView) else _document_state(vector_store)
+
+def _note_write(vector_store, added=None, removed=None, partial=False):
+    """Chroma writes bypass any object of ours, so they are recorded on the collection's state."""
+    if not isinstance(vector_store, (NumpyVectorStore, SessionIndexView)):
+        _document_state(vector_store).record_write(added=added, removed=removed, partial=partial)
+
+def ingest_checkpoint_path(vector_store, source, doc_hash, page_range):
+    """
+    Checkpoint file for ingesting one page range of one document into `vector_store` (see
+    core.ingest), so a failed upload resumes from its failed batches. Kept inside a persistent
+    index; for in-memory stores a temp directory scoped to the store, since progress recorded
+    against one store must never be reused for another.
+    """
+    if isinstance(vector_store, NumpyVectorStore) and isinstance(vector_store.index, PersistentIndex):
+        directory = os.path.join(vector_store.index.path, CHECKPOINT_DIR)
+    else:
+        state = _content_state(vector_store)
+        if state not in _checkpoint_tokens:
+            _checkpoint_tokens[state] = uuid.uuid4().hex
+        directory = os.path.join(tempfile.gettempdir(), "pdf_qa_checkpoints", _checkpoint_tokens[state])
+    key = hashlib.sha256(f"{source}|{doc_hash}|{page_range[0]}-{page_range[1]}".encode("utf-8")).hexdigest()
+    return os.path.join(directory, f"{key[:32]}.json")
+
+def add_documents_to_store(vector_store, documents, ids=None, batch_size=DEFAULT_BATCH_SIZE, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                           requests_per_second=None, checkpoint_path=None):
+    """
+    Adds Langchain Document objects to the vector store.
+    Embedding runs in batches with bounded concurrency, rate limiting and retries (see core.ingest).
+    Returns the IngestReport; raises if any batch still failed, in which case calling again
+    with the same checkpoint_path resumes from the failed batches.
+    """
     if not documents:
-        print("--- No documents to add to in-memory vector store. ---")
-        return
+        print("--- No documents to add to the vector store. ---")
+        return None
     
-    collection_name_debug = vector_store._collection.name if hasattr(vector_store, '_collection') and vector_store._collection else 'N/A'
-    print(f"--- Attempting to add {len(documents)} chunks to IN-MEMORY vector store '{collection_name_debug}' ---")
+    print(f"--- Attempting to add {len(documents)} chunks to the {describe_store(vector_store)} ---")
+    if ids is None:
+        ids = [str(uuid.uuid4()) for _ in documents]
     try:
-        vector_store.add_documents(documents)
-        # No vector_store.persist() needed for in-memory
-        print(f"--- Successfully added {len(documents)} document chunks to the IN-MEMORY vector store. ---")
+        with telemetry.span("ingest", chunks=len(documents)):
+            report = ingest_documents(
+                vector_store,
+                documents,
+                ids=ids,
+                batch_size=batch_size,
+                max_in_flight=max_in_flight,
+                requests_per_second=requests_per_second,
+                checkpoint_path=checkpoint_path,
+            )
     except Exception as e:
-        print(f"--- CRITICAL ERROR adding documents to IN-MEMORY vector store: {e} ---")
+        _note_write(vector_store, partial=True)
+        print(f"--- CRITICAL ERROR adding documents to the {describe_store(vector_store)}: {e} ---")
         raise
+    if not report.ok:
+        _note_write(vector_store, partial=True)
+        raise RuntimeError(
+            f"{len(report.failed_batches)} embedding batch(es) failed ({report.ingested_chunks}/{report.total_chunks} chunks added). "
+            f"First error: {report.failed_batches[0][1]}"
+        )
+    _note_write(vector_store, added=(ids, [d.page_content for d in documents], [d.metadata for d in documents]))
+    print(f"--- Successfully added {report.ingested_chunks} document chunks to the {describe_store(vector_store)}. ---")
+    return report
+
+def get_indexed_hashes(vector_store):
+    """Returns {source: doc_hash} for every document currently in the store."""
+    if isinstance(vector_store, SessionIndexView):
+        return vector_store.indexed_sources()
+    if isinstance(vector_store, NumpyVectorStore):
+        return vector_store.index.source_hashes() # Does not read every chunk
+    result = vector_store.get(include=["metadatas"])
+    indexed = {}
+    for meta in (result or {}).get("metadatas") or []:
+        if meta and "source" in meta:
+            indexed.setdefault(meta["source"], meta.get("doc_hash"))
+    return indexed
+
+def index_fingerprint(vector_store):
+    """
+    Hash identifying the set of indexed documents (source + content hash + chunk count).
+    Changes whenever documents are added, replaced or removed, so caches keyed by it
+    are invalidated automatically. Memoized against the index's write version, so it stays
+    correct when other sessions write to the same index or collection.
+    """
+    state = _content_state(vector_store)
+    version = state.version
+    cached = _fingerprints.get(state)
+    if cached is None or cached[0] != version:
+        if isinstance(vector_store, NumpyVectorStore):
+            chunk_count = len(vector_store.index)
+        elif isinstance(vector_store, SessionIndexView):
+            chunk_count = len(vector_store.get(include=[])["ids"])
+        else:
+            chunk_count = vector_store._collection.count()
+        digest = hashlib.sha256(f"{chunk_count}".encode("utf-8"))
+        for source, doc_hash in sorted(get_indexed_hashes(vector_store).items()):
+            digest.update(f"|{source}:{doc_hash}".encode("utf-8"))
+        cached = (version, digest.hexdigest())
+        _fingerprints[state] = cached
+    return cached[1]
+
+def completed_documents(vector_store):
+    """{source: doc_hash} of the documents whose indexing finished (see finish_indexing)."""
+    if isinstance(vector_store, SessionIndexView):
+        return vector_store.completed_sources()
+    return _document_state(vector_store).completed_documents()
+
+def remove_source(vector_store, source):
+    """Deletes only the chunks that belong to `source`. Returns how many were removed."""
+    ids = vector_store.get(where={"source": source}, include=[])["ids"]
+    if isinstance(vector_store, SessionIndexView):
+        # Other names for the same content keep the shared chunks
+        vector_store.detach(source)
+        print(f"--- Removed '{source}' from this session ({len(ids)} chunks) ---")
+        return len(ids)
+    _document_state(vector_store).forget_documents([source])
+    if ids:
+        vector_store.delete(ids=ids)
+        _note_write(vector_store, removed=ids)
+    print(f"--- Removed {len(ids)} chunks of '{source}' from the vector store ---")
+    return len(ids)
+
+def alias_source(vector_store, source, existing_source):
+    """
+    Indexes `source` as a copy of `existing_source`, which has identical content: its chunks
+    and vectors are written again under the new name, without extraction or embedding.
+    Returns how many chunks were copied.
+    """
+    existing = vector_store.get(where={"source": existing_source}, include=["documents", "metadatas", "embeddings"])
+    ids = [source_chunk_id(source, content_chunk_id(chunk_id)) for chunk_id in existing["ids"]]
+    metadatas = [dict(metadata, source=source, chunk_id=chunk_id) for chunk_id, metadata in zip(ids, existing["metadatas"])]
+    if ids:
+        write_embedded_batch(vector_store, list(existing["documents"]), metadatas, ids, list(existing["embeddings"]))
+        _note_write(vector_store, added=(ids, list(existing["documents"]), metadatas))
+    doc_hash = completed_documents(vector_store)[existing_source]
+    finish_indexing(vector_store, {source: doc_hash})
+    print(f"--- Indexed '{source}' as a copy of '{existing_source}' ({len(ids)} chunks) ---")
+    return len(ids)
+
+def sync_sources(vector_store, source_hashes):
+    """
+    Compares {source: doc_hash} for an upload against what is indexed.
+    Only documents marked complete by finish_indexing count as unchanged; a document whose
+    indexing stopped part way is indexed again, which resumes it (chunk ids are stable and
+    checkpoints skip finished batches). Sources whose content changed have their old chunks
+    removed; a new name for content that is already indexed becomes a copy of it (see
+    alias_source). Returns (sources_to_index, unchanged_sources); unchanged sources need no work at all.
+    """
+    indexed = get_indexed_hashes(vector_store)
+    completed = completed_documents(vector_store)
+    to_index, unchanged = [], []
+    for source, doc_hash in source_hashes.items():
+        if completed.get(source) == doc_hash:
+            unchanged.append(source)
+            continue
+        if indexed.get(source) == doc_hash:
+            print(f"--- '{source}' was only partly indexed; resuming it ---")
+            to_index.append(source)
+            continue
+        if source in indexed or source in completed:
+            print(f"--- '{source}' changed since it was indexed; replacing its chunks ---")
+            remove_source(vector_store, source)
+        if isinstance(vector_store, SessionIndexView):
+            if vector_store.attach(source, doc_hash):
+                # Another session (or file name) already indexed identical content; reuse it without embedding
+                print(f"--- Reusing shared copy of '{source}' ---")
+                unchanged.append(source)
+                continue
+        else:
+            existing_source = next((s for s, h in completed.items() if h == doc_hash and s != source), None)
+            if existing_source is not None:
+                alias_source(vector_store, source, existing_source)
+                unchanged.append(source)
+                continue
+        to_index.append(source)
+    return to_index, unchanged
+
+def finish_indexing(vector_store, source_hashes):
+    """
+    Marks {source: doc_hash} documents as fully indexed once every batch of theirs was added.
+    Until then sync_sources keeps treating them as to be indexed; on the shared index this
+    also makes them reusable by other sessions.
+    """
+    if isinstance(vector_store, SessionIndexView):
+        vector_store.mark_complete(set(source_hashes.values()))
+    else:
+        _document_state(vector_store).mark_complete(source_hashes)
+
+def index_documents(vector_store, documents, **ingest_kwargs):
+    """
+    Incrementally indexes chunks produced by process_pdfs: unchanged files are skipped,
+    changed files replace their previous version, new files are added. Chunks are written
+    under their stable chunk_id, so the operation is idempotent.
+    Returns (sources_indexed, unchanged_sources).
+    """
+    source_hashes = {}
+    for doc in documents:
+        source_hashes.setdefault(doc.metadata["source"], doc.metadata["doc_hash"])
+    to_index, unchanged = sync_sources(vector_store, source_hashes)
+    wanted = set(to_index)
+    new_docs = [doc for doc in documents if doc.metadata["source"] in wanted]
+    if new_docs:
+        add_documents_to_store(vector_store, new_docs, ids=[doc.metadata["chunk_id"] for doc in new_docs], **ingest_kwargs)
+        finish_indexing(vector_store, {source: source_hashes[source] for source in to_index})
+    return to_index, unchanged
 
 def get_retriever(vector_store, k_results=5):
     """Returns a general retriever from the vector store."""
     return vector_store.as_retriever(search_kwargs={"k": k_results})
 
-def get_retriever_with_filter(vector_store, document_sources, k_results=5):
+def get_lexical_index(vector_store):
+    """
+    Returns the BM25 index for `vector_store`. It belongs to the underlying index (or Chroma
+    collection), so every wrapper sees the same one; it is built from the stored chunks the
+    first time hybrid retrieval asks for it and kept current on every write after that.
+    """
+    if isinstance(vector_store, SessionIndexView):
+        return vector_store.lexical_index # Maintained by the shared index
+    if isinstance(vector_store, NumpyVectorStore):
+        return vector_store.index.lexical_index()
+    return _document_state(vector_store).lexical_index(lambda: vector_store.get(include=["documents", "metadatas"]))
+
+def get_retriever_with_filter(vector_store, document_sources, k_results=5, mode="dense", token_budget=None):
     """
     Returns a retriever that filters by specific document sources (filenames).
+    mode="hybrid" fuses BM25 and dense rankings (see core.hybrid_retriever).
+    With token_budget, results are merged, de-duplicated and packed into that many prompt
+    tokens (see core.context_packing).
     """
-    if not document_sources:
-        return get_retriever(vector_store, k_results)
-    filter_dict = {"source": {"$in": document_sources}}
-    return vector_store.as_retriever(search_kwargs={"k": k_results, "filter": filter_dict})
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"mode must be one of {RETRIEVAL_MODES}, got {mode!r}")
+    filter_dict = {"source": {"$in": document_sources}} if document_sources else None
+    if mode == "hybrid":
+        retriever = HybridRetriever(
+            vector_store=vector_store, lexical_index=get_lexical_index(vector_store), k=k_results, filter=filter_dict
+        )
+    elif not document_sources:
+        retriever = get_retriever(vector_store, k_results)
+    else:
+        retriever = vector_store.as_retriever(search_kwargs={"k": k_results, "filter": filter_dict})
+    if token_budget:
+        retriever = PackedContextRetriever(retriever=retriever, token_budget=token_budget)
+    return retriever
 
 def list_indexed_documents(vector_store):
-    """Lists unique 'source' (filename) documents in the in-memory vector store."""
-    collection_name_debug = vector_store._collection.name if hasattr(vector_store, '_collection') and vector_store._collection else 'N/A'
-    print(f"--- Listing indexed documents from IN-MEMORY vector store. Collection: {collection_name_debug} ---")
+    """Lists unique 'source' (filename) documents in the vector store."""
+    store_name = describe_store(vector_store)
+    print(f"--- Listing indexed documents from the {store_name} ---")
     try:
-        # In-memory store still holds documents in the same way
-        all_docs_result = vector_store.get(include=["metadatas"]) 
-        if all_docs_result and all_docs_result['metadatas']:
-            sources = set(meta['source'] for meta in all_docs_result['metadatas'] if 'source' in meta)
-            sorted_sources = sorted(list(sources))
-            print(f"--- Found indexed sources in IN-MEMORY store: {sorted_sources} ---")
+        sorted_sources = sorted(get_indexed_hashes(vector_store))
+        if sorted_sources:
+            print(f"--- Found indexed sources in the {store_name}: {sorted_sources} ---")
             return sorted_sources
-        print("--- No metadatas found or no 'source' key in metadatas (in-memory). Returning empty list. ---")
+        print(f"--- No indexed sources in the {store_name}. Returning empty list. ---")
         return []
     except Exception as e:
-        print(f"--- Error listing indexed documents from IN-MEMORY store: {e}. ---")
+        print(f"--- Error listing indexed documents from the {store_name}: {e}. ---")
         return []
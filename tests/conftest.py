@@ -0,0 +1,18 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import telemetry  # noqa: E402
+
+
+@pytest.fixture
+def memory_telemetry():
+    """Enables telemetry with a fresh in-memory exporter for one test."""
+    exporter = telemetry.InMemoryExporter()
+    telemetry.configure(enabled=True, exporters=[exporter])
+    telemetry.reset()
+    yield exporter
+    telemetry.configure(enabled=False, exporters=[])
+    telemetry.reset()
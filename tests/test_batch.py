@@ -0,0 +1,70 @@
+import json
+from langchain_core.documents import Document
+from core import batch
+from core.batch import answer_questions, fake_llm, open_store
+from core.fakes import FakeStreamingChatModel
+from core.pdf_processor import assign_chunk_ids
+from core.vector_store import index_documents
+
+
+class _UnavailableChatModel(FakeStreamingChatModel):
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        raise RuntimeError("503 model unavailable")
+
+
+def _store():
+    store = open_store(fake=True)
+    chunks = [Document(page_content=f"page {page}: the valve torque is {page * 10} Nm", metadata={"source": "a.pdf", "page": page}) for page in range(3)]
+    index_documents(store, assign_chunk_ids(chunks, "a" * 64))
+    return store
+
+
+def _questions(count):
+    return [{"id": f"q{i}", "question": f"What is the torque on page {i}?"} for i in range(count)]
+
+
+def _ids(path):
+    return [json.loads(line)["id"] for line in path.read_text().splitlines()]
+
+
+def test_resume_skips_unreadable_lines_and_a_torn_tail(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    output.write_text('{"id": "q0", "answer": "x"}\nnot json\n{"id": "q1", "ans')
+
+    summary = answer_questions(_store(), _questions(3), str(output), llm=fake_llm(), resume=True)
+
+    assert (summary["skipped"], summary["answered"], summary["failed"]) == (1, 2, [])
+    lines = output.read_text().splitlines()
+    assert lines[:2] == ['{"id": "q0", "answer": "x"}', "not json"]
+    assert sorted(json.loads(line)["id"] for line in lines[2:]) == ["q1", "q2"]
+
+
+def test_failed_writes_are_reported(tmp_path, monkeypatch):
+    output = tmp_path / "answers.jsonl"
+    dumps = json.dumps
+
+    def failing_dumps(record, *args, **kwargs):
+        if record.get("id") == "q1":
+            raise OSError("disk full")
+        return dumps(record, *args, **kwargs)
+
+    monkeypatch.setattr(batch.json, "dumps", failing_dumps)
+    summary = answer_questions(_store(), _questions(3), str(output), llm=fake_llm())
+
+    assert summary["failed"] == ["q1"]
+    assert sorted(_ids(output)) == ["q0", "q2"]
+
+
+def test_generation_errors_are_recorded_and_retried_on_resume(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    store = _store()
+
+    summary = answer_questions(store, _questions(2), str(output), llm=_UnavailableChatModel())
+
+    assert (summary["answered"], summary["errors"], summary["failed"]) == (0, 2, [])
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert all(r["answer"] is None and "503 model unavailable" in r["error"] for r in records)
+
+    retried = answer_questions(store, _questions(2), str(output), llm=fake_llm(), resume=True)
+
+    assert (retried["skipped"], retried["answered"], retried["errors"]) == (0, 2, 0)
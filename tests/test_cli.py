@@ -0,0 +1,24 @@
+import pytest
+import cli
+
+
+@pytest.mark.parametrize("order", ["before", "after"])
+def test_shared_options_are_accepted_before_or_after_the_command(tmp_path, monkeypatch, order):
+    index_dir = str(tmp_path / "index")
+    opened = []
+    monkeypatch.setattr(cli, "cmd_index", lambda args: opened.append((args.index_dir, args.fake, args.workers)) or 0)
+    shared = ["--index-dir", index_dir, "--fake", "--workers", "1"]
+
+    argv = shared + ["index", "docs/"] if order == "before" else ["index", "docs/"] + shared
+    assert cli.main(argv) == 0
+
+    assert opened == [(index_dir, True, 1)]
+
+
+def test_shared_options_default_when_not_given(monkeypatch):
+    seen = []
+    monkeypatch.setattr(cli, "cmd_index", lambda args: seen.append((args.index_dir, args.fake, args.quantization)) or 0)
+
+    cli.main(["index", "docs/"])
+
+    assert seen == [(cli.DEFAULT_INDEX_DIR, False, None)]
@@ -0,0 +1,107 @@
+from typing import List
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from core.context_packing import (
+    CHARS_PER_TOKEN, PackedContextRetriever, PackingReport, estimate_tokens, overlap_length, pack_context,
+)
+from core.pdf_processor import _make_text_splitter, assign_chunk_ids
+
+class _ListRetriever(BaseRetriever):
+    documents: List[Document]
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.documents
+
+
+WORDS = ["valve", "torque", "pressure", "seal", "gasket", "pump", "flange", "bolt", "inspect", "replace", "rotor"]
+
+
+def _page_text(page, words=900):
+    return " ".join(f"{WORDS[(i * 7 + page) % len(WORDS)]}{page}x{i}" for i in range(words))
+
+
+def _split(pages, source="manual.pdf", doc_hash="a" * 64):
+    pages_docs = [Document(page_content=_page_text(page), metadata={"source": source, "page": page}) for page in pages]
+    return assign_chunk_ids(_make_text_splitter().split_documents(pages_docs), doc_hash)
+
+
+def test_overlap_length_finds_the_shared_suffix():
+    chunks = _split([0])
+    left, right = chunks[0].page_content, chunks[1].page_content
+
+    overlap = overlap_length(left, right)
+
+    assert overlap > 150 and left.endswith(right[:overlap])
+    assert overlap_length(left, chunks[3].page_content) == 0
+    assert overlap_length("the valve seal", "valve seal and more") == 0 # Under MIN_OVERLAP_CHARS
+
+
+def test_overlapping_chunks_merge_into_a_contiguous_page_substring():
+    chunks = _split([0])
+    retrieved = [chunks[2], chunks[3], chunks[1]] # Relevance order, not page order
+
+    packed, report = pack_context(retrieved, token_budget=10_000)
+
+    assert len(packed) == 1
+    assert packed[0].page_content in _page_text(0)
+    assert packed[0].page_content.startswith(chunks[1].page_content)
+    assert packed[0].page_content.endswith(chunks[3].page_content)
+    assert packed[0].metadata["merged_chunks"] == 3
+    original = sum(estimate_tokens(c.page_content) for c in retrieved)
+    assert (report.retrieved_chunks, report.packed_blocks, report.merged_chunks) == (3, 1, 2)
+    assert (report.original_tokens, report.packed_tokens) == (original, estimate_tokens(packed[0].page_content))
+    assert report.saved_tokens == original - report.packed_tokens
+    assert report.saved_tokens >= 2 * 150 // CHARS_PER_TOKEN # Both overlaps are sent once
+
+
+def test_blocks_keep_their_best_rank_and_separate_pages_stay_apart():
+    chunks = _split([0, 1])
+    page0 = [c for c in chunks if c.metadata["page"] == 0]
+    page1 = [c for c in chunks if c.metadata["page"] == 1]
+    retrieved = [page1[4], page0[0], page0[6], page1[5]]
+
+    packed, report = pack_context(retrieved, token_budget=10_000)
+
+    # page0 positions 0 and 6 neither touch nor overlap; page1 positions 4 and 5 merge
+    assert [(d.metadata["page"], d.metadata.get("merged_chunks", 1)) for d in packed] == [(1, 2), (0, 1), (0, 1)]
+    assert packed[1].page_content == page0[0].page_content and packed[2].page_content == page0[6].page_content
+    assert report.merged_chunks == 1
+
+
+def test_near_duplicate_blocks_are_dropped():
+    original = _split([0])[2]
+    copy = _split([0], source="copy.pdf", doc_hash="b" * 64)[2]
+    edited = Document(page_content=copy.page_content.replace(WORDS[0], "VALVE", 1), metadata=copy.metadata)
+
+    packed, report = pack_context([original, edited, _split([1])[0]], token_budget=10_000)
+
+    assert [d.metadata["source"] for d in packed] == ["manual.pdf", "manual.pdf"]
+    assert report.dropped_duplicates == 1
+    assert report.saved_tokens == estimate_tokens(edited.page_content)
+
+
+def test_budget_truncates_the_top_block_and_skips_blocks_that_do_not_fit():
+    chunks = _split([0])
+    retrieved = [chunks[0], chunks[5], chunks[9]]
+
+    packed, report = pack_context(retrieved, token_budget=100)
+
+    assert [d.page_content for d in packed] == [chunks[0].page_content[:100 * CHARS_PER_TOKEN]]
+    assert (report.packed_tokens, report.dropped_over_budget) == (100, 2)
+    assert report.saved_tokens == report.original_tokens - 100
+
+    packed, report = pack_context(retrieved, token_budget=2 * estimate_tokens(chunks[0].page_content) + 10)
+
+    assert [d.page_content for d in packed] == [chunks[0].page_content, chunks[5].page_content]
+    assert report.dropped_over_budget == 1
+
+
+def test_packed_context_retriever_records_its_report():
+    chunks = _split([0])
+    retriever = PackedContextRetriever(retriever=_ListRetriever(documents=chunks[1:4]), token_budget=10_000)
+
+    packed = retriever.invoke("valve torque")
+
+    assert len(packed) == 1
+    assert isinstance(retriever.last_report, PackingReport) and retriever.last_report.merged_chunks == 2
+
@@ -0,0 +1,72 @@
+import sqlite3
+import numpy as np
+from core.embedding_cache import CachedEmbeddings, EmbeddingCache, text_hash
+from core.fakes import DeterministicFakeEmbeddings
+
+
+def test_hits_and_misses_are_counted():
+    cache = EmbeddingCache(":memory:")
+    underlying = DeterministicFakeEmbeddings(size=8)
+    embeddings = CachedEmbeddings(underlying, "fake-model", cache)
+
+    first = embeddings.embed_documents(["a", "b", "a"])
+    assert underlying.embedded_texts == 2 # "a" is only sent once
+    assert cache.stats()["misses"] == 3 and cache.stats()["hits"] == 0
+
+    second = embeddings.embed_documents(["a", "b", "c"])
+    assert underlying.embedded_texts == 3
+    assert np.allclose(second[:2], first[:2], atol=1e-6)
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 4
+
+
+def test_query_vectors_are_cached_separately_from_documents():
+    cache = EmbeddingCache(":memory:")
+    underlying = DeterministicFakeEmbeddings(size=8)
+    embeddings = CachedEmbeddings(underlying, "fake-model", cache)
+
+    embeddings.embed_documents(["what is x"])
+    embeddings.embed_query("what is x")
+    assert underlying.embedded_texts == 2
+    embeddings.embed_query("what is x")
+    vectors = embeddings.embed_queries(["what is x", "new"])
+    assert np.allclose(vectors[0], underlying._embed("what is x"), atol=1e-6)
+    assert underlying.embedded_texts == 3
+
+
+def test_lru_eviction_keeps_recently_used_entries():
+    cache = EmbeddingCache(":memory:", max_entries=3)
+    underlying = DeterministicFakeEmbeddings(size=4)
+    embeddings = CachedEmbeddings(underlying, "fake-model", cache)
+
+    embeddings.embed_documents(["a"])
+    embeddings.embed_documents(["b"])
+    embeddings.embed_documents(["c"])
+    embeddings.embed_documents(["a"]) # Touch "a" so "b" is now the least recently used
+    embeddings.embed_documents(["d"])
+
+    assert cache.stats()["entries"] == 3
+    assert cache.stats()["evictions"] == 1
+    found = cache.get_many("fake-model", ["a", "b", "c", "d"])
+    assert [v is not None for v in found] == [True, False, True, True]
+
+
+def _last_used(path, text):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT last_used FROM embeddings WHERE text_hash = ?", (text_hash(text),)).fetchone()[0]
+
+
+def test_lookups_buffer_lru_touches_instead_of_committing(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    cache = EmbeddingCache(path)
+    cache.put_many("fake-model", ["a", "b"], [[1.0, 0.0], [0.0, 1.0]])
+    stored = _last_used(path, "a")
+    assert cache._conn.execute("PRAGMA synchronous").fetchone()[0] == 1 # NORMAL
+
+    changes = cache._conn.total_changes
+    assert cache.get_many("fake-model", ["a"])[0] == [1.0, 0.0]
+    assert cache._conn.total_changes == changes and not cache._conn.in_transaction
+    assert _last_used(path, "a") == stored
+
+    cache.close() # Pending touches are written on close
+    assert _last_used(path, "a") > stored
+    assert _last_used(path, "b") == stored
@@ -0,0 +1,76 @@
+from langchain_core.documents import Document
+from core.fakes import DeterministicFakeEmbeddings
+from core.hybrid_retriever import HybridRetriever, document_key, reciprocal_rank_fusion
+from core.lexical_index import BM25Index
+from core.numpy_store import NumpyVectorStore
+
+TEXTS = [
+    "Error ERR-4021 means the pump seal is worn.",
+    "Check the valve torque monthly.",
+    "ERR-4022 is raised when the rotor housing overheats.",
+    "Replace the seal and the gasket together.",
+]
+
+
+def _doc(name, source="a.pdf"):
+    return Document(page_content=f"text {name}", metadata={"source": source, "page": 0, "chunk_id": name})
+
+
+def _retriever(**kwargs):
+    ids = [f"c{i}" for i in range(len(TEXTS))]
+    metadatas = [{"source": "b.pdf" if i == 2 else "a.pdf", "page": i, "chunk_id": ids[i]} for i in range(len(TEXTS))]
+    store = NumpyVectorStore(DeterministicFakeEmbeddings(size=16))
+    store.add_texts(TEXTS, metadatas=metadatas, ids=ids)
+    lexical = BM25Index()
+    lexical.add(ids, TEXTS, metadatas)
+    return HybridRetriever(vector_store=store, lexical_index=lexical, k=3, **kwargs), store.embeddings
+
+
+def test_rrf_rewards_documents_ranked_by_both_lists():
+    a, b, c, d = (_doc(name) for name in "abcd")
+
+    fused = reciprocal_rank_fusion([[a, b, c], [c, d, a]], k=3, rrf_k=60)
+
+    # a: 1/61 + 1/63, c: 1/63 + 1/61 (tie, a seen first), then b (1/62) over d (1/62, seen later)
+    assert [doc.metadata["chunk_id"] for doc in fused] == ["a", "c", "b"]
+    assert len(reciprocal_rank_fusion([[a], [a]], k=5)) == 1
+
+
+def test_document_key_falls_back_to_source_page_and_text():
+    first = Document(page_content="same text", metadata={"source": "a.pdf", "page": 1})
+    assert document_key(first) == document_key(Document(page_content="same text", metadata={"source": "a.pdf", "page": 1}))
+    assert document_key(first) != document_key(Document(page_content="same text", metadata={"source": "b.pdf", "page": 1}))
+    assert document_key(_doc("x")) == "x"
+
+
+def test_confident_identifier_query_skips_the_dense_search():
+    retriever, embeddings = _retriever()
+
+    hits = retriever.invoke("ERR-4021")
+
+    assert retriever.last_mode == "lexical"
+    assert hits[0].page_content == TEXTS[0]
+    assert embeddings.embedded_texts == len(TEXTS) # The query was never embedded
+
+
+def test_plain_questions_fuse_lexical_and_dense_rankings():
+    retriever, embeddings = _retriever()
+
+    hits = retriever.invoke("how do I replace the seal")
+
+    assert retriever.last_mode == "hybrid"
+    assert embeddings.embedded_texts == len(TEXTS) + 1
+    assert len(hits) == 3 and len({document_key(doc) for doc in hits}) == 3
+    assert TEXTS[3] in [doc.page_content for doc in hits]
+
+    retriever.invoke("ERR-4021")
+    assert retriever.last_mode == "lexical" # Switches back per query
+
+
+def test_lexical_only_can_be_disabled_and_filters_apply_to_both_rankings():
+    retriever, _ = _retriever(allow_lexical_only=False, filter={"source": {"$in": ["b.pdf"]}})
+
+    hits = retriever.invoke("ERR-4021")
+
+    assert retriever.last_mode == "hybrid"
+    assert [doc.metadata["source"] for doc in hits] == ["b.pdf"]
@@ -0,0 +1,63 @@
+from langchain_core.documents import Document
+from core.fakes import FlakyFakeEmbeddings
+from core.ingest import ingest_documents
+from core.numpy_store import NumpyVectorStore
+
+
+def _documents(count):
+    return [Document(page_content=f"chunk {i}", metadata={"source": "a.pdf", "page": i}) for i in range(count)]
+
+
+def test_quota_errors_are_retried():
+    embeddings = FlakyFakeEmbeddings(size=8, fail_first=2)
+    store = NumpyVectorStore(embeddings)
+
+    report = ingest_documents(store, _documents(10), batch_size=5, max_in_flight=1, base_delay=0.0)
+
+    assert report.ok
+    assert report.retries == 2
+    assert report.ingested_chunks == 10
+    assert len(store.index) == 10
+
+
+def test_non_retryable_errors_fail_the_batch_without_retrying():
+    embeddings = FlakyFakeEmbeddings(size=8, fail_first=1, error_factory=ValueError)
+    store = NumpyVectorStore(embeddings)
+
+    report = ingest_documents(store, _documents(10), batch_size=5, max_in_flight=1, base_delay=0.0)
+
+    assert not report.ok
+    assert report.retries == 0
+    assert [index for index, _ in report.failed_batches] == [0]
+    assert report.ingested_chunks == 5
+
+
+def test_concurrency_is_bounded():
+    embeddings = FlakyFakeEmbeddings(size=8, latency=0.02)
+    store = NumpyVectorStore(embeddings)
+
+    ingest_documents(store, _documents(40), batch_size=2, max_in_flight=3)
+
+    assert 1 < embeddings.max_in_flight <= 3
+
+
+def test_checkpoint_resumes_only_failed_batches(tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    documents = _documents(15)
+    ids = [f"id-{i}" for i in range(15)]
+    embeddings = FlakyFakeEmbeddings(size=8, fail_first=1, error_factory=ValueError)
+    store = NumpyVectorStore(embeddings)
+
+    failed = ingest_documents(store, documents, ids=ids, batch_size=5, max_in_flight=1, checkpoint_path=checkpoint_path)
+    assert not failed.ok
+    assert (tmp_path / "checkpoint.json").exists()
+
+    embedded_before = embeddings.embedded_texts
+    resumed = ingest_documents(store, documents, ids=ids, batch_size=5, max_in_flight=1, checkpoint_path=checkpoint_path)
+
+    assert resumed.ok
+    assert resumed.resumed_chunks == 10
+    assert resumed.ingested_chunks == 5
+    assert embeddings.embedded_texts - embedded_before == 5
+    assert len(store.index) == 15
+    assert not (tmp_path / "checkpoint.json").exists() # Cleared once everything landed
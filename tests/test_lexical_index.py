@@ -0,0 +1,68 @@
+import pytest
+from langchain_core.documents import Document
+from core.lexical_index import BM25Index, is_identifier, lexical_is_confident, tokenize
+
+CHUNKS = [
+    ("a1", "Error ERR-4021 means the pump seal is worn; replace the seal.", {"source": "a.pdf", "page": 0}),
+    ("a2", "Check the valve torque monthly.", {"source": "a.pdf", "page": 1}),
+    ("b1", "ERR-4022 is raised when the rotor housing overheats.", {"source": "b.pdf", "page": 0}),
+    ("b2", "The seal kit for revision A7.3b ships with two gaskets.", {"source": "b.pdf", "page": 3}),
+    ("c1", "Replace the seal and the gasket together.", {"source": "c.pdf", "page": 0}),
+]
+
+
+@pytest.fixture
+def index():
+    index = BM25Index()
+    index.add([c[0] for c in CHUNKS], [c[1] for c in CHUNKS], [c[2] for c in CHUNKS])
+    return index
+
+
+def _sources(results):
+    return [doc.metadata["source"] for doc, _ in results]
+
+
+def test_compound_identifiers_are_kept_whole_and_split():
+    assert tokenize("See ERR-4021 and rev A7.3b.") == ["see", "err-4021", "err", "4021", "and", "rev", "a7.3b", "a7", "3b"]
+    assert tokenize("path/to_file") == ["path/to_file", "path", "to", "file"]
+    assert is_identifier("err-4021") and is_identifier("a7") and not is_identifier("seal")
+
+
+def test_identifier_matches_exact_code_first(index):
+    results = index.search("what does ERR-4021 mean", k=3)
+
+    assert results[0][0].page_content.startswith("Error ERR-4021")
+    assert [doc.page_content for doc, _ in index.search("4021")] == [CHUNKS[0][1]] # Matched by its numeric part
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+
+
+def test_search_honours_partition_and_where_filters(index):
+    assert set(_sources(index.search("seal", k=10))) == {"a.pdf", "b.pdf", "c.pdf"}
+    assert _sources(index.search("seal", k=10, filter={"source": "c.pdf"})) == ["c.pdf"]
+    assert set(_sources(index.search("seal", k=10, filter={"source": {"$in": ["a.pdf", "b.pdf"]}}))) == {"a.pdf", "b.pdf"}
+    where = {"$and": [{"source": {"$in": ["a.pdf", "b.pdf"]}}, {"page": {"$ne": 0}}]}
+    assert [doc.metadata["page"] for doc, _ in index.search("seal", k=10, filter=where)] == [3]
+    assert index.search("seal", k=10, filter={"source": {"$in": ["missing.pdf"]}}) == []
+
+
+def test_add_replaces_and_remove_forgets_chunks(index):
+    index.add(["a1"], ["Torque the flange bolts."], [{"source": "a.pdf", "page": 0}])
+    assert index.search("4021") == []
+    assert _sources(index.search("flange")) == ["a.pdf"]
+
+    index.remove(["a1", "missing"])
+
+    assert len(index) == len(CHUNKS) - 1
+    assert index.search("flange") == []
+
+
+def test_lexical_is_confident_needs_a_clearly_winning_identifier(index):
+    assert lexical_is_confident("ERR-4021", index.search("ERR-4021"))
+    # "err" is shared by two chunks, but the whole code only matches one
+    assert lexical_is_confident("what is err-4022?", index.search("what is err-4022?"))
+    assert not lexical_is_confident("replace the seal", index.search("replace the seal")) # No identifier
+    assert not lexical_is_confident("ERR-9999", index.search("ERR-9999")) # Identifier absent from the top hit
+    assert not lexical_is_confident("ERR-4021", [])
+    tied = [(Document(page_content="ERR-4021 here"), 2.0), (Document(page_content="ERR-4021 there"), 1.9)]
+    assert not lexical_is_confident("ERR-4021", tied)
+    assert lexical_is_confident("ERR-4021", tied[:1])
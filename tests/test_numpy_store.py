@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+from core.fakes import DeterministicFakeEmbeddings
+from core.numpy_store import NumpyVectorStore
+from core.persistent_index import PersistentIndex
+
+SOURCES = [f"doc-{i}.pdf" for i in range(6)]
+
+
+def _populate(store, per_source=40):
+    texts, metadatas, ids = [], [], []
+    # Interleave sources so partitions span several row ranges
+    for batch in range(2):
+        for source in SOURCES:
+            for i in range(per_source // 2):
+                page = batch * per_source + i
+                texts.append(f"{source} page {page} text")
+                metadatas.append({"source": source, "page": page})
+                ids.append(f"{source}:{page}")
+    store.add_texts(texts, metadatas=metadatas, ids=ids)
+    return texts, metadatas
+
+
+def _brute_force(embeddings, texts, metadatas, query, k, allowed):
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    q = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+    q /= np.linalg.norm(q)
+    candidates = [i for i, m in enumerate(metadatas) if allowed(m)]
+    scores = vectors[candidates] @ q
+    order = np.argsort(-scores, kind="stable")[:k]
+    return [texts[candidates[i]] for i in order]
+
+
+@pytest.fixture(params=["memory", "persistent"])
+def store(request, tmp_path):
+    embeddings = DeterministicFakeEmbeddings(size=32)
+    index = PersistentIndex(str(tmp_path)) if request.param == "persistent" else None
+    return NumpyVectorStore(embeddings, index)
+
+
+@pytest.mark.parametrize("selected", [["doc-1.pdf"], ["doc-0.pdf", "doc-4.pdf"], SOURCES])
+def test_partition_filtered_search_matches_brute_force(store, selected):
+    texts, metadatas = _populate(store)
+    query = "doc-4.pdf page 7 text"
+    expected = _brute_force(store.embeddings, texts, metadatas, query, 5, lambda m: m["source"] in selected)
+
+    hits = store.similarity_search(query, k=5, filter={"source": {"$in": selected}})
+
+    assert [doc.page_content for doc in hits] == expected
+    assert all(doc.metadata["source"] in selected for doc in hits)
+
+
+def test_general_filter_matches_brute_force(store):
+    texts, metadatas = _populate(store)
+    where = {"$and": [{"source": {"$in": ["doc-2.pdf", "doc-3.pdf"]}}, {"page": {"$ne": 3}}]}
+    expected = _brute_force(
+        store.embeddings, texts, metadatas, "page 3", 4, lambda m: m["source"] in ("doc-2.pdf", "doc-3.pdf") and m["page"] != 3
+    )
+
+    assert [doc.page_content for doc in store.similarity_search("page 3", k=4, filter=where)] == expected
+
+
+def test_deleted_rows_are_never_returned(store):
+    _populate(store)
+    deleted = store.get(where={"source": "doc-1.pdf"}, include=[])["ids"]
+    store.delete(ids=deleted)
+
+    hits = store.similarity_search("doc-1.pdf page 1 text", k=10, filter={"source": {"$in": ["doc-1.pdf", "doc-2.pdf"]}})
+
+    assert hits and all(doc.metadata["source"] == "doc-2.pdf" for doc in hits)
+
+
+def test_batched_search_matches_single_queries(store):
+    _populate(store)
+    queries = ["doc-0.pdf page 1 text", "doc-5.pdf page 30 text"]
+    vectors = [store.embeddings.embed_query(q) for q in queries]
+
+    batched = store.similarity_search_by_vectors_with_score(vectors, k=3)
+
+    for query, hits in zip(queries, batched):
+        assert [d.page_content for d, _ in hits] == [d.page_content for d in store.similarity_search(query, k=3)]
+
+
+def test_source_hashes_lists_live_sources(store):
+    texts = [f"text {i}" for i in range(6)]
+    metadatas = [{"source": f"doc-{i % 3}.pdf", "doc_hash": f"h{i % 3}", "page": i} for i in range(6)]
+    store.add_texts(texts, metadatas=metadatas, ids=[f"id-{i}" for i in range(6)])
+    store.delete(ids=["id-0", "id-3", "id-1"]) # Every chunk of doc-0.pdf, one of doc-1.pdf
+
+    assert store.index.source_hashes() == {"doc-1.pdf": "h1", "doc-2.pdf": "h2"}
+
+
+def test_search_retries_when_compaction_renumbers_rows_mid_read(store, monkeypatch):
+    _populate(store)
+    store.delete(ids=store.get(where={"source": "doc-0.pdf"}, include=[])["ids"])
+    expected = [d.page_content for d in store.similarity_search("doc-3.pdf page 2 text", k=5)]
+    records = store.index.records
+
+    def records_after_compaction(rows):
+        # Another session compacts between this search's snapshot and its record lookup
+        monkeypatch.setattr(store.index, "records", records)
+        store.index.compact()
+        return records(rows)
+
+    monkeypatch.setattr(store.index, "records", records_after_compaction)
+    hits = store.similarity_search("doc-3.pdf page 2 text", k=5)
+
+    assert [d.page_content for d in hits] == expected
+
+
+@pytest.mark.parametrize("kind", ["memory", "persistent"])
+def test_quantized_store_reports_resident_memory_and_recall(kind, tmp_path):
+    embeddings = DeterministicFakeEmbeddings(size=32)
+    index = PersistentIndex(str(tmp_path)) if kind == "persistent" else None
+    store = NumpyVectorStore(embeddings, index, quantization="int8")
+    _populate(store)
+    queries = [embeddings.embed_query(f"doc-{i}.pdf page {i} text") for i in range(6)]
+
+    report = store.evaluate_quantization(queries, k=5)
+
+    assert report["recall_at_k"] >= 0.9
+    assert not report["float32_in_memory"] # Only the int8 copy is on the heap
+    assert report["resident_bytes"] == report["quantized_bytes"] == 240 * 32 + 240 * 4
+    assert report["saved_bytes"] == report["float32_bytes"] - report["resident_bytes"]
+    assert report["ratio"] == pytest.approx(36 / 128)
+
+
+def test_unquantized_in_memory_store_reports_the_float32_matrix(store):
+    _populate(store)
+
+    report = store.memory_report()
+
+    assert report["resident_bytes"] == (report["float32_bytes"] if report["float32_in_memory"] else 0)
+    with pytest.raises(ValueError):
+        store.evaluate_quantization([store.embeddings.embed_query("page 1")])
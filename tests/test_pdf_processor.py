@@ -0,0 +1,84 @@
+import os
+import fitz
+from core.pdf_processor import FileError, PdfBytes, iter_process_pdfs, process_pdfs
+
+
+def _pdf_bytes(pages):
+    doc = fitz.open()
+    for page in range(pages):
+        doc.new_page().insert_text((72, 72), f"Page {page}: the valve torque is {page * 10} Nm.")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def _shared_blocks():
+    return set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+
+
+def _write_pdfs(tmp_path, page_counts):
+    paths = []
+    for name, pages in page_counts:
+        path = tmp_path / name
+        path.write_bytes(_pdf_bytes(pages) if pages else b"%PDF-1.7 truncated garbage")
+        paths.append(str(path))
+    return paths
+
+
+def _summary(batches):
+    return [(b.source, b.page_range, [(c.page_content, c.metadata["chunk_id"]) for c in b.chunks], b.errors) for b in batches]
+
+
+def test_large_uploads_are_extracted_by_workers_like_inline():
+    uploads = [PdfBytes("big.pdf", memoryview(_pdf_bytes(7))), PdfBytes("small.pdf", _pdf_bytes(1))]
+    before = _shared_blocks()
+
+    pooled = list(iter_process_pdfs(uploads, max_workers=2, pages_per_task=2))
+    inline = list(iter_process_pdfs(uploads, max_workers=1, pages_per_task=2))
+
+    assert _summary(pooled) == _summary(inline)
+    assert [b.page_range for b in pooled] == [(0, 2), (2, 4), (4, 6), (6, 7), (0, 1)]
+    assert all(c.metadata["source"] == "big.pdf" and c.metadata["file_path"] == "big.pdf" for c in pooled[0].chunks)
+    assert _shared_blocks() == before # Every shared block was unlinked
+
+
+def test_abandoned_runs_release_shared_memory():
+    before = _shared_blocks()
+    batches = iter_process_pdfs([PdfBytes("big.pdf", _pdf_bytes(9))], max_workers=2, pages_per_task=2)
+
+    next(batches)
+    batches.close()
+
+    assert _shared_blocks() == before
+
+
+def test_file_paths_are_extracted_by_the_pool_in_file_then_page_order(tmp_path):
+    paths = _write_pdfs(tmp_path, [("a.pdf", 5), ("broken.pdf", 0), ("b.pdf", 3), ("c.pdf", 1)])
+
+    pooled = list(iter_process_pdfs(paths, max_workers=3, pages_per_task=2))
+    inline = list(iter_process_pdfs(paths, max_workers=1, pages_per_task=2))
+
+    assert _summary(pooled) == _summary(inline)
+    assert [(b.source, b.page_range) for b in pooled] == [
+        ("a.pdf", (0, 2)), ("a.pdf", (2, 4)), ("a.pdf", (4, 5)),
+        ("broken.pdf", (0, 0)),
+        ("b.pdf", (0, 2)), ("b.pdf", (2, 3)),
+        ("c.pdf", (0, 1)),
+    ]
+    pages = [(c.metadata["source"], c.metadata["page"]) for b in pooled for c in b.chunks]
+    assert pages == sorted(pages, key=lambda item: (["a.pdf", "b.pdf", "c.pdf"].index(item[0]), item[1]))
+    assert all(b.errors == [] for b in pooled if b.source != "broken.pdf")
+    error, = pooled[3].errors
+    assert isinstance(error, FileError) and (error.source, error.page_range) == ("broken.pdf", None)
+    assert pooled[3].chunks == []
+
+
+def test_parallel_process_pdfs_matches_sequential_and_reports_unreadable_files(tmp_path):
+    paths = _write_pdfs(tmp_path, [("a.pdf", 3), ("broken.pdf", 0), ("b.pdf", 2)])
+    parallel_errors, sequential_errors = [], []
+
+    parallel = process_pdfs(paths, parallel=True, max_workers=2, errors=parallel_errors)
+    sequential = process_pdfs(paths, errors=sequential_errors)
+
+    assert [(c.page_content, c.metadata["chunk_id"]) for c in parallel] == [(c.page_content, c.metadata["chunk_id"]) for c in sequential]
+    assert [(e.source, e.page_range) for e in parallel_errors] == [(e.source, e.page_range) for e in sequential_errors] == [("broken.pdf", None)]
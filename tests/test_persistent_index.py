@@ -0,0 +1,112 @@
+import os
+import numpy as np
+import pytest
+from core.persistent_index import FORMAT_VERSION, IndexFormatError, MANIFEST_FILE, PersistentIndex
+
+DIM = 8
+
+
+def _vectors(count, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, DIM)).astype(np.float32)
+
+
+def _append(index, start, count):
+    ids = [f"id-{i}" for i in range(start, start + count)]
+    texts = [f"text {i}" for i in ids]
+    metadatas = [{"source": f"doc-{i % 3}.pdf", "page": i} for i in range(start, start + count)]
+    index.append(ids, _vectors(count, seed=start), texts, metadatas)
+    return ids
+
+
+def test_reopen_keeps_committed_rows(tmp_path):
+    index = PersistentIndex(str(tmp_path))
+    _append(index, 0, 10)
+    index.close()
+
+    reopened = PersistentIndex(str(tmp_path))
+    assert reopened.rows == 10
+    assert reopened.dim == DIM
+    assert reopened.records([3])[0][0] == "id-3"
+    assert np.allclose(np.linalg.norm(reopened.vectors(), axis=1), 1.0, atol=1e-5)
+
+
+def test_torn_append_is_truncated_on_open(tmp_path):
+    index = PersistentIndex(str(tmp_path))
+    _append(index, 0, 5)
+    vectors_path = index._vectors_path()
+    index.close()
+    # A crash after the vectors were written but before the SQLite commit
+    with open(vectors_path, "ab") as f:
+        f.write(_vectors(3).tobytes())
+
+    reopened = PersistentIndex(str(tmp_path))
+    assert reopened.rows == 5
+    assert os.path.getsize(vectors_path) == 5 * DIM * 4
+    _append(reopened, 5, 2)
+    assert reopened.records([5, 6]) == [
+        ("id-5", "text id-5", {"source": "doc-2.pdf", "page": 5}),
+        ("id-6", "text id-6", {"source": "doc-0.pdf", "page": 6}),
+    ]
+
+
+def test_append_with_existing_ids_is_an_upsert(tmp_path):
+    index = PersistentIndex(str(tmp_path))
+    _append(index, 0, 4)
+    _append(index, 2, 2)
+    assert index.rows == 6
+    assert len(index) == 4
+    assert index.rows_where(ids=["id-2"]) == [4]
+
+
+def test_compaction_drops_deleted_rows_and_switches_generation(tmp_path):
+    index = PersistentIndex(str(tmp_path))
+    ids = _append(index, 0, 12)
+    live_vectors = np.asarray(index.vectors())[[i for i in range(12) if i % 2]].copy()
+    index.delete(ids=ids[::2])
+    old_generation = index.generation
+
+    index.compact()
+
+    assert index.generation == old_generation + 1
+    assert index.rows == 6 and len(index) == 6
+    assert [r[0] for r in index.records(range(6))] == ids[1::2]
+    assert np.allclose(index.vectors(), live_vectors)
+    assert sorted(n for n in os.listdir(tmp_path) if n.startswith("vectors-")) == [f"vectors-{index.generation}.f32"]
+
+    reopened = PersistentIndex(str(tmp_path))
+    assert reopened.generation == index.generation
+    assert reopened.rows == 6
+
+
+def test_incompatible_format_is_rejected(tmp_path):
+    PersistentIndex(str(tmp_path)).close()
+    manifest_path = tmp_path / MANIFEST_FILE
+    manifest_path.write_text(manifest_path.read_text().replace(f'"version": {FORMAT_VERSION}', '"version": 999'))
+    with pytest.raises(IndexFormatError):
+        PersistentIndex(str(tmp_path))
+
+
+def test_completion_markers_survive_compaction_and_reopen(tmp_path):
+    index = PersistentIndex(str(tmp_path))
+    ids = _append(index, 0, 6)
+    index.mark_complete({"doc-0.pdf": "h0", "doc-1.pdf": "h1"})
+    index.forget_documents(["doc-1.pdf"])
+    index.delete(ids=ids[:2])
+    index.compact()
+    index.close()
+
+    reopened = PersistentIndex(str(tmp_path))
+    assert reopened.completed_documents() == {"doc-0.pdf": "h0"}
+    reopened.clear()
+    assert reopened.completed_documents() == {}
+
+
+def test_source_listing_reads_only_the_source_index(tmp_path):
+    index = PersistentIndex(str(tmp_path))
+    _append(index, 0, 9)
+    sql = "SELECT MIN(row) FROM chunks WHERE deleted = 0 AND source IS NOT NULL GROUP BY source"
+
+    plan = " ".join(str(step) for step in index._conn.execute(f"EXPLAIN QUERY PLAN {sql}"))
+
+    assert "COVERING INDEX idx_chunks_source_live" in plan
+    assert set(index.source_hashes()) == {"doc-0.pdf", "doc-1.pdf", "doc-2.pdf"}
@@ -0,0 +1,103 @@
+import uuid
+from langchain_community.vectorstores import Chroma
+from core.answer_cache import AnswerCache
+from core.embedding_cache import CachedEmbeddings, EmbeddingCache
+from core.fakes import DeterministicFakeEmbeddings, FakeStreamingChatModel, FlakyFakeEmbeddings
+from core.numpy_store import NumpyVectorStore
+from core.qa_engine import get_qa_chain, query_rag, stream_rag
+
+
+def _store():
+    store = NumpyVectorStore(DeterministicFakeEmbeddings(size=16))
+    store.add_texts(
+        [f"The valve torque for model {i} is {i * 10} Nm." for i in range(20)],
+        metadatas=[{"source": "manual.pdf", "page": i} for i in range(20)],
+    )
+    return store
+
+
+def _events(chain, question, **kwargs):
+    return list(stream_rag(chain, question, **kwargs))
+
+
+def test_stream_rag_reports_time_to_first_token_separately():
+    llm = FakeStreamingChatModel(answer_words=10, first_token_latency=0.2, token_latency=0.02)
+    chain = get_qa_chain(None, _store().as_retriever(search_kwargs={"k": 3}), llm=llm)
+
+    events = _events(chain, "What is the valve torque?")
+
+    kinds = [kind for kind, _ in events]
+    assert kinds[0] == "sources" and kinds[-1] == "done"
+    assert kinds.count("token") == 10
+    timings = events[-1][1]
+    assert timings["ttft_ms"] >= 200
+    assert timings["total_ms"] - timings["ttft_ms"] >= 9 * 20 * 0.9
+    assert timings["retrieval_ms"] <= timings["ttft_ms"]
+    assert not timings["cached"]
+    assert "manual.pdf" in events[0][1]
+
+
+def test_stream_rag_serves_repeated_questions_from_the_answer_cache():
+    llm = FakeStreamingChatModel(answer_words=5, first_token_latency=0.1)
+    chain = get_qa_chain(None, _store().as_retriever(), llm=llm)
+    cache = AnswerCache()
+
+    first = _events(chain, "What is the valve torque?", answer_cache=cache, fingerprint="f")
+    second = _events(chain, "what is the valve torque", answer_cache=cache, fingerprint="f")
+
+    answer = "".join(payload for kind, payload in first if kind == "token")
+    assert [payload for kind, payload in second if kind == "token"] == [answer]
+    assert second[-1][1]["cached"]
+    assert second[-1][1]["ttft_ms"] < 100
+
+
+def test_query_rag_matches_streamed_answer():
+    llm = FakeStreamingChatModel(answer_words=8)
+    chain = get_qa_chain(None, _store().as_retriever(), llm=llm)
+
+    answer, sources = query_rag(chain, "What is the valve torque?")
+    streamed = "".join(payload for kind, payload in _events(chain, "What is the valve torque?") if kind == "token")
+
+    assert answer == streamed
+    assert sources.startswith("- manual.pdf, Page:")
+
+
+def test_exact_cache_hits_do_not_embed_the_question():
+    chain = get_qa_chain(None, _store().as_retriever(), llm=FakeStreamingChatModel(answer_words=5))
+    cache = AnswerCache(semantic=True)
+    embeddings = DeterministicFakeEmbeddings(size=16)
+
+    query_rag(chain, "What is the valve torque?", answer_cache=cache, fingerprint="f", embeddings=embeddings)
+    assert embeddings.embedded_texts == 1
+    _events(chain, "what is the valve torque", answer_cache=cache, fingerprint="f", embeddings=embeddings)
+
+    assert embeddings.embedded_texts == 1
+    assert cache.stats()["exact_hits"] == 1
+
+
+def test_embedding_failures_skip_the_semantic_tier():
+    chain = get_qa_chain(None, _store().as_retriever(), llm=FakeStreamingChatModel(answer_words=5))
+    cache = AnswerCache(semantic=True)
+    failing = FlakyFakeEmbeddings(size=16, fail_first=2, error_factory=ValueError)
+
+    answer, sources = query_rag(chain, "What is the valve torque?", answer_cache=cache, fingerprint="f", embeddings=failing)
+    events = _events(chain, "Which valve is it?", answer_cache=cache, fingerprint="f", embeddings=failing)
+
+    assert answer and sources.startswith("- manual.pdf")
+    assert [kind for kind, _ in events if kind == "error"] == []
+    assert cache.stats()["misses"] == 2
+
+
+def test_query_rag_spans_cover_embedding_retrieval_and_generation_on_any_backend(memory_telemetry):
+    embeddings = CachedEmbeddings(DeterministicFakeEmbeddings(size=16), "fake-model", EmbeddingCache(":memory:"))
+    store = Chroma(collection_name=f"spans-{uuid.uuid4().hex[:8]}", embedding_function=embeddings)
+    store.add_texts(["The valve torque is 40 Nm."], metadatas=[{"source": "manual.pdf", "page": 0}])
+    chain = get_qa_chain(None, store.as_retriever(search_kwargs={"k": 1}), llm=FakeStreamingChatModel(answer_words=4))
+
+    query_rag(chain, "What is the valve torque?")
+
+    query = memory_telemetry.records("query")[0]
+    children = {r["name"]: r for r in memory_telemetry.records() if r["parent_id"] == query["span_id"]}
+    assert set(children) == {"retrieval", "generation"}
+    assert memory_telemetry.records("query_embed")[0]["parent_id"] == children["retrieval"]["span_id"]
+    assert children["generation"]["attributes"]["completion_tokens"] > 0
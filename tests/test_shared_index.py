@@ -0,0 +1,118 @@
+import gc
+import threading
+import time
+from core.fakes import DeterministicFakeEmbeddings
+from core.shared_index import SharedDocumentIndex, _ReadWriteLock
+
+
+def _chunks(doc_hash, source, count=4):
+    texts = [f"{source} chunk {i}" for i in range(count)]
+    metadatas = [{"source": source, "doc_hash": doc_hash, "page": i} for i in range(count)]
+    ids = [f"{doc_hash}:{i}:0" for i in range(count)]
+    return texts, metadatas, ids
+
+
+def _index(view, doc_hash, source, count=4):
+    texts, metadatas, ids = _chunks(doc_hash, source, count)
+    view.add_texts(texts, metadatas=metadatas, ids=ids)
+    view.mark_complete([doc_hash])
+
+
+def test_identical_documents_are_embedded_once_and_shared():
+    shared = SharedDocumentIndex()
+    embeddings = DeterministicFakeEmbeddings(size=16)
+    first, second = shared.session_view(embeddings), shared.session_view(embeddings)
+
+    _index(first, "h1", "report.pdf")
+    embedded = embeddings.embedded_texts
+    assert second.attach("renamed.pdf", "h1")
+
+    assert embeddings.embedded_texts == embedded
+    hits = second.similarity_search("report.pdf chunk 1", k=2)
+    assert hits and all(doc.metadata["source"] == "renamed.pdf" for doc in hits)
+    assert shared.stats()["referenced_documents"] == 1
+    assert shared.stats()["sessions"] == 2
+
+
+def test_incomplete_documents_are_not_reused():
+    shared = SharedDocumentIndex()
+    first, second = shared.session_view(DeterministicFakeEmbeddings(size=16)), shared.session_view(DeterministicFakeEmbeddings(size=16))
+    texts, metadatas, ids = _chunks("h1", "a.pdf")
+    first.add_texts(texts, metadatas=metadatas, ids=ids)
+
+    assert not second.attach("a.pdf", "h1")
+
+
+def test_sessions_only_see_their_own_documents():
+    shared = SharedDocumentIndex()
+    first, second = shared.session_view(DeterministicFakeEmbeddings(size=16)), shared.session_view(DeterministicFakeEmbeddings(size=16))
+    _index(first, "h1", "a.pdf")
+    _index(second, "h2", "b.pdf")
+
+    assert {doc.metadata["source"] for doc in first.similarity_search("chunk", k=10)} == {"a.pdf"}
+    assert {doc.metadata["source"] for doc in second.similarity_search("chunk", k=10)} == {"b.pdf"}
+
+
+def test_only_unreferenced_documents_are_evicted_least_recently_used_first():
+    embeddings = DeterministicFakeEmbeddings(size=16)
+    bytes_per_document = 4 * (16 * 4 + len("x.pdf chunk 0".encode("utf-8")))
+    shared = SharedDocumentIndex(max_bytes=int(bytes_per_document * 2.5))
+    keeper = shared.session_view(embeddings)
+    _index(keeper, "kept", "x.pdf")
+
+    transient = shared.session_view(embeddings)
+    _index(transient, "old", "y.pdf")
+    _index(transient, "new", "z.pdf")
+    assert shared.stats()["evictions"] == 0 # Over the cap, but every document is referenced
+
+    transient.delete(ids=transient.get(where={"source": "y.pdf"}, include=[])["ids"])
+    assert shared.stats()["evictions"] == 1
+    assert shared.stats()["documents"] == 2
+    assert keeper.similarity_search("x.pdf chunk 0", k=1)[0].metadata["doc_hash"] == "kept"
+
+
+def test_finalized_views_release_their_documents():
+    shared = SharedDocumentIndex()
+    view = shared.session_view(DeterministicFakeEmbeddings(size=16))
+    _index(view, "h1", "a.pdf")
+    assert shared.stats()["referenced_documents"] == 1
+
+    del view
+    gc.collect()
+    shared.release("nobody") # Any write drains the queue of ended sessions
+
+    assert shared.stats()["referenced_documents"] == 0
+    assert shared.stats()["documents"] == 1 # Still cached for a later upload
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_waiting_writer_blocks_new_readers():
+    lock = _ReadWriteLock()
+    order = []
+
+    def _write():
+        with lock.write():
+            order.append("writer")
+
+    def _read():
+        with lock.read():
+            order.append("late reader")
+
+    with lock.read():
+        writer = threading.Thread(target=_write)
+        writer.start()
+        _wait_for(lambda: lock._writers_waiting == 1)
+        reader = threading.Thread(target=_read)
+        reader.start()
+        time.sleep(0.05)
+        assert order == [] # Neither the writer nor the late reader got in while the first read is held
+
+    writer.join(5)
+    reader.join(5)
+    assert order == ["writer", "late reader"]
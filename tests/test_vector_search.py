@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from core.persistent_index import normalize_rows
+from core.vector_search import QuantizedMatrix, exact_top_k, quantized_top_k, recall_at_k
+
+
+class _RecordingMatrix:
+    """Float32 matrix that records which rows were read from it."""
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.rows_read = []
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def __getitem__(self, rows):
+        self.rows_read.extend(np.atleast_1d(np.arange(len(self.matrix))[rows]).tolist())
+        return self.matrix[rows]
+
+
+def _data(rows=3000, dim=64, queries=16, seed=7):
+    rng = np.random.default_rng(seed)
+    matrix = normalize_rows(rng.standard_normal((rows, dim)))
+    # Queries near stored rows, like questions about indexed passages
+    queries = normalize_rows(matrix[rng.choice(rows, queries, replace=False)] + 0.3 * rng.standard_normal((queries, dim)))
+    return matrix, queries
+
+
+@pytest.mark.parametrize("mode", ["int8", "float16"])
+def test_quantized_search_keeps_recall(mode):
+    matrix, queries = _data()
+    quantized = QuantizedMatrix(mode)
+    quantized.extend(matrix[:1000])
+    quantized.extend(matrix[1000:]) # Grown in place, like an index that keeps appending
+
+    exact_rows, exact_scores = exact_top_k(matrix, queries, 10)
+    approx_rows, approx_scores = quantized_top_k(matrix, quantized, queries, 10, shortlist_factor=4)
+
+    assert recall_at_k(exact_rows, approx_rows) >= 0.95
+    assert np.allclose(approx_scores[:, 0], exact_scores[:, 0]) # Re-ranked with the exact float32 scores
+    assert quantized.nbytes == (3000 * 64 + 3000 * 4 if mode == "int8" else 3000 * 64 * 2)
+
+
+def test_only_the_shortlist_is_read_from_the_float32_rows():
+    matrix, queries = _data(queries=4)
+    quantized = QuantizedMatrix("int8")
+    quantized.extend(matrix)
+    recording = _RecordingMatrix(matrix)
+
+    rows, scores = quantized_top_k(recording, quantized, queries, 5, shortlist_factor=3)
+
+    assert len(recording.rows_read) == 4 * 5 * 3
+    assert np.allclose(scores, np.einsum("qkd,qd->qk", matrix[rows], queries))
+    assert (np.diff(scores, axis=1) <= 0).all()
+
+
+def test_a_shortlist_covering_every_row_matches_exact_search():
+    matrix, queries = _data(rows=200)
+    quantized = QuantizedMatrix("int8")
+    quantized.extend(matrix)
+    excluded = np.zeros(200, dtype=bool)
+    excluded[::3] = True
+    rows = np.arange(50, 200)
+
+    exact_rows, _ = exact_top_k(matrix, queries, 5, rows=rows, excluded=excluded)
+    approx_rows, _ = quantized_top_k(matrix, quantized, queries, 5, shortlist_factor=200, rows=rows, excluded=excluded)
+
+    assert np.array_equal(approx_rows, exact_rows)
+    assert not excluded[approx_rows].any() and (approx_rows >= 50).all()
@@ -0,0 +1,131 @@
+import uuid
+import pytest
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+from core.fakes import DeterministicFakeEmbeddings, FlakyFakeEmbeddings
+from core.numpy_store import NumpyVectorStore
+from core.pdf_processor import assign_chunk_ids
+from core.persistent_index import PersistentIndex, open_persistent_index
+from core.shared_index import SharedDocumentIndex
+from core.vector_store import (
+    get_lexical_index, get_retriever_with_filter, index_documents, index_fingerprint, ingest_checkpoint_path,
+    list_indexed_documents, remove_source, sync_sources,
+)
+
+
+def _chunks(source, doc_hash="h" * 64, pages=3):
+    chunks = [
+        Document(page_content=f"page {page} part {part} of the manual", metadata={"source": source, "page": page})
+        for page in range(pages)
+        for part in range(2)
+    ]
+    return assign_chunk_ids(chunks, doc_hash)
+
+
+def _make_store(kind, embeddings, tmp_path):
+    if kind == "memory":
+        return NumpyVectorStore(embeddings)
+    if kind == "persistent":
+        return NumpyVectorStore(embeddings, PersistentIndex(str(tmp_path)))
+    if kind == "chroma":
+        return Chroma(collection_name=f"test-{uuid.uuid4().hex[:8]}", embedding_function=embeddings)
+    return SharedDocumentIndex().session_view(embeddings)
+
+
+@pytest.fixture(params=["memory", "persistent", "chroma", "shared"])
+def kind(request):
+    return request.param
+
+
+@pytest.fixture
+def store(kind, tmp_path):
+    return _make_store(kind, DeterministicFakeEmbeddings(size=16), tmp_path)
+
+
+def _count(store, source):
+    return len(store.get(where={"source": source}, include=[])["ids"])
+
+
+def test_identical_file_under_a_new_name_is_indexed_as_a_copy(store):
+    index_documents(store, _chunks("b.pdf"))
+    embedded = store.embeddings.embedded_texts
+
+    to_index, unchanged = index_documents(store, _chunks("c.pdf"))
+
+    assert (to_index, unchanged) == ([], ["c.pdf"])
+    assert store.embeddings.embedded_texts == embedded
+    assert list_indexed_documents(store) == ["b.pdf", "c.pdf"]
+    assert _count(store, "b.pdf") == 6 and _count(store, "c.pdf") == 6
+
+
+def test_removing_one_copy_keeps_the_other(store):
+    index_documents(store, _chunks("b.pdf"))
+    index_documents(store, _chunks("c.pdf"))
+
+    remove_source(store, "c.pdf")
+
+    assert list_indexed_documents(store) == ["b.pdf"]
+    assert _count(store, "b.pdf") == 6
+    hits = store.similarity_search("page 1 part 0 of the manual", k=2, filter={"source": "b.pdf"})
+    assert hits and all(doc.metadata["source"] == "b.pdf" for doc in hits)
+
+
+def test_partly_indexed_documents_are_resumed_not_skipped(kind, tmp_path):
+    store = _make_store(kind, FlakyFakeEmbeddings(size=16, fail_first=1, error_factory=ValueError), tmp_path)
+    chunks = _chunks("b.pdf")
+    options = dict(batch_size=2, max_in_flight=1, checkpoint_path=ingest_checkpoint_path(store, "b.pdf", "h" * 64, (0, 3)))
+
+    with pytest.raises(RuntimeError):
+        index_documents(store, chunks, **options)
+
+    assert sync_sources(store, {"b.pdf": "h" * 64}) == (["b.pdf"], [])
+    assert sync_sources(store, {"c.pdf": "h" * 64}) == (["c.pdf"], []) # Not copied from an incomplete document
+    embedded = store.embeddings.embedded_texts
+    assert index_documents(store, chunks, **options) == (["b.pdf"], [])
+    assert store.embeddings.embedded_texts - embedded == 2 # Only the failed batch
+    assert sync_sources(store, {"b.pdf": "h" * 64}) == ([], ["b.pdf"])
+    assert _count(store, "b.pdf") == 6
+
+
+def test_fingerprint_follows_writes_made_through_another_wrapper(tmp_path):
+    embeddings = DeterministicFakeEmbeddings(size=16)
+    name = f"test-{uuid.uuid4().hex[:8]}"
+    pairs = [
+        (NumpyVectorStore(embeddings, open_persistent_index(str(tmp_path))), NumpyVectorStore(embeddings, open_persistent_index(str(tmp_path)))),
+        (Chroma(collection_name=name, embedding_function=embeddings), Chroma(collection_name=name, embedding_function=embeddings)),
+    ]
+    for reader, writer in pairs:
+        index_documents(writer, _chunks("b.pdf"))
+        before = index_fingerprint(reader)
+
+        index_documents(writer, _chunks("c.pdf", doc_hash="c" * 64))
+        assert index_fingerprint(reader) != before
+        assert index_fingerprint(reader) == index_fingerprint(writer)
+
+        remove_source(writer, "c.pdf")
+        assert index_fingerprint(reader) == before
+
+
+@pytest.mark.parametrize("kind", ["memory", "persistent", "chroma"])
+def test_lexical_index_is_shared_by_wrappers_and_follows_deletes(kind, tmp_path):
+    embeddings = DeterministicFakeEmbeddings(size=16)
+    first = _make_store(kind, embeddings, tmp_path)
+    if kind == "chroma":
+        second = Chroma(collection_name=first._collection.name, embedding_function=embeddings)
+    else:
+        second = NumpyVectorStore(embeddings, first.index)
+    index_documents(first, _chunks("a.pdf", doc_hash="a" * 64))
+    index_documents(first, _chunks("b.pdf", doc_hash="b" * 64))
+    assert {doc.metadata["source"] for doc, _ in get_lexical_index(first).search("manual", k=20)} == {"a.pdf", "b.pdf"}
+
+    remove_source(second, "a.pdf")
+
+    retriever = get_retriever_with_filter(first, None, k_results=20, mode="hybrid")
+    assert {doc.metadata["source"] for doc in retriever.invoke("manual")} == {"b.pdf"}
+
+
+def test_dense_ingest_does_not_build_the_lexical_index(tmp_path):
+    store = NumpyVectorStore(DeterministicFakeEmbeddings(size=16), PersistentIndex(str(tmp_path)))
+    index_documents(store, _chunks("a.pdf"))
+
+    assert store.index._bm25 is None